@@ -8,27 +8,8 @@ from pathlib import Path
 import click
 from loguru import logger
 
-from plassembler.utils.assembly import run_flye, run_raven
-from plassembler.utils.bam import bam_to_fastq_short, sam_to_bam, split_bams
-from plassembler.utils.cleanup import move_and_copy_files, remove_intermediate_files
-from plassembler.utils.concat import concatenate_short_fastqs
-from plassembler.utils.db import check_db_installation
-from plassembler.utils.input_commands import (
-    check_dependencies,
-    validate_fastas_assembled_mode,
-    validate_fastq,
-    validate_fastqs_assembled_mode,
-    validate_pacbio_model,
-)
-from plassembler.utils.mapping import minimap_long_reads, minimap_short_reads
-
-# import classes
-from plassembler.utils.plass_class import Assembly, Plass
-from plassembler.utils.qc import chopper, copy_sr_fastq_file, fastp
-from plassembler.utils.run_mash import mash_sketch, run_mash
-from plassembler.utils.run_unicycler import run_unicycler
-from plassembler.utils.sam_to_fastq import extract_bin_long_fastqs
-from plassembler.utils.test_incompatibility import incompatbility
+# the pipeline modules are imported in the commands that use them,
+# so --help, citation and argument errors do not load pandas, pysam and Biopython
 from plassembler.utils.util import get_version, print_citation
 
 log_fmt = (
@@ -37,7 +18,7 @@ log_fmt = (
 )
 
 
-def begin_plassembler(outdir, force):
+def begin_plassembler(outdir, force, resume=False):
     """
     begins plassembler
     returns start time
@@ -48,8 +29,13 @@ def begin_plassembler(outdir, force):
     logger.add(lambda _: sys.exit(1), level="ERROR")
 
     # instantiate the outdir
+    # keep the existing outdir on resume
+    if resume is True and os.path.isdir(outdir) is True:
+        logger.info(
+            f"--resume was specified. Resuming in the existing directory {outdir}"
+        )
     # remove outdir on force
-    if force is True:
+    elif force is True:
         if os.path.isdir(outdir) is True:
             shutil.rmtree(outdir)
         else:
@@ -61,34 +47,540 @@ def begin_plassembler(outdir, force):
             logger.error(
                 f"Directory {outdir} already exists and force was not specified. Please specify -f or --force to overwrite {outdir}"
             )
-    # instantiate outdir
-    if os.path.isdir(outdir) is False:
-        os.mkdir(outdir)
+    # instantiate outdir
+    if os.path.isdir(outdir) is False:
+        os.mkdir(outdir)
+
+    # initial logging stuff
+    log_file = os.path.join(outdir, f"plassembler_{start_time}.log")
+    # adds log file
+    logger.add(log_file)
+    # ensure sys exit if error
+    logger.info(f"You are using Plassembler version {get_version()}")
+    logger.info("Repository homepage is https://github.com/gbouras13/plassembler")
+    logger.info("Written by George Bouras: george.bouras@adelaide.edu.au")
+
+    return start_time, outdir
+
+
+def end_plassembler(start_time):
+    """
+    finishes plassembler
+    """
+
+    # Determine elapsed time
+    elapsed_time = time.time() - start_time
+    elapsed_time = round(elapsed_time, 2)
+
+    # Show elapsed time for the process
+    logger.info("Plassembler has finished")
+    logger.info("Elapsed time: " + str(elapsed_time) + " seconds")
+
+
+def run_plassembler(
+    database,
+    longreads,
+    short_one,
+    short_two,
+    chromosome,
+    outdir,
+    min_length,
+    min_quality,
+    threads,
+    force,
+    resume,
+    prefix,
+    use_raven,
+    pacbio_model,
+    skip_qc,
+    raw_flag,
+    keep_fastqs,
+    keep_chromosome,
+    daemon=None,
+    skip_checks=False,
+):
+    """
+    runs plassembler on one isolate with long and short reads
+    daemon is the socket of a PLSDB daemon, or None to use the database directory
+    skip_checks skips the dependency and database checks already done by batch
+    """
+
+    from plassembler.utils.cleanup import move_and_copy_files, remove_intermediate_files
+    from plassembler.utils.db import check_db_installation
+    from plassembler.utils.input_commands import (
+        check_dependencies,
+        check_long_read_bases,
+        validate_fastq,
+        validate_pacbio_model,
+    )
+    from plassembler.utils.plass_class import Plass
+    from plassembler.utils.run_mash import calculate_mash_distances
+    from plassembler.utils.stages import (
+        StageGraph,
+        long_read_assembly_stage,
+        long_read_binning_stage,
+        long_read_qc_stage,
+        plsdb_stage,
+        short_read_binning_stage,
+        short_read_qc_stage,
+        unicycler_stage,
+    )
+    from plassembler.utils.test_incompatibility import incompatbility
+
+    # initiate plassembler
+    start_time, outdir = begin_plassembler(outdir, force, resume)
+    checkpoint_dir: Path = Path(outdir) / "checkpoints"
+
+    logger.info(f"Database directory is {database}")
+    logger.info(f"Longreads file is {longreads}")
+    logger.info(f"R1 fasta file is {short_one}")
+    logger.info(f"R2 fasta file is {short_two}")
+    logger.info(f"Chromosome length threshold is {chromosome}")
+    logger.info(f"Output directory is {outdir}")
+    logger.info(f"Min long read length is {min_length}")
+    logger.info(f"Min long read quality is {min_quality}")
+    logger.info(f"Thread count is {threads}")
+    logger.info(f"--force is {force}")
+    logger.info(f"--resume is {resume}")
+    logger.info(f"--skip_qc is {skip_qc}")
+    logger.info(f"--raw_flag is {raw_flag}")
+    logger.info(f"--pacbio_model is {pacbio_model}")
+    logger.info(f"--keep_fastqs is {keep_fastqs}")
+    logger.info(f"--keep_chromosome is {keep_chromosome}")
+    logger.info(f"--daemon is {daemon}")
+    logdir = Path(f"{outdir}/logs")
+
+    # batch has already checked the dependencies and database once
+    if skip_checks is False:
+        # check deps
+        logger.info("Checking dependencies")
+        check_dependencies()
+
+        # check the mash database is installed
+
+        logger.info("Checking database installation.")
+        check_db_installation(Path(database), install_flag=False)
+        # will only continue if successful
+        logger.info("Database successfully checked.")
+
+    # check fastqs
+    logger.info("Checking input fastqs.")
+
+    # check fastqs
+
+    long_zipped = validate_fastq(longreads, outdir)
+    s1_zipped = validate_fastq(short_one, outdir)
+    s2_zipped = validate_fastq(short_two, outdir)
+    check_long_read_bases(longreads, outdir, chromosome)
+
+    logger.info(f"FASTQ file {longreads} compression is {long_zipped}")
+    logger.info(f"FASTQ file {short_one} compression is {s1_zipped}")
+    logger.info(f"FASTQ file {short_two} compression is {s2_zipped}")
+
+    # pacbio model check that the string is valid if legit
+    if pacbio_model != "nothing":
+        pacbio_model = validate_pacbio_model(pacbio_model)
+
+    # qc and assembly - fastp runs alongside chopper and the assembly
+    qc_assembly = StageGraph(threads, checkpoint_dir, resume)
+    qc_assembly.add(
+        long_read_qc_stage(
+            longreads, outdir, min_length, min_quality, long_zipped, skip_qc, logdir
+        )
+    )
+    qc_assembly.add(short_read_qc_stage(short_one, short_two, outdir, skip_qc, logdir))
+    if use_raven is True:
+        logger.info(
+            "You have specified --use_raven. Using Raven for long read assembly."
+        )
+    qc_assembly.add(
+        long_read_assembly_stage(outdir, use_raven, raw_flag, pacbio_model, logdir)
+    )
+    qc_assembly.run()
+
+    # instanatiate the class with some of the commands
+    plass = Plass()
+    plass.outdir = outdir
+    plass.threads = threads
+    plass.long_only = False
+
+    # count contigs and add to the object
+    logger.info("Counting Contigs.")
+    plass.get_contig_count()
+
+    ####################################################################
+    # Case 1: only 1 contig -> no plasmids in the long read only assembly, attempt recovery with short reads
+    # Case 3: more than 1 contig -> get reads mapped to plasmids, unmapped to chromosome and assemble
+    # both are handled the same way from here
+    ####################################################################
+
+    plass.no_plasmids_flag = plass.contig_count == 1
+    assembler = "Raven" if use_raven is True else "Flye"
+    if plass.contig_count == 1:
+        logger.info(f"Only one contig was assembled with {assembler}.")
+    else:
+        logger.info(f"More than one contig was assembled with {assembler}.")
+        logger.info("Extracting Chromosome.")
+
+    # identifies chromosome and renames contigs
+    if use_raven is True:
+        plass.identify_chromosome_process_raven(chromosome)
+    else:
+        plass.identify_chromosome_process_flye(chromosome)
+
+    ####################################################################
+    # Case 2: no chromosome identified (likely below required depth) - cleanup and exit
+    ####################################################################
+    if plass.chromosome_flag is False:
+        move_and_copy_files(
+            outdir,
+            prefix,
+            False,  # unicycler success
+            keep_fastqs,
+            False,  # assembled mode
+            False,  # long only
+            use_raven,
+        )
+        remove_intermediate_files(
+            outdir,
+            keep_chromosome,
+            False,  # assembled mode
+            False,  # long only
+            use_raven,
+        )
+        end_plassembler(start_time)
+        message = "No chromosome was identified. Likely, there was insufficient long read depth to assemble a chromosome. \nIncreasing sequencing depth is recommended. \nAlso please check your -c or --chromosome parameter, it may be too high. "
+        logger.error(message)
+    else:  # chromosome identified -> move on
+        logger.info(
+            "Chromosome Identified. Plassembler will now use long and short reads to assemble plasmids accurately."
+        )
+
+        # long and short read binning and the PLSDB load are independent
+        binning = StageGraph(threads, checkpoint_dir, resume)
+        binning.add(long_read_binning_stage(outdir, pacbio_model, logdir))
+        binning.add(short_read_binning_stage(outdir, logdir))
+        binning.add(plsdb_stage(database, daemon))
+        binning.run()
+
+        # running unicycler
+        unicycler = StageGraph(threads, checkpoint_dir, resume)
+        unicycler.add(unicycler_stage(outdir, logdir))
+        unicycler.run()
+        unicycler_dir: Path = Path(outdir) / "unicycler_output"
+
+        # check for successful unicycler completion
+        plass.check_unicycler_success(unicycler_dir)
+
+        # if unicycler successfully finished, calculate the plasmid copy numbers
+        if plass.unicycler_success is True:
+            logger.info(
+                "Unicycler identified plasmids. Calculating Plasmid Copy Numbers."
+            )
+            # get depth
+            # as class so saves the depth dataframe nicely
+            plass.get_depth(logdir, pacbio_model, threads)
+
+            # run mash
+            logger.info("Calculating mash distances to PLSDB.")
+
+            # sketches the plasmids and runs mash
+            calculate_mash_distances(
+                outdir,
+                os.path.join(outdir, "unicycler_output", "assembly.fasta"),
+                database,
+                logdir,
+                daemon,
+            )
+            # processes output
+            plass.process_mash_tsv(database, daemon)
+            # combine depth and mash tsvs
+            plass.combine_depth_mash_tsvs(prefix)
+
+            # rename contigs and update copy bumber with plsdb
+            plass.finalise_contigs(prefix)
+
+            # heuristic check
+            incompatbility(plass.combined_depth_mash_df)
+
+            # cleanup files
+            move_and_copy_files(
+                outdir,
+                prefix,
+                True,  # unicycler success
+                keep_fastqs,
+                False,  # assembled mode
+                False,  # long only
+                use_raven,
+            )
+            remove_intermediate_files(
+                outdir,
+                keep_chromosome,
+                False,  # assembled mode
+                False,  # long only
+                use_raven,
+            )
+        elif plass.no_plasmids_flag is False:
+            # Case 3 where Unicycler recovered none of the plasmids in the long read assembly - keep the files for debugging
+            logger.error(
+                f"{assembler} assembled plasmid contigs, but Unicycler assembled no plasmids. "
+                f"Please check the Unicycler log files in {logdir}. Temporary files are preserved for debugging."
+            )
+
+            ####################################################################
+            # Case 4: where there are truly no plasmids even after unicycler runs
+            ####################################################################
+        else:  # unicycler did not successfully finish, just cleanup and touch the files empty for downstream (snakemake)
+            logger.info("No plasmids found.")
+            move_and_copy_files(
+                outdir,
+                prefix,
+                False,  # unicycler success
+                keep_fastqs,
+                False,  # assembled mode
+                False,  # long only
+                use_raven,
+            )
+            remove_intermediate_files(
+                outdir,
+                keep_chromosome,
+                False,  # assembled mode
+                False,  # long only
+                use_raven,
+            )
+
+    # end plassembler
+    end_plassembler(start_time)
+
+
+def run_plassembler_long(
+    database,
+    longreads,
+    chromosome,
+    outdir,
+    min_length,
+    min_quality,
+    threads,
+    force,
+    resume,
+    prefix,
+    use_raven,
+    pacbio_model,
+    skip_qc,
+    raw_flag,
+    keep_chromosome,
+    daemon=None,
+    skip_checks=False,
+):
+    """
+    runs plassembler on one isolate with long reads only
+    daemon is the socket of a PLSDB daemon, or None to use the database directory
+    skip_checks skips the dependency and database checks already done by batch
+    """
+
+    from plassembler.utils.cleanup import move_and_copy_files, remove_intermediate_files
+    from plassembler.utils.db import check_db_installation
+    from plassembler.utils.depth import DepthAccumulator, get_contig_lengths
+    from plassembler.utils.input_commands import (
+        check_dependencies,
+        check_long_read_bases,
+        validate_fastq,
+        validate_pacbio_model,
+    )
+    from plassembler.utils.plass_class import Plass
+    from plassembler.utils.run_mash import calculate_mash_distances
+    from plassembler.utils.stages import (
+        StageGraph,
+        long_read_assembly_stage,
+        long_read_binning_stage,
+        long_read_qc_stage,
+        plsdb_stage,
+    )
+
+    # start times
+    start_time, outdir = begin_plassembler(outdir, force, resume)
+    checkpoint_dir: Path = Path(outdir) / "checkpoints"
+
+    logger.info(f"Database directory is {database}")
+    logger.info(f"Longreads file is {longreads}")
+    logger.info(f"Chromosome length threshold is {chromosome}")
+    logger.info(f"Output directory is {outdir}")
+    logger.info(f"Min long read length is {min_length}")
+    logger.info(f"Min long read quality is {min_quality}")
+    logger.info(f"Thread count is {threads}")
+    logger.info(f"--force is {force}")
+    logger.info(f"--resume is {resume}")
+    logger.info(f"--skip_qc is {skip_qc}")
+    logger.info(f"--raw_flag is {raw_flag}")
+    logger.info(f"--pacbio_model is {pacbio_model}")
+    logger.info(f"--keep_chromosome is {keep_chromosome}")
+    logger.info(f"--daemon is {daemon}")
+    logdir = Path(f"{outdir}/logs")
+
+    # batch has already checked the dependencies and database once
+    if skip_checks is False:
+        # check deps
+        logger.info("Checking dependencies")
+        check_dependencies()
+
+        # check the mash database is installed
+        logger.info("Checking database installation.")
+        check_db_installation(Path(database), install_flag=False)
+        # will only continue if successful
+        logger.info("Database successfully checked.")
+
+    # check fastqs
+    logger.info("Checking input fastqs.")
+
+    # check fastqs
+    long_zipped = validate_fastq(longreads, outdir)
+    check_long_read_bases(longreads, outdir, chromosome)
+
+    # pacbio model check that the string is valid if legit
+    if pacbio_model != "nothing":
+        pacbio_model = validate_pacbio_model(pacbio_model)
+
+    # qc and assembly
+    qc_assembly = StageGraph(threads, checkpoint_dir, resume)
+    qc_assembly.add(
+        long_read_qc_stage(
+            longreads, outdir, min_length, min_quality, long_zipped, skip_qc, logdir
+        )
+    )
+    if use_raven is True:
+        logger.info(f"--use_raven is {use_raven}. Using Raven for long read assembly.")
+    qc_assembly.add(
+        long_read_assembly_stage(outdir, use_raven, raw_flag, pacbio_model, logdir)
+    )
+    qc_assembly.run()
+
+    # instanatiate the class with some of the commands
+    plass = Plass()
+    plass.outdir = outdir
+    plass.threads = threads
+    plass.long_only = True
+
+    # count contigs and add to the object
+    logger.info("Counting Contigs.")
+    plass.get_contig_count()
+
+    if use_raven is True:
+        plass.identify_chromosome_process_raven(chromosome)
+    else:
+        plass.identify_chromosome_process_flye(chromosome)
+
+    if plass.chromosome_flag is False:
+        move_and_copy_files(
+            outdir,
+            prefix,
+            False,  # unicycler success
+            False,  # keep fastqs
+            False,  # assembled mode
+            True,  # long only
+            use_raven,
+        )
+        remove_intermediate_files(
+            outdir,
+            keep_chromosome,
+            False,  # assembled mode
+            True,  # long only
+            use_raven,
+        )
+        message = "No chromosome was identified. Likely, there was insufficient long read depth to assemble a chromosome. \nIncreasing sequencing depth is recommended. \nAlso please check your -c or --chromosome parameter, it may be too high. "
+        logger.error(message)
+
+    else:
+        ####################################################################
+        # Only 1 contig
+        ####################################################################
+
+        if plass.contig_count == 1:
+            # chromosome identified but no plasmids - just finish
+            # end plassembler
+            move_and_copy_files(
+                outdir,
+                prefix,
+                False,  # unicycler success
+                False,  # keep fastqs
+                True,  # assembled mode
+                False,  # long only
+                use_raven,
+            )
+            remove_intermediate_files(
+                outdir,
+                keep_chromosome,
+                False,  # assembled mode
+                True,  # long only
+                use_raven,
+            )
+            logger.error("Chromosome identified but no plasmids.")
+
+        ####################################################################
+        # Multiple Contigs
+        ####################################################################
+
+        elif plass.contig_count > 1:
+            # no_plasmids_flag = False as obviously "plasmids"
+            plass.no_plasmids_flag = False
+
+            # binning accumulates long read depth in the same pass, alongside the PLSDB load
+            fasta: Path = Path(outdir) / "flye_renamed.fasta"
+            depth_accumulator = DepthAccumulator(get_contig_lengths(fasta))
+            binning = StageGraph(threads, checkpoint_dir, resume)
+            binning.add(
+                long_read_binning_stage(
+                    outdir, pacbio_model, logdir, depth_accumulator=depth_accumulator
+                )
+            )
+            binning.add(plsdb_stage(database, daemon))
+            binning.run()
+            # a binning skipped by --resume accumulated nothing - get_depth_long remaps
+            if "long_read_binning" not in binning.skipped:
+                plass.set_long_depths(depth_accumulator.get_depths(), fasta)
+            plass.get_depth_long(logdir, pacbio_model, threads)
+
+            # run mash
+            logger.info("Calculating mash distances to PLSDB.")
+
+            # sketches the plasmids and runs mash
+            calculate_mash_distances(
+                outdir,
+                os.path.join(outdir, "plasmids_initial.fasta"),
+                database,
+                logdir,
+                daemon,
+            )
 
-    # initial logging stuff
-    log_file = os.path.join(outdir, f"plassembler_{start_time}.log")
-    # adds log file
-    logger.add(log_file)
-    # ensure sys exit if error
-    logger.info(f"You are using Plassembler version {get_version()}")
-    logger.info("Repository homepage is https://github.com/gbouras13/plassembler")
-    logger.info("Written by George Bouras: george.bouras@adelaide.edu.au")
+            # processes output
+            plass.process_mash_tsv(database, daemon)
 
-    return start_time, outdir
+            # combine depth and mash tsvs
+            plass.combine_depth_mash_tsvs(prefix)
 
+            # rename contigs and update copy bumber with plsdb
+            plass.finalise_contigs_long(prefix)
 
-def end_plassembler(start_time):
-    """
-    finishes plassembler
-    """
+            # cleanup files
+            move_and_copy_files(
+                outdir,
+                prefix,
+                False,  # unicycler success
+                False,  # keep fastqs
+                False,  # assembled mode
+                True,  # long only
+                use_raven,
+            )
 
-    # Determine elapsed time
-    elapsed_time = time.time() - start_time
-    elapsed_time = round(elapsed_time, 2)
+            remove_intermediate_files(
+                outdir,
+                keep_chromosome,
+                False,  # assembled mode
+                True,  # long only
+                use_raven,
+            )
 
-    # Show elapsed time for the process
-    logger.info("Plassembler has finished")
-    logger.info("Elapsed time: " + str(elapsed_time) + " seconds")
+    # end plassembler
+    end_plassembler(start_time)
 
 
 def run_options(func):
@@ -220,6 +712,11 @@ def common_options(func):
         click.option(
             "-f", "--force", is_flag=True, help="Force overwrites the output directory."
         ),
+        click.option(
+            "--resume",
+            is_flag=True,
+            help="Resumes an interrupted run in the existing output directory, \nskipping stages that already completed.",
+        ),
         click.option(
             "-p",
             "--prefix",
@@ -229,6 +726,11 @@ def common_options(func):
             show_default=True,
         ),
         click.option("--skip_qc", is_flag=True, help="Skips qc (chopper and fastp)."),
+        click.option(
+            "--daemon",
+            help="Unix socket of a running plassembler serve daemon to query PLSDB with. \nFalls back to the database directory when no daemon is running.",
+            type=click.Path(),
+        ),
         click.option(
             "--pacbio_model",
             help="Pacbio model for Flye. \nMust be one of pacbio-raw, pacbio-corr or pacbio-hifi. \nUse pacbio-raw for PacBio regular CLR reads (<20 percent error), pacbio-corr for PacBio reads that were corrected with other methods (<3 percent error) or pacbio-hifi for PacBio HiFi reads (<1 percent error).",
@@ -295,419 +797,39 @@ def run(
     min_quality,
     threads,
     force,
-    prefix,
-    use_raven,
-    pacbio_model,
-    skip_qc,
-    raw_flag,
-    keep_fastqs,
-    keep_chromosome,
-    **kwargs,
-):
-    """Runs Plassembler"""
-
-    # initiate plassembler
-    start_time, outdir = begin_plassembler(outdir, force)
-
-    logger.info(f"Database directory is {database}")
-    logger.info(f"Longreads file is {longreads}")
-    logger.info(f"R1 fasta file is {short_one}")
-    logger.info(f"R2 fasta file is {short_two}")
-    logger.info(f"Chromosome length threshold is {chromosome}")
-    logger.info(f"Output directory is {outdir}")
-    logger.info(f"Min long read length is {min_length}")
-    logger.info(f"Min long read quality is {min_quality}")
-    logger.info(f"Thread count is {threads}")
-    logger.info(f"--force is {force}")
-    logger.info(f"--skip_qc is {skip_qc}")
-    logger.info(f"--raw_flag is {raw_flag}")
-    logger.info(f"--pacbio_model is {pacbio_model}")
-    logger.info(f"--keep_fastqs is {keep_fastqs}")
-    logger.info(f"--keep_chromosome is {keep_chromosome}")
-    logdir = Path(f"{outdir}/logs")
-
-    # check deps
-    logger.info("Checking dependencies")
-    check_dependencies()
-
-    # check the mash database is installed
-
-    logger.info("Checking database installation.")
-    check_db_installation(Path(database), install_flag=False)
-    # will only continue if successful
-    logger.info("Database successfully checked.")
-
-    # check fastqs
-    logger.info("Checking input fastqs.")
-
-    # check fastqs
-
-    long_zipped = validate_fastq(longreads)
-    s1_zipped = validate_fastq(short_one)
-    s2_zipped = validate_fastq(short_two)
-
-    logger.info(f"FASTQ file {longreads} compression is {long_zipped}")
-    logger.info(f"FASTQ file {short_one} compression is {s1_zipped}")
-    logger.info(f"FASTQ file {short_two} compression is {s2_zipped}")
-
-    # pacbio model check that the string is valid if legit
-    if pacbio_model != "nothing":
-        pacbio_model = validate_pacbio_model(pacbio_model)
-
-    if skip_qc is False:
-        # filtering long readfastq
-        logger.info("Filtering long reads with chopper")
-        chopper(  # due to the stdin side of this, just implement the class maually in py
-            longreads, outdir, min_length, min_quality, long_zipped, threads, logdir
-        )
-
-    else:  # copy the input to the outdir
-        shutil.copy2(
-            longreads,
-            Path(f"{outdir}/chopper_long_reads.fastq.gz"),
-        )
-
-    # Raven for long only or '--use_raven'
-    if use_raven is True:
-        logger.info(
-            "You have specified --use_raven. Using Raven for long read assembly."
-        )
-        logger.info("Running Raven.")
-        run_raven(outdir, threads, logdir)
-    else:
-        logger.info("Running Flye.")
-        run_flye(outdir, threads, raw_flag, pacbio_model, logdir)
-
-    # instanatiate the class with some of the commands
-    plass = Plass()
-    plass.outdir = outdir
-    plass.threads = threads
-    plass.long_only = False
-
-    # count contigs and add to the object
-    logger.info("Counting Contigs.")
-    plass.get_contig_count()
-
-    ####################################################################
-    # Case 1: where there is only 1 contig -> means that chromosome was assembled, no plasmids in the long read only assembly, and  attempt recovery with short reads
-    ####################################################################
-
-    if plass.contig_count == 1:
-        # no_plasmids_flag = True as no plasmids
-        plass.no_plasmids_flag = True
-
-        # identifies chromosome and renames contigs
-        if use_raven is True:
-            logger.info("Only one contig was assembled with Raven.")
-            plass.identify_chromosome_process_raven(chromosome)
-        else:
-            logger.info("Only one contig was assembled with Flye.")
-            plass.identify_chromosome_process_flye(chromosome)
-
-        #################################################
-        # no chromosome identified - cleanup and exit
-        ####################################################################
-        if plass.chromosome_flag is False:
-            move_and_copy_files(
-                outdir,
-                prefix,
-                False,  # unicycler success
-                keep_fastqs,
-                False,  # assembled mode
-                False,  # long only
-                use_raven,
-            )
-            remove_intermediate_files(
-                outdir,
-                keep_chromosome,
-                False,  # assembled mode
-                False,  # long only
-                use_raven,
-            )
-            message = "No chromosome was identified. Likely, there was insufficient long read depth to assemble a chromosome. \nIncreasing sequencing depth is recommended. \nAlso please check your -c or --chromosome parameter, it may be too high. "
-            logger.error(message)
-        else:  # chromosome identified -> move on
-            logger.info(
-                "Chromosome Identified. Plassembler will now use long and short reads to assemble plasmids accurately."
-            )
-
-            if skip_qc is True:  # copy the input to the outdir
-                logger.info("Skipping short read trimming as --skip_qc was specified")
-                out_one: Path = Path(outdir) / "trimmed_R1.fastq"
-                out_two: Path = Path(outdir) / "trimmed_R2.fastq"
-                copy_sr_fastq_file(Path(short_one), out_one)
-                copy_sr_fastq_file(Path(short_two), out_two)
-            else:
-                logger.info("Trimming short reads.")
-                fastp(short_one, short_two, outdir, logdir)
-
-            logger.info("Mapping long reads.")
-            input_long_reads: Path = Path(outdir) / "chopper_long_reads.fastq.gz"
-            fasta: Path = Path(outdir) / "flye_renamed.fasta"
-            sam: Path = Path(outdir) / "long_read.sam"
-            minimap_long_reads(
-                input_long_reads, fasta, sam, threads, pacbio_model, logdir
-            )
-
-            # short reads mapping
-            samfile: Path = Path(outdir) / "short_read.sam"
-            r1: Path = Path(outdir) / "trimmed_R1.fastq"
-            r2: Path = Path(outdir) / "trimmed_R2.fastq"
-            logger.info("Mapping short reads.")
-            minimap_short_reads(r1, r2, fasta, samfile, threads, logdir)
-
-            # for long, custom function is quick enough
-            logger.info("Processing Sam/Bam Files and extracting Fastqs.")
-            extract_bin_long_fastqs(outdir)
-
-            # for short, too slow so use samtools
-            samfile: Path = Path(outdir) / "short_read.sam"
-            bamfile: Path = Path(outdir) / "short_read.bam"
-            sam_to_bam(samfile, bamfile, threads, logdir)
-            split_bams(outdir, threads, logdir)
-            bam_to_fastq_short(outdir, threads, logdir)
-            concatenate_short_fastqs(outdir)
-
-            # running unicycler
-            logger.info("Running Unicycler.")
-            long_reads: Path = Path(outdir) / "plasmid_long.fastq"
-            short_r1: Path = Path(outdir) / "short_read_concat_R1.fastq"
-            short_r2: Path = Path(outdir) / "short_read_concat_R2.fastq"
-            unicycler_dir: Path = Path(outdir) / "unicycler_output"
-
-            run_unicycler(
-                threads, logdir, short_r1, short_r2, long_reads, unicycler_dir
-            )
-
-            # check for successful unicycler completion
-            plass.check_unicycler_success(unicycler_dir)
-
-            # if unicycler successfully finished, calculate the plasmid copy numbers
-            if plass.unicycler_success is True:
-                logger.info(
-                    "Unicycler identified plasmids. Calculating Plasmid Copy Numbers."
-                )
-                # get depth
-                # as class so saves the depth dataframe nicely
-                plass.get_depth(logdir, pacbio_model, threads)
-
-                # run mash
-                logger.info("Calculating mash distances to PLSDB.")
-
-                # mash sketches the plasmids
-                mash_sketch(
-                    outdir,
-                    os.path.join(outdir, "unicycler_output", "assembly.fasta"),
-                    logdir,
-                )
-                # runs mash
-                run_mash(outdir, database, logdir)
-                # processes output
-                plass.process_mash_tsv(database)
-                # combine depth and mash tsvs
-                plass.combine_depth_mash_tsvs(prefix)
-
-                # rename contigs and update copy bumber with plsdb
-                plass.finalise_contigs(prefix)
-
-                # heuristic check
-                incompatbility(plass.combined_depth_mash_df)
-
-                # cleanup files
-                move_and_copy_files(
-                    outdir,
-                    prefix,
-                    True,  # unicycler success
-                    keep_fastqs,
-                    False,  # assembled mode
-                    False,  # long only
-                    use_raven,
-                )
-                remove_intermediate_files(
-                    outdir,
-                    keep_chromosome,
-                    False,  # assembled mode
-                    False,  # long only
-                    use_raven,
-                )
-
-                ####################################################################
-                # Case 4: where there are truly no plasmids even after unicycler runs
-                ####################################################################
-            else:  # unicycler did not successfully finish, just cleanup and touch the files empty for downstream (snakemake)
-                logger.info("No plasmids found.")
-                move_and_copy_files(
-                    outdir,
-                    prefix,
-                    False,  # unicycler success
-                    keep_fastqs,
-                    False,  # assembled mode
-                    False,  # long only
-                    use_raven,
-                )
-                remove_intermediate_files(
-                    outdir,
-                    keep_chromosome,
-                    False,  # assembled mode
-                    False,  # long only
-                    use_raven,
-                )
-
-    ####################################################################
-    # where more than 1 contig was assembled
-    ####################################################################
-    else:
-        # no_plasmids_flag = False as no plasmids
-        plass.no_plasmids_flag = False
-
-        # identifies chromosome and renames contigs
-        # just keep Flye as placeholder experimental for now for long read only
-        if use_raven is True:
-            logger.info("More than one contig was assembled with Raven.")
-            logger.info("Extracting Chromosome.")
-            plass.identify_chromosome_process_raven(chromosome)
-        else:
-            logger.info("More than one contig was assembled with Flye.")
-            logger.info("Extracting Chromosome.")
-            plass.identify_chromosome_process_flye(chromosome)
-
-        ####################################################################
-        # Case 2 - where no chromosome was identified (likely below required depth) - need more long reads or user got chromosome parameter wrong - exit plassembler
-        ####################################################################
-        if plass.chromosome_flag is False:
-            move_and_copy_files(
-                outdir,
-                prefix,
-                False,  # unicycler success
-                keep_fastqs,
-                False,  # assembled
-                False,  # long only
-                use_raven,
-            )
-            remove_intermediate_files(
-                outdir,
-                keep_chromosome,
-                False,  # assembled mode
-                False,  # long only
-                use_raven,
-            )
-
-            end_plassembler(start_time)
-            logger.error(
-                "No chromosome was idenfitied. please check your -c or --chromosome parameter, it may be too high. \nLikely, there was insufficient long read depth to assemble a chromosome. Increasing sequencing depth is recommended."
-            )
-
-        ####################################################################
-        # Case 3 - where a chromosome and plasmids were identified in the Flye assembly -> get reads mappeed to plasmids, unmapped to chromosome and assemble
-        ####################################################################
-        else:
-            message = "Chromosome Identified. Plassembler will now use long and short reads to assemble plasmids accurately."
-            logger.info(message)
-
-            logger.info("Mapping long reads.")
-            input_long_reads: Path = Path(outdir) / "chopper_long_reads.fastq.gz"
-            fasta: Path = Path(outdir) / "flye_renamed.fasta"
-            sam_file: Path = Path(outdir) / "long_read.sam"
-            minimap_long_reads(
-                input_long_reads, fasta, sam_file, threads, pacbio_model, logdir
-            )
-
-            if skip_qc is True:  # copy the input to the outdir
-                logger.info(f"Skipping short read trimming as --skip_qc is {skip_qc}")
-                out_one: Path = Path(outdir) / "trimmed_R1.fastq"
-                out_two: Path = Path(outdir) / "trimmed_R2.fastq"
-                copy_sr_fastq_file(Path(short_one), out_one)
-                copy_sr_fastq_file(Path(short_two), out_two)
-            else:
-                logger.info("Trimming short reads.")
-                fastp(short_one, short_two, outdir, logdir)
-
-            # short reads mapping
-            logger.info("Mapping short reads.")
-            samfile: Path = Path(outdir) / "short_read.sam"
-            r1: Path = Path(outdir) / "trimmed_R1.fastq"
-            r2: Path = Path(outdir) / "trimmed_R2.fastq"
-            minimap_short_reads(r1, r2, fasta, samfile, threads, logdir)
-
-            # for long, custom function is quick enough
-            logger.info("Processing Sam/Bam Files and extracting Fastqs.")
-            extract_bin_long_fastqs(outdir)
-
-            # for short, too slow so use samtools
-            samfile: Path = Path(outdir) / "short_read.sam"
-            bamfile: Path = Path(outdir) / "short_read.bam"
-            sam_to_bam(samfile, bamfile, threads, logdir)
-            split_bams(outdir, threads, logdir)
-            bam_to_fastq_short(outdir, threads, logdir)
-            concatenate_short_fastqs(outdir)
-
-            # running unicycler
-            logger.info("Running Unicycler.")
-            long_reads: Path = Path(outdir) / "plasmid_long.fastq"
-            short_r1: Path = Path(outdir) / "short_read_concat_R1.fastq"
-            short_r2: Path = Path(outdir) / "short_read_concat_R2.fastq"
-            unicycler_dir: Path = Path(outdir) / "unicycler_output"
-
-            run_unicycler(
-                threads, logdir, short_r1, short_r2, long_reads, unicycler_dir
-            )
-
-            # check for successful unicycler completion
-            plass.check_unicycler_success(unicycler_dir)
-
-            ####################################################################
-            # get copy number depths
-            ####################################################################
-
-            logger.info(
-                "Unicycler identified plasmids. Calculating Plasmid Copy Numbers."
-            )
-            # get depth
-            # as class so saves the depth dataframe nicely
-            plass.get_depth(logdir, pacbio_model, threads)
-
-            # run mash
-            logger.info("Calculating mash distances to PLSDB.")
-
-            # mash sketches the plasmids
-            mash_sketch(
-                outdir,
-                os.path.join(outdir, "unicycler_output", "assembly.fasta"),
-                logdir,
-            )
-            # runs mash
-            run_mash(outdir, database, logdir)
-            # processes output
-            plass.process_mash_tsv(database)
-            # combine depth and mash tsvs
-            plass.combine_depth_mash_tsvs(prefix)
-
-            # rename contigs and update copy bumber with plsdb
-            plass.finalise_contigs(prefix)
-
-            # heuristic check
-            incompatbility(plass.combined_depth_mash_df)
-
-            # cleanup files
-            move_and_copy_files(
-                outdir,
-                prefix,
-                True,  # unicycler success
-                keep_fastqs,
-                False,  # assembled mode
-                False,  # long only
-                use_raven,
-            )
-            remove_intermediate_files(
-                outdir,
-                keep_chromosome,
-                False,  # assembled mode
-                False,  # long only
-                use_raven,
-            )
-
-    # end plassembler
-    end_plassembler(start_time)
+    resume,
+    prefix,
+    use_raven,
+    pacbio_model,
+    skip_qc,
+    raw_flag,
+    keep_fastqs,
+    keep_chromosome,
+    daemon,
+    **kwargs,
+):
+    """Runs Plassembler"""
+    run_plassembler(
+        database,
+        longreads,
+        short_one,
+        short_two,
+        chromosome,
+        outdir,
+        min_length,
+        min_quality,
+        threads,
+        force,
+        resume,
+        prefix,
+        use_raven,
+        pacbio_model,
+        skip_qc,
+        raw_flag,
+        keep_fastqs,
+        keep_chromosome,
+        daemon,
+    )
 
 
 """
@@ -747,17 +869,37 @@ def assembled(
     min_quality,
     threads,
     force,
+    resume,
     prefix,
     skip_qc,
     input_chromosome,
     input_plasmids,
     pacbio_model,
+    daemon,
     **kwargs,
 ):
     """Runs assembled mode"""
 
+    from plassembler.utils.cleanup import move_and_copy_files, remove_intermediate_files
+    from plassembler.utils.db import check_db_installation
+    from plassembler.utils.input_commands import (
+        check_dependencies,
+        validate_fastas_assembled_mode,
+        validate_fastqs_assembled_mode,
+        validate_pacbio_model,
+    )
+    from plassembler.utils.plass_class import Assembly
+    from plassembler.utils.run_mash import calculate_mash_distances
+    from plassembler.utils.stages import (
+        StageGraph,
+        long_read_qc_stage,
+        plsdb_stage,
+        short_read_qc_stage,
+    )
+
     # start times
-    start_time, outdir = begin_plassembler(outdir, force)
+    start_time, outdir = begin_plassembler(outdir, force, resume)
+    checkpoint_dir: Path = Path(outdir) / "checkpoints"
 
     logger.info(f"Database directory is {database}")
     logger.info(f"Longreads file is {longreads}")
@@ -768,8 +910,10 @@ def assembled(
     logger.info(f"Min long read length is {min_length}")
     logger.info(f"Min long read quality is {min_quality}")
     logger.info(f"Thread count is {threads}")
+    logger.info(f"--resume is {resume}")
     logger.info(f"--skip_qc is {skip_qc}")
     logger.info(f"--pacbio_model is {pacbio_model}")
+    logger.info(f"--daemon is {daemon}")
     logdir = Path(f"{outdir}/logs")
 
     # check deps
@@ -800,37 +944,25 @@ def assembled(
     logger.info("Checking input fastqs.")
 
     (short_flag, long_flag, long_zipped) = validate_fastqs_assembled_mode(
-        longreads, short_one, short_two
+        longreads, short_one, short_two, outdir
     )
 
     # assign the flags to object
     assembly.short_flag = short_flag
     assembly.long_flag = long_flag
 
-    # filtering long readfastq
+    # long and short read qc and the PLSDB load are independent
+    qc = StageGraph(threads, checkpoint_dir, resume)
     if long_flag is True:
-        if skip_qc is False:
-            logger.info("Filtering long reads with chopper")
-            chopper(  # due to the stdin side of this, just implement the class maually in py
-                longreads, outdir, min_length, min_quality, long_zipped, threads, logdir
+        qc.add(
+            long_read_qc_stage(
+                longreads, outdir, min_length, min_quality, long_zipped, skip_qc, logdir
             )
-
-        else:  # copy the input to the outdir
-            shutil.copy2(
-                longreads,
-                Path(f"{outdir}/chopper_long_reads.fastq.gz"),
-            )
-
+        )
     if short_flag is True:
-        if skip_qc is True:  # copy the input to the outdir
-            logger.info("Skipping short read trimming as --skip_qc was specified")
-            out_one: Path = Path(outdir) / "trimmed_R1.fastq"
-            out_two: Path = Path(outdir) / "trimmed_R2.fastq"
-            copy_sr_fastq_file(Path(short_one), out_one)
-            copy_sr_fastq_file(Path(short_two), out_two)
-        else:
-            logger.info("Trimming short reads.")
-            fastp(short_one, short_two, outdir, logdir)
+        qc.add(short_read_qc_stage(short_one, short_two, outdir, skip_qc, logdir))
+    qc.add(plsdb_stage(database, daemon))
+    qc.run()
 
     logger.info("Calculating Depths.")
     assembly.combine_input_fastas(Path(input_chromosome), Path(input_plasmids))
@@ -839,16 +971,16 @@ def assembled(
     # run mash
     logger.info("Calculating mash distances to PLSDB.")
 
-    # mash sketches the plasmids
-    mash_sketch(
+    # sketches the plasmids and runs mash
+    calculate_mash_distances(
         outdir,
         Path(input_plasmids),
+        database,
         logdir,
+        daemon,
     )
-    # runs mash
-    run_mash(outdir, database, logdir)
     # processes output
-    assembly.process_mash_tsv(database, input_plasmids)
+    assembly.process_mash_tsv(database, input_plasmids, daemon)
     # combine depth and mash tsvs
     assembly.combine_depth_mash_tsvs(prefix)
 
@@ -896,12 +1028,66 @@ download
 def download(ctx, database, force, **kwargs):
     """Downloads Plassembler DB"""
 
+    from plassembler.utils.db import check_db_installation
+
     logger.add(lambda _: sys.exit(1), level="ERROR")
     database = Path(database)
     logger.info(f"Checking database installation at {database}")
     check_db_installation(database, install_flag=True)  # t
 
 
+"""
+serve
+"""
+
+
+@main_cli.command()
+@click.help_option("--help", "-h")
+@click.version_option(get_version(), "--version", "-V")
+@click.pass_context
+@click.option(
+    "-d",
+    "--database",
+    help="Directory of PLSDB database.",
+    type=click.Path(),
+    required=True,
+)
+@click.option(
+    "-s",
+    "--socket",
+    help="Unix socket to listen on. Defaults to plsdb_daemon.sock in the database directory.",
+    type=click.Path(),
+)
+@click.option("--stop", is_flag=True, help="Stops the daemon listening on the socket.")
+def serve(ctx, database, socket, stop, **kwargs):
+    """Serves PLSDB queries from memory to run, long, assembled and batch with --daemon"""
+
+    from plassembler.utils.daemon import (
+        PlsdbDaemon,
+        get_daemon_socket,
+        ping_plsdb_daemon,
+        stop_plsdb_daemon,
+    )
+    from plassembler.utils.db import check_db_installation
+
+    logger.add(lambda _: sys.exit(1), level="ERROR")
+    socket = get_daemon_socket(database, socket)
+    if stop:
+        if stop_plsdb_daemon(socket, database):
+            logger.info(f"Stopped the PLSDB daemon on {socket}")
+        else:
+            logger.warning(f"No PLSDB daemon was running on {socket}")
+        return
+
+    if ping_plsdb_daemon(socket, database) is not None:
+        logger.error(f"A PLSDB daemon is already listening on {socket}.")
+    logger.info("Checking database installation.")
+    check_db_installation(Path(database), install_flag=False)
+    daemon = PlsdbDaemon(database, socket)
+    daemon.load()
+    daemon.serve()
+
+
 """
 long only
 """
@@ -969,6 +1155,11 @@ def long_options(func):
         click.option(
             "-f", "--force", is_flag=True, help="Force overwrites the output directory."
         ),
+        click.option(
+            "--resume",
+            is_flag=True,
+            help="Resumes an interrupted run in the existing output directory, \nskipping stages that already completed.",
+        ),
         click.option(
             "-p",
             "--prefix",
@@ -978,6 +1169,11 @@ def long_options(func):
             show_default=True,
         ),
         click.option("--skip_qc", is_flag=True, help="Skips qc (chopper and fastp)."),
+        click.option(
+            "--daemon",
+            help="Unix socket of a running plassembler serve daemon to query PLSDB with. \nFalls back to the database directory when no daemon is running.",
+            type=click.Path(),
+        ),
         click.option(
             "--pacbio_model",
             help="Pacbio model for Flye. \nMust be one of pacbio-raw, pacbio-corr or pacbio-hifi. \nUse pacbio-raw for PacBio regular CLR reads (<20 percent error), pacbio-corr for PacBio reads that were corrected with other methods (<3 percent error) or pacbio-hifi for PacBio HiFi reads (<1 percent error).",
@@ -1021,197 +1217,220 @@ def long(
     min_quality,
     threads,
     force,
+    resume,
     prefix,
     use_raven,
     pacbio_model,
     skip_qc,
     raw_flag,
     keep_chromosome,
+    daemon,
     **kwargs,
 ):
     """
     Plassembler with long reads only - experimental and untested
     """
+    run_plassembler_long(
+        database,
+        longreads,
+        chromosome,
+        outdir,
+        min_length,
+        min_quality,
+        threads,
+        force,
+        resume,
+        prefix,
+        use_raven,
+        pacbio_model,
+        skip_qc,
+        raw_flag,
+        keep_chromosome,
+        daemon,
+    )
 
-    # start times
-    start_time, outdir = begin_plassembler(outdir, force)
+
+"""
+batch
+"""
+
+
+@main_cli.command()
+@click.help_option("--help", "-h")
+@click.version_option(get_version(), "--version", "-V")
+@click.pass_context
+@click.option(
+    "-d",
+    "--database",
+    help="Directory of PLSDB database.",
+    type=click.Path(),
+    required=True,
+)
+@click.option(
+    "-s",
+    "--sample_sheet",
+    help="Tab separated sample sheet with the columns sample, longreads, short_one and short_two. \nSamples without short reads are run in long only mode.",
+    type=click.Path(),
+    required=True,
+)
+@common_options
+@click.option(
+    "--threads_per_sample",
+    help="Threads wanted by each sample. \nSamples run concurrently within the -t/--threads budget.",
+    type=int,
+    default=8,
+    show_default=True,
+)
+@click.option(
+    "--memory",
+    help="Total memory budget in GB. Defaults to the physical memory.",
+    type=float,
+)
+@click.option(
+    "--memory_per_sample",
+    help="Peak memory expected per sample in GB. \nLimits the number of samples run concurrently within --memory.",
+    type=float,
+    default=8,
+    show_default=True,
+)
+@click.option(
+    "-r",
+    "--raw_flag",
+    help="Use --nano-raw for Flye. \nDesigned for Guppy fast configuration reads. \nBy default, Flye will assume SUP or HAC reads and use --nano-hq.",
+    is_flag=True,
+)
+@click.option(
+    "--keep_fastqs",
+    help="Whether you want to keep FASTQ files containing putative plasmid reads \nand long reads that map to multiple contigs (plasmid and chromosome).",
+    is_flag=True,
+)
+@click.option(
+    "--keep_chromosome",
+    help="If you want to keep the chromosome assembly.",
+    is_flag=True,
+)
+@click.option(
+    "--use_raven",
+    help="Uses Raven instead of Flye for long read assembly. \nMay be useful if you want to reduce runtime.",
+    is_flag=True,
+)
+def batch(
+    ctx,
+    database,
+    sample_sheet,
+    chromosome,
+    outdir,
+    min_length,
+    min_quality,
+    threads,
+    force,
+    resume,
+    prefix,
+    pacbio_model,
+    skip_qc,
+    threads_per_sample,
+    memory,
+    memory_per_sample,
+    raw_flag,
+    keep_fastqs,
+    keep_chromosome,
+    use_raven,
+    daemon,
+    **kwargs,
+):
+    """Runs Plassembler on many isolates from a sample sheet"""
+
+    from plassembler.utils.batch import (
+        get_batch_workers,
+        get_total_memory,
+        read_sample_sheet,
+        run_batch,
+        write_batch_summary,
+    )
+    from plassembler.utils.daemon import ping_plsdb_daemon
+    from plassembler.utils.db import check_db_installation
+    from plassembler.utils.input_commands import (
+        check_dependencies,
+        validate_pacbio_model,
+    )
+    from plassembler.utils.plsdb import preload_plsdb_metadata
+
+    start_time, outdir = begin_plassembler(outdir, force, resume)
 
     logger.info(f"Database directory is {database}")
-    logger.info(f"Longreads file is {longreads}")
-    logger.info(f"Chromosome length threshold is {chromosome}")
+    logger.info(f"Sample sheet is {sample_sheet}")
     logger.info(f"Output directory is {outdir}")
-    logger.info(f"Min long read length is {min_length}")
-    logger.info(f"Min long read quality is {min_quality}")
     logger.info(f"Thread count is {threads}")
-    logger.info(f"--force is {force}")
-    logger.info(f"--skip_qc is {skip_qc}")
-    logger.info(f"--raw_flag is {raw_flag}")
-    logger.info(f"--pacbio_model is {pacbio_model}")
-    logger.info(f"--keep_chromosome is {keep_chromosome}")
-    logdir = Path(f"{outdir}/logs")
+    logger.info(f"--resume is {resume}")
+    logger.info(f"--daemon is {daemon}")
 
-    # check deps
+    samples = read_sample_sheet(sample_sheet)
+
+    # checked once for all samples
     logger.info("Checking dependencies")
     check_dependencies()
-
-    # check the mash database is installed
     logger.info("Checking database installation.")
     check_db_installation(Path(database), install_flag=False)
-    # will only continue if successful
     logger.info("Database successfully checked.")
 
-    # check fastqs
-    logger.info("Checking input fastqs.")
-
-    # check fastqs
-    long_zipped = validate_fastq(longreads)
-
-    # pacbio model check that the string is valid if legit
     if pacbio_model != "nothing":
         pacbio_model = validate_pacbio_model(pacbio_model)
 
-    if skip_qc is False:
-        # filtering long readfastq
-        logger.info("Filtering long reads with chopper")
-        chopper(  # due to the stdin side of this, just implement the class maually in py
-            longreads, outdir, min_length, min_quality, long_zipped, threads, logdir
-        )
-
-    else:  # copy the input to the outdir
-        shutil.copy2(
-            longreads,
-            Path(f"{outdir}/chopper_long_reads.fastq.gz"),
-        )
-
-    # Raven for long only or '--use_raven'
-    if use_raven is True:
-        logger.info(f"--use_raven is {use_raven}. Using Raven for long read assembly.")
-        logger.info("Running Raven.")
-        run_raven(outdir, threads, logdir)
-    else:
-        logger.info("Running Flye.")
-        run_flye(outdir, threads, raw_flag, pacbio_model, logdir)
-
-    # instanatiate the class with some of the commands
-    plass = Plass()
-    plass.outdir = outdir
-    plass.threads = threads
-    plass.long_only = True
-
-    # count contigs and add to the object
-    logger.info("Counting Contigs.")
-    plass.get_contig_count()
+    # without the indexed store plsdb.tsv is read once here - the forked workers share it
+    if ping_plsdb_daemon(daemon, database) is None:
+        preload_plsdb_metadata(database)
 
-    if use_raven is True:
-        plass.identify_chromosome_process_raven(chromosome)
-    else:
-        plass.identify_chromosome_process_flye(chromosome)
+    if memory is None:
+        memory = get_total_memory()
+    workers, sample_threads = get_batch_workers(
+        len(samples), int(threads), threads_per_sample, memory, memory_per_sample
+    )
+    logger.info(
+        f"Running {workers} of {len(samples)} samples at once with {sample_threads} threads each."
+    )
 
-    if plass.chromosome_flag is False:
-        move_and_copy_files(
-            outdir,
-            prefix,
-            False,  # unicycler success
-            False,  # keep fastqs
-            False,  # assembled mode
-            True,  # long only
-            use_raven,
-        )
-        remove_intermediate_files(
-            outdir,
-            keep_chromosome,
-            False,  # assembled mode
-            True,  # long only
-            use_raven,
+    jobs = []
+    for row in samples.itertuples(index=False):
+        kwargs = dict(
+            database=database,
+            longreads=row.longreads,
+            chromosome=chromosome,
+            outdir=os.path.join(outdir, row.sample),
+            min_length=min_length,
+            min_quality=min_quality,
+            threads=str(sample_threads),
+            force=False,
+            resume=resume,
+            prefix=prefix,
+            use_raven=use_raven,
+            pacbio_model=pacbio_model,
+            skip_qc=skip_qc,
+            raw_flag=raw_flag,
+            keep_chromosome=keep_chromosome,
+            daemon=daemon,
+            skip_checks=True,
         )
-        message = "No chromosome was identified. Likely, there was insufficient long read depth to assemble a chromosome. \nIncreasing sequencing depth is recommended. \nAlso please check your -c or --chromosome parameter, it may be too high. "
-        logger.error(message)
-
-    else:
-        ####################################################################
-        # Only 1 contig
-        ####################################################################
-
-        if plass.contig_count == 1:
-            # chromosome identified but no plasmids - just finish
-            # end plassembler
-            move_and_copy_files(
-                outdir,
-                prefix,
-                False,  # unicycler success
-                False,  # keep fastqs
-                True,  # assembled mode
-                False,  # long only
-                use_raven,
-            )
-            remove_intermediate_files(
-                outdir,
-                keep_chromosome,
-                False,  # assembled mode
-                True,  # long only
-                use_raven,
-            )
-            logger.error("Chromosome identified but no plasmids.")
-
-        ####################################################################
-        # Multiple Contigs
-        ####################################################################
-
-        elif plass.contig_count > 1:
-            # no_plasmids_flag = False as obviously "plasmids"
-            plass.no_plasmids_flag = False
-
-            logger.info("Mapping long reads.")
-            input_long_reads: Path = Path(outdir) / "chopper_long_reads.fastq.gz"
-            fasta: Path = Path(outdir) / "flye_renamed.fasta"
-            samfile: Path = Path(outdir) / "long_read.sam"
-            minimap_long_reads(
-                input_long_reads, fasta, samfile, threads, pacbio_model, logdir
+        if row.short_one == "":
+            jobs.append((run_plassembler_long, row.sample, kwargs))
+        else:
+            kwargs.update(
+                short_one=row.short_one,
+                short_two=row.short_two,
+                keep_fastqs=keep_fastqs,
             )
+            jobs.append((run_plassembler, row.sample, kwargs))
 
-            # for long, custom function is quick enough
-            logger.info("Processing Sam/Bam Files and extracting Fastqs.")
-            extract_bin_long_fastqs(outdir)
-            plass.get_depth_long(logdir, pacbio_model, threads)
-
-            # run mash
-            logger.info("Calculating mash distances to PLSDB.")
-
-            # mash sketches the plasmids
-            mash_sketch(outdir, os.path.join(outdir, "plasmids_initial.fasta"), logdir)
-
-            # runs mash
-            run_mash(outdir, database, logdir)
-
-            # processes output
-            plass.process_mash_tsv(database)
+    # loaded before the workers fork, so they share the imported pipeline modules
+    import plassembler.utils.plass_class  # noqa: F401
+    import plassembler.utils.stages  # noqa: F401
 
-            # combine depth and mash tsvs
-            plass.combine_depth_mash_tsvs(prefix)
-
-            # rename contigs and update copy bumber with plsdb
-            plass.finalise_contigs_long(prefix)
-
-            # cleanup files
-            move_and_copy_files(
-                outdir,
-                prefix,
-                False,  # unicycler success
-                False,  # keep fastqs
-                False,  # assembled mode
-                True,  # long only
-                use_raven,
-            )
+    statuses = run_batch(jobs, workers)
+    write_batch_summary(statuses, outdir, prefix)
 
-            remove_intermediate_files(
-                outdir,
-                keep_chromosome,
-                False,  # assembled mode
-                True,  # long only
-                use_raven,
-            )
+    failed = [status["sample"] for status in statuses if status["status"] != "success"]
+    if failed:
+        logger.warning(f"Samples {failed} failed. Check their logs.")
 
-    # end plassembler
     end_plassembler(start_time)
 
 
@@ -0,0 +1,151 @@
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+from loguru import logger
+
+from plassembler.utils.util import log_fmt
+
+SAMPLE_SHEET_COLUMNS = ["sample", "longreads", "short_one", "short_two"]
+
+
+def read_sample_sheet(sample_sheet):
+    """reads a batch sample sheet
+    tab separated with a header of sample, longreads, short_one and short_two
+    samples with no short reads are run in long only mode
+    :param sample_sheet: sample sheet tsv
+    :return: samples: dataframe with one row per sample
+    """
+    samples = pd.read_csv(sample_sheet, sep="\t", dtype=str, keep_default_na=False)
+    for column in ["short_one", "short_two"]:
+        if column not in samples.columns:
+            samples[column] = ""
+    missing = [column for column in ["sample", "longreads"] if column not in samples]
+    if missing:
+        logger.error(f"Sample sheet {sample_sheet} is missing the columns {missing}.")
+    samples = samples[SAMPLE_SHEET_COLUMNS]
+    if samples.empty:
+        logger.error(f"Sample sheet {sample_sheet} contains no samples.")
+    if samples["sample"].duplicated().any():
+        duplicated = samples.loc[samples["sample"].duplicated(), "sample"].tolist()
+        logger.error(f"Sample names {duplicated} are duplicated in {sample_sheet}.")
+    for sample in samples["sample"]:
+        if sample == "" or os.sep in sample or sample in (".", ".."):
+            logger.error(f"Sample name '{sample}' cannot be used as a directory name.")
+    # short reads come in pairs
+    unpaired = samples.loc[(samples["short_one"] == "") != (samples["short_two"] == "")]
+    if not unpaired.empty:
+        logger.error(
+            f"Samples {unpaired['sample'].tolist()} have only one short read FASTQ."
+        )
+    return samples
+
+
+def get_total_memory():
+    """total physical memory in GB
+    :return: memory or None if it cannot be determined
+    """
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024**3
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def get_batch_workers(
+    sample_count, threads, threads_per_sample, memory, memory_per_sample
+):
+    """number of samples run at once under the thread and memory budgets, and the threads each gets
+    :param sample_count: number of samples
+    :param threads: total thread budget
+    :param threads_per_sample: threads wanted per sample
+    :param memory: total memory budget in GB - None for no limit
+    :param memory_per_sample: peak memory expected per sample in GB
+    :return: workers, sample_threads
+    """
+    workers = min(sample_count, max(1, threads // threads_per_sample))
+    if memory is not None:
+        workers = min(workers, max(1, int(memory // memory_per_sample)))
+    # leftover threads go to the samples that are running
+    sample_threads = max(1, threads // workers)
+    return workers, sample_threads
+
+
+def run_sample(sample_func, sample, kwargs):
+    """runs one sample in a batch worker, capturing its failure instead of stopping the batch
+    :param sample_func: run_plassembler or run_plassembler_long
+    :param sample: sample name
+    :param kwargs: keyword arguments of sample_func
+    :return: dictionary of the sample's status
+    """
+    start_time = time.time()
+    # fresh sinks per sample - begin_plassembler adds the sample log and the exit on error
+    logger.remove()
+    logger.add(sys.stderr, format=f"{sample} | {log_fmt}")
+    try:
+        sample_func(**kwargs)
+        status = "success"
+    except SystemExit:
+        status = "failed"
+    except Exception as e:
+        logger.warning(f"Sample {sample} failed with {e!r}")
+        status = "failed"
+    finally:
+        logger.remove()
+    return {
+        "sample": sample,
+        "status": status,
+        "elapsed_seconds": round(time.time() - start_time, 2),
+        "outdir": str(kwargs["outdir"]),
+    }
+
+
+def run_batch(jobs, workers):
+    """runs samples in parallel worker processes
+    workers are forked where possible so they share resources already loaded by the parent e.g. the PLSDB metadata
+    :param jobs: list of (sample_func, sample, kwargs) tuples
+    :param workers: number of samples run at once
+    :return: statuses: list of dictionaries from run_sample in the order of jobs
+    """
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+    else:
+        context = multiprocessing.get_context()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        futures = [executor.submit(run_sample, *job) for job in jobs]
+        statuses = []
+        for future in futures:
+            status = future.result()
+            logger.info(f"Sample {status['sample']} finished: {status['status']}")
+            statuses.append(status)
+    return statuses
+
+
+def write_batch_summary(statuses, outdir, prefix):
+    """writes the status of every sample and all their plasmid summaries into one table each
+    :param statuses: list of dictionaries from run_sample
+    :param outdir: batch output directory
+    :param prefix: prefix of the per sample outputs
+    :return:
+    """
+    status_df = pd.DataFrame(
+        statuses, columns=["sample", "status", "elapsed_seconds", "outdir"]
+    )
+    status_df.to_csv(Path(outdir) / "batch_status.tsv", sep="\t", index=False)
+
+    summaries = []
+    for status in statuses:
+        summary_file: Path = Path(status["outdir"]) / f"{prefix}_summary.tsv"
+        # samples without plasmids have an empty summary
+        if summary_file.exists() and summary_file.stat().st_size > 0:
+            summary_df = pd.read_csv(summary_file, sep="\t")
+            summary_df.insert(0, "sample", status["sample"])
+            summaries.append(summary_df)
+    if summaries:
+        batch_summary_df = pd.concat(summaries, ignore_index=True)
+    else:
+        batch_summary_df = pd.DataFrame(columns=["sample"])
+    batch_summary_df.to_csv(Path(outdir) / "batch_summary.tsv", sep="\t", index=False)
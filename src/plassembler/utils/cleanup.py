@@ -2,6 +2,8 @@ import glob
 import os
 import shutil
 
+from plassembler.utils.util import stage_file
+
 ####################################################
 # cleanup
 ##########################################################
@@ -17,7 +19,7 @@ def remove_intermediate_files(
 
     # find all files with the suffix "fastq"
     # find all files with the specified suffixes
-    suffixes = ["fastq", "bam", "sa", "sam", "json", "bed", "msh"]
+    suffixes = ["fastq", "bam", "sa", "sam", "json", "bed", "msh", "mmi"]
     files = []
     for suffix in suffixes:
         files.extend(glob.glob(os.path.join(out_dir, "*." + suffix)))
@@ -31,6 +33,8 @@ def remove_intermediate_files(
     remove_directory(os.path.join(out_dir, "20-repeat"))
     remove_directory(os.path.join(out_dir, "30-contigger"))
     remove_directory(os.path.join(out_dir, "40-polishing"))
+    # --resume completion markers
+    remove_directory(os.path.join(out_dir, "checkpoints"))
 
     if long_only is True:
         # the fake unicycler directory only in long only mode
@@ -52,6 +56,9 @@ def remove_intermediate_files(
 
     # delete fastq intermediate files
     remove_file(os.path.join(out_dir, "chopper_long_reads.fastq.gz"))
+    # gzipped short reads staged with --skip_qc
+    remove_file(os.path.join(out_dir, "trimmed_R1.fastq.gz"))
+    remove_file(os.path.join(out_dir, "trimmed_R2.fastq.gz"))
     remove_file(os.path.join(out_dir, "multimap_plasmid_chromosome_long.fastq"))
 
     # multimer
@@ -101,10 +108,11 @@ def move_and_copy_files(
 
     if long_only is False:
         if unicycler_success_flag is True:
-            # move unicycler graph output to main directory
-            shutil.copy2(
+            # link unicycler graph output to main directory
+            stage_file(
                 os.path.join(out_dir, "unicycler_output", "assembly.gfa"),
                 os.path.join(out_dir, prefix + "_plasmids.gfa"),
+                allow_symlink=False,
             )
         else:
             # to touch empty versions of the output files if no plasmids
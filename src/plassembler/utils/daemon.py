@@ -0,0 +1,274 @@
+import os
+import secrets
+import signal
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+from loguru import logger
+
+from plassembler.utils.minhash import (
+    get_plsdb_sketch_index,
+    load_sketch_index,
+    mash_distances,
+    sketch_fasta,
+)
+from plassembler.utils.plsdb import load_plsdb_metadata
+
+# default socket of plassembler serve, inside the database directory
+DAEMON_SOCKET = "plsdb_daemon.sock"
+
+# seconds a client waits for an answer before falling back to the local database
+DAEMON_TIMEOUT = 600
+
+# seconds the daemon waits for a connected client to send its request
+DAEMON_REQUEST_TIMEOUT = 10
+
+
+def get_daemon_socket(plassembler_db_dir, socket_path=None):
+    """socket of the PLSDB daemon
+    :param plassembler_db_dir: database directory
+    :param socket_path: socket given by the user - None for the default in the database directory
+    :return: socket path
+    """
+    if socket_path is None:
+        socket_path = os.path.join(plassembler_db_dir, DAEMON_SOCKET)
+    return os.path.abspath(socket_path)
+
+
+def get_daemon_key(socket_path):
+    """file of the key clients authenticate to the daemon with
+    :param socket_path: daemon socket
+    :return: key path
+    """
+    return f"{socket_path}.key"
+
+
+class PlsdbDaemon:
+    """Holds the PLSDB sketch index and metadata in memory and answers queries over a Unix socket"""
+
+    def __init__(self, plassembler_db_dir, socket_path):
+        """
+        Parameters
+        --------
+        plassembler_db_dir: str
+            database directory
+        socket_path: str
+            Unix socket the daemon listens on
+        """
+        self.database = os.path.realpath(plassembler_db_dir)
+        self.socket_path = socket_path
+        self.key_path = get_daemon_key(socket_path)
+        self.authkey = secrets.token_bytes(32)
+        self.index = None
+        self.metadata = None
+        self.stopping = threading.Event()
+
+    def load(self):
+        """
+        Reads the sketch index and the PLSDB metadata into memory
+        """
+        index_dir = get_plsdb_sketch_index(self.database)
+        if index_dir is None:
+            logger.error(
+                f"No PLSDB sketch index in {self.database}. Run plassembler download to build it."
+            )
+        # copied out of the memory maps so queries never page from disk
+        index = dict(load_sketch_index(str(index_dir)))
+        for array in ["hashes", "sketches", "ranks", "sizes", "lengths"]:
+            index[array] = np.array(index[array])
+        self.index = index
+        self.metadata = load_plsdb_metadata(self.database)
+        logger.info(
+            f"Loaded {len(index['names'])} PLSDB sketches and {len(self.metadata)} metadata rows."
+        )
+
+    def answer(self, request):
+        """
+        Answers one client request
+        :param request: dictionary with the command, the client's database and the command's arguments
+        :return: dictionary with the result, or the error when the request cannot be answered
+        """
+        command = request.get("command")
+        if os.path.realpath(request.get("database", "")) != self.database:
+            return {"error": f"the daemon serves the database {self.database}"}
+        try:
+            if command == "ping":
+                result = {"database": self.database, "pid": os.getpid()}
+            elif command == "mash":
+                query = sketch_fasta(
+                    request["fasta"],
+                    self.index["kmer_size"],
+                    self.index["sketch_size"],
+                )
+                result = mash_distances(
+                    query,
+                    self.index,
+                    request["max_distance"],
+                    request["max_pvalue"],
+                )
+            elif command == "metadata":
+                result = self.metadata.loc[
+                    self.metadata["ACC_NUCCORE"].isin(request["accessions"])
+                ]
+            elif command == "stop":
+                self.stopping.set()
+                result = None
+            else:
+                return {"error": f"unknown command {command}"}
+        except Exception as e:
+            return {"error": repr(e)}
+        return {"error": None, "result": result}
+
+    def handle(self, connection):
+        """
+        Answers the request of one connection
+        :param connection: multiprocessing Connection
+        """
+        with connection:
+            try:
+                if not connection.poll(DAEMON_REQUEST_TIMEOUT):
+                    return
+                connection.send(self.answer(connection.recv()))
+            except (OSError, EOFError) as e:
+                logger.warning(f"Lost a PLSDB daemon client: {e!r}")
+                return
+        # wake the accept loop so it sees the stop, unless it has already seen it
+        if self.stopping.is_set():
+            try:
+                Client(self.socket_path, family="AF_UNIX", authkey=self.authkey).close()
+            except (OSError, EOFError):
+                pass
+
+    def serve(self):
+        """
+        Listens until a stop request, SIGTERM or SIGINT, answering each client in its own thread
+        """
+        if os.path.exists(self.socket_path):
+            if ping_plsdb_daemon(self.socket_path, self.database) is not None:
+                logger.error(
+                    f"A PLSDB daemon is already listening on {self.socket_path}."
+                )
+            # left behind by a daemon that was killed
+            os.remove(self.socket_path)
+
+        # a stop on SIGTERM too, so the socket and key are removed
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, signal.default_int_handler)
+        listener = Listener(self.socket_path, family="AF_UNIX", authkey=self.authkey)
+        try:
+            os.chmod(self.socket_path, 0o600)
+            # only the user running the daemon can read the key
+            key_fd = os.open(
+                self.key_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600
+            )
+            with os.fdopen(key_fd, "wb") as key_file:
+                key_file.write(self.authkey)
+            logger.info(f"PLSDB daemon listening on {self.socket_path}")
+            while not self.stopping.is_set():
+                try:
+                    connection = listener.accept()
+                except AuthenticationError as e:
+                    logger.warning(f"Rejected a PLSDB daemon client: {e}")
+                    continue
+                if self.stopping.is_set():
+                    connection.close()
+                    break
+                threading.Thread(
+                    target=self.handle, args=(connection,), daemon=True
+                ).start()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # also removes the socket
+            listener.close()
+            if os.path.exists(self.key_path):
+                os.remove(self.key_path)
+            logger.info("PLSDB daemon stopped.")
+
+
+def request_plsdb_daemon(socket_path, plassembler_db_dir, request):
+    """sends one request to the PLSDB daemon
+    :param socket_path: daemon socket - None when no daemon is used
+    :param plassembler_db_dir: database directory the request is for
+    :param request: dictionary with the command and its arguments
+    :return: result or None when the daemon is not running or cannot answer
+    """
+    if socket_path is None:
+        return None
+    try:
+        with open(get_daemon_key(socket_path), "rb") as key_file:
+            authkey = key_file.read()
+        with Client(str(socket_path), family="AF_UNIX", authkey=authkey) as connection:
+            connection.send(
+                {**request, "database": os.path.realpath(plassembler_db_dir)}
+            )
+            if not connection.poll(DAEMON_TIMEOUT):
+                logger.warning(
+                    f"The PLSDB daemon on {socket_path} did not answer. Using the local database."
+                )
+                return None
+            response = connection.recv()
+    except (OSError, EOFError, AuthenticationError) as e:
+        logger.info(
+            f"No PLSDB daemon on {socket_path} ({e.__class__.__name__}). Using the local database."
+        )
+        return None
+    if response["error"] is not None:
+        logger.warning(
+            f"The PLSDB daemon on {socket_path} could not answer: {response['error']}. Using the local database."
+        )
+        return None
+    return response["result"]
+
+
+def ping_plsdb_daemon(socket_path, plassembler_db_dir):
+    """checks whether a PLSDB daemon serves the database
+    :return: dictionary with the daemon's database and pid, or None
+    """
+    return request_plsdb_daemon(socket_path, plassembler_db_dir, {"command": "ping"})
+
+
+def stop_plsdb_daemon(socket_path, plassembler_db_dir):
+    """asks the PLSDB daemon to stop
+    :return: True if the daemon was running
+    """
+    if ping_plsdb_daemon(socket_path, plassembler_db_dir) is None:
+        return False
+    request_plsdb_daemon(socket_path, plassembler_db_dir, {"command": "stop"})
+    return True
+
+
+def daemon_mash_distances(
+    socket_path, plassembler_db_dir, fasta_file, max_distance, max_pvalue
+):
+    """mash distances of the plasmids to PLSDB from the daemon
+    :param fasta_file: plasmid FASTA, read by the daemon
+    :param max_distance: as mash dist -d
+    :param max_pvalue: as mash dist -v
+    :return: rows as from mash_distances, or None to fall back to the local database
+    """
+    return request_plsdb_daemon(
+        socket_path,
+        plassembler_db_dir,
+        {
+            "command": "mash",
+            "fasta": os.path.abspath(fasta_file),
+            "max_distance": max_distance,
+            "max_pvalue": max_pvalue,
+        },
+    )
+
+
+def daemon_plsdb_metadata(socket_path, plassembler_db_dir, accessions):
+    """PLSDB metadata of some accessions from the daemon
+    :param accessions: iterable of ACC_NUCCORE accessions
+    :return: pandas df of the matching PLSDB metadata rows, or None to fall back to the local database
+    """
+    accessions = sorted({acc for acc in accessions if isinstance(acc, str) and acc})
+    return request_plsdb_daemon(
+        socket_path,
+        plassembler_db_dir,
+        {"command": "metadata", "accessions": accessions},
+    )
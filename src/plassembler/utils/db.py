@@ -7,6 +7,13 @@ from pathlib import Path
 
 from loguru import logger
 
+from plassembler.utils.minhash import (
+    PLSDB_SKETCH_INDEX,
+    build_sketch_index,
+    get_plsdb_sketch_index,
+)
+from plassembler.utils.plsdb import build_plsdb_store, get_plsdb_store
+
 
 def check_db_installation(db_dir: Path, install_flag: bool):
     """checks database is installed correctly
@@ -37,6 +44,26 @@ def check_db_installation(db_dir: Path, install_flag: bool):
                         f"Database directory is missing {file_path}. Plassembler database needs to be downloaded using the plassembler download command."
                     )
 
+    # the indexed metadata store, so each run fetches only its hits,
+    # and the memory-mappable PLSDB sketch for the in-process mash distances
+    # built by download, or by the first run once the database is downloaded
+    store_missing = get_plsdb_store(str(db_dir)) is None
+    index_missing = get_plsdb_sketch_index(str(db_dir)) is None
+    if store_missing is False and index_missing is False:
+        return
+    if install_flag is False and os.access(db_dir, os.W_OK) is False:
+        logger.warning(
+            f"The indexed PLSDB metadata store or sketch index is missing from {db_dir}, which is not writable, so plasmids are compared to PLSDB more slowly. "
+            f"Run plassembler download -d {db_dir} as a user who can write to it to build them."
+        )
+        return
+    if store_missing is True:
+        logger.info("Building the indexed PLSDB metadata store.")
+        build_plsdb_store(db_dir)
+    if index_missing is True:
+        logger.info("Building the PLSDB sketch index.")
+        build_sketch_index(db_dir / "plsdb.msh", db_dir / PLSDB_SKETCH_INDEX)
+
 
 def get_database_zenodo(db_dir: Path):
     logger.info("Downloading Plassembler Database.")
@@ -2,9 +2,11 @@
 # some code taken from & modified
 # https://github.com/rrwick/Small-plasmid-Nanopore/blob/main/scripts/get_depths.py
 #########################################
-import os
-import statistics
-import subprocess as sp
+import math
+import re
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
 
 import numpy as np
@@ -13,6 +15,11 @@ from Bio import SeqIO
 from loguru import logger
 
 from plassembler.utils.concat import concatenate_single_fasta
+from plassembler.utils.mapping import (
+    minimap_long_reads_to_pipe,
+    minimap_short_reads_to_pipe,
+)
+from plassembler.utils.qc import get_trimmed_short_reads
 
 
 def concatenate_chrom_plasmids(outdir):
@@ -66,28 +73,242 @@ def get_contig_circularity(fasta):
     return circular_status
 
 
-def get_depths_from_bam(bam_file: Path, contig_lengths: pd.DataFrame):
-    """maps runs samtools depth on bam
-    :param bam_file: Path
+# alignments samtools depth skips by default: unmapped, secondary, qc fail and duplicates
+DEPTH_SKIP_FLAGS = 0x4 | 0x100 | 0x200 | 0x400
+
+# cigar operations in minimap2's PAF cg:Z: tag
+PAF_CIGAR_LENGTHS = re.compile(rb"\d+")
+REFERENCE_OPS = np.frombuffer(b"MDN=X", dtype=np.uint8)
+COVERING_OPS = np.frombuffer(b"M=X", dtype=np.uint8)
+
+
+class DepthAccumulator:
+    """Per-base depth accumulator
+
+    Each aligned block adds +1 at its start and -1 at its end of a per contig
+    NumPy difference array, and the depths are the cumulative sum. Block
+    coordinates are buffered and added in chunks with np.bincount, so memory
+    is bounded by the contig lengths and the chunk size, and the alignments
+    need not be sorted.
+    """
+
+    def __init__(self, contig_lengths: dict, chunk_size: int = 1000000) -> None:
+        """
+        Parameters
+        --------
+        contig_lengths: dict, required
+            dictionary of headers and contig lengths
+        chunk_size: int, optional
+            number of buffered blocks before they are added to the difference arrays
+        """
+        self.contig_lengths = contig_lengths
+        self.chunk_size = chunk_size
+        self.diffs = {
+            name: np.zeros(length + 1, dtype=np.int32)
+            for name, length in contig_lengths.items()
+        }
+        self.starts = defaultdict(list)
+        self.ends = defaultdict(list)
+        self.buffered = 0
+
+    def add_interval(self, contig: str, start: int, end: int) -> None:
+        """adds one covered interval
+        :param contig: contig name
+        :param start: 0-based start
+        :param end: 0-based exclusive end
+        :return:
+        """
+        self.starts[contig].append(start)
+        self.ends[contig].append(end)
+        self.buffered += 1
+        if self.buffered >= self.chunk_size:
+            self.flush()
+
+    def add_alignment(self, read) -> None:
+        """adds the aligned blocks of a pysam alignment (deletions and clips are not counted)
+        :param read: pysam AlignedSegment
+        :return:
+        """
+        if read.flag & DEPTH_SKIP_FLAGS:
+            return
+        contig = read.reference_name
+        for start, end in read.get_blocks():
+            self.add_interval(contig, start, end)
+
+    def add_blocks(self, contig: str, starts, ends) -> None:
+        """adds many covered intervals at once
+        :param contig: contig name
+        :param starts: array of 0-based starts
+        :param ends: array of 0-based exclusive ends
+        :return:
+        """
+        self.starts[contig].extend(starts.tolist())
+        self.ends[contig].extend(ends.tolist())
+        self.buffered += len(starts)
+        if self.buffered >= self.chunk_size:
+            self.flush()
+
+    def add_paf_line(self, line: bytes) -> None:
+        """adds a minimap2 PAF alignment - from its cg:Z: cigar if present, else its target span
+        :param line: PAF line
+        :return:
+        """
+        fields = line.rstrip(b"\n").split(b"\t")
+        if len(fields) < 12:
+            return
+        tags = fields[12:]
+        # secondary alignments are skipped as in SAM
+        if b"tp:A:S" in tags:
+            return
+        contig = fields[5].decode()
+        start = int(fields[7])
+        cigar = None
+        for tag in tags:
+            if tag.startswith(b"cg:Z:"):
+                cigar = tag[5:]
+                break
+        if cigar is None:
+            self.add_interval(contig, start, int(fields[8]))
+            return
+        # walk the cigar vectorised - only M, = and X add depth, D and N skip reference
+        lengths = np.array(PAF_CIGAR_LENGTHS.findall(cigar)).astype(np.int64)
+        ops = np.frombuffer(PAF_CIGAR_LENGTHS.sub(b"", cigar), dtype=np.uint8)
+        reference_lengths = np.where(np.isin(ops, REFERENCE_OPS), lengths, 0)
+        offsets = start + np.cumsum(reference_lengths) - reference_lengths
+        covering = np.isin(ops, COVERING_OPS)
+        self.add_blocks(
+            contig, offsets[covering], offsets[covering] + lengths[covering]
+        )
+
+    def flush(self) -> None:
+        for contig, starts in self.starts.items():
+            diff = self.diffs[contig]
+            diff += np.bincount(starts, minlength=len(diff)).astype(np.int32)
+            diff -= np.bincount(self.ends[contig], minlength=len(diff)).astype(np.int32)
+        self.starts = defaultdict(list)
+        self.ends = defaultdict(list)
+        self.buffered = 0
+
+    def get_depths(self) -> dict:
+        """
+        :return: depths: dictionary of contigs and per-base depth arrays
+        """
+        self.flush()
+        return {
+            name: np.cumsum(diff[:-1], dtype=np.int32)
+            for name, diff in self.diffs.items()
+        }
+
+
+def get_depths_from_paf(paf_stream, contig_lengths: dict):
+    """computes per-base depths straight from an unsorted PAF stream e.g. minimap2 -c's stdout
+    :param paf_stream: binary PAF stream
     :param: contig_lengths: dictionary of headers and contig lengths
-    :return: depths: dictionary of contigs and depths
+    :return: depths: dictionary of contigs and depth arrays
+    """
+    accumulator = DepthAccumulator(contig_lengths)
+    for line in paf_stream:
+        accumulator.add_paf_line(line)
+    return accumulator.get_depths()
+
+
+def get_long_read_depths(outdir, fasta, contig_lengths, threads, pacbio_model, logdir):
+    """maps the long reads to fasta and gets their per-base depths
+    :param outdir: output directory
+    :param fasta: reference fasta
+    :param contig_lengths: dictionary of headers and contig lengths
+    :param threads: threads
+    :param pacbio_model: pacbio_model
+    :param logdir: logdir
+    :return: depths: dictionary of contigs and depth arrays
+    """
+    input_long_reads: Path = Path(outdir) / "chopper_long_reads.fastq.gz"
+
+    # minimap2 PAF streams straight into the depth accumulator - no SAM, BAM or sort
+    return minimap_long_reads_to_pipe(
+        input_long_reads,
+        fasta,
+        threads,
+        pacbio_model,
+        logdir,
+        partial(get_depths_from_paf, contig_lengths=contig_lengths),
+        output_format="paf",
+    )
+
+
+def get_short_read_depths(outdir, fasta, contig_lengths, threads, logdir):
+    """maps the trimmed short reads to fasta and gets their per-base depths
+    :param outdir: output directory
+    :param fasta: reference fasta
+    :param contig_lengths: dictionary of headers and contig lengths
+    :param threads: threads
+    :param logdir: logdir
+    :return: depths: dictionary of contigs and depth arrays
+    """
+    r1, r2 = get_trimmed_short_reads(outdir)
+
+    # minimap2 PAF streams straight into the depth accumulator - no SAM, BAM or sort
+    return minimap_short_reads_to_pipe(
+        r1,
+        r2,
+        fasta,
+        threads,
+        logdir,
+        partial(get_depths_from_paf, contig_lengths=contig_lengths),
+        output_format="paf",
+    )
+
+
+def split_threads(threads, n):
+    """splits a thread budget as evenly as possible, with at least 1 thread each
+    :param threads: threads
+    :param n: number of jobs
+    :return: list of threads per job
+    """
+    threads = int(threads)
+    return [max(1, threads // n + (1 if i < threads % n else 0)) for i in range(n)]
+
+
+def run_depth_branches(branches, threads):
+    """runs independent depth branches concurrently, splitting the thread budget between them
+    :param branches: dictionary of names and functions taking the number of threads
+    :param threads: threads
+    :return: dictionary of names and the return value of each branch
+    """
+    if len(branches) == 0:
+        return {}
+    branch_threads = split_threads(threads, len(branches))
+    with ThreadPoolExecutor(max_workers=len(branches)) as executor:
+        futures = {
+            name: executor.submit(branch, branch_threads[i])
+            for i, (name, branch) in enumerate(branches.items())
+        }
+        # re-raises any error (including the SystemExit from logger.error) here
+        return {name: future.result() for name, future in futures.items()}
+
+
+def summarise_depths(base_depths):
+    """calculates the depth summary statistics of one contig in one vectorised pass
+    :param base_depths: per-base depths of the contig
+    :return: mean_depth, depth_stdev, q25, q75 - all "NA" for contigs shorter than 2 bases
     """
-    depths = {}
-    for repName, repLength in contig_lengths.items():
-        depths[repName] = [0] * repLength
-    depthCommand = ["samtools", "depth", bam_file]
-    with open(os.devnull, "wb") as devNull:
-        depthOutput = sp.check_output(depthCommand, stderr=devNull).decode()
-    for line in depthOutput.splitlines():  # parse output
-        parts = line.strip().split("\t")
-        repName = parts[0]
-        depths[repName][int(parts[1]) - 1] = int(parts[2])
-    return depths
+    base_depths = np.asarray(base_depths, dtype=np.int64)
+    n = len(base_depths)
+    if n < 2:  # if can't calculate
+        return "NA", "NA", "NA", "NA"
+    # exact integer sums so the mean and sample sd match the statistics module
+    depth_sum = int(base_depths.sum())
+    depth_sum_sq = int(np.dot(base_depths, base_depths))
+    mean_depth = round(depth_sum / n, 2)
+    variance = (n * depth_sum_sq - depth_sum * depth_sum) / (n * (n - 1))
+    depth_stdev = round(math.sqrt(variance), 2)
+    q25, q75 = np.percentile(base_depths, [25, 75])
+    return mean_depth, depth_stdev, int(q25), int(q75)
 
 
 def collate_depths(depths, shortFlag, contig_lengths):
     """calculates summary statistics for all depths
-    :param depths:  dictionary of contigs and depths from get_depths_from_bam
+    :param depths:  dictionary of contigs and depth arrays from DepthAccumulator
     :param: shortFlag: string either "short" or "long"
     :param: contig_lengths: dictionary of headers and contig lengths
     :return: summary_df: pandas df of depth summary statistics
@@ -102,19 +323,10 @@ def collate_depths(depths, shortFlag, contig_lengths):
     # iterate over the conitgs
     for replicon_name, base_depths in depths.items():
         replicon_length = contig_lengths[replicon_name]
-        unmaskedDepths = []
-        for depth in enumerate(base_depths):
-            unmaskedDepths.append(depth)
-        try:
-            mean_depth = round(statistics.mean(base_depths), 2)
-            depth_stdev = round(statistics.stdev(base_depths), 2)
-            q25, q75 = np.percentile(base_depths, [25, 75])
-            q25, q75 = int(q25), int(q75)
-            # save the chromosome depth
-            if replicon_name == "chromosome":
-                chromosome_depth = mean_depth
-        except statistics.StatisticsError:  # if can't calculate
-            mean_depth, depth_stdev, q25, q75 = "NA", "NA", "NA", "NA"
+        mean_depth, depth_stdev, q25, q75 = summarise_depths(base_depths)
+        # save the chromosome depth
+        if replicon_name == "chromosome" and mean_depth != "NA":
+            chromosome_depth = mean_depth
         # append to list
         contig_names.append(replicon_name)
         contig_length.append(replicon_length)
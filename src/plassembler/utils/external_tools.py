@@ -1,9 +1,11 @@
 import hashlib
 import shlex
+import signal
 import subprocess
 import sys
+from contextlib import contextmanager
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import IO, Any, Callable, List, Optional, Tuple
 
 import click
 from loguru import logger
@@ -65,10 +67,56 @@ class ExternalTool:
             self._run_core(self.command, stdout_fh=outfile, stderr_fh=stderr_fh)
             logger.info(f"Done running {self.command_as_str}")
 
+    @contextmanager
+    def run_to_pipe(self):
+        """
+        Runs the tool and yields its stdout as a binary pipe, so the output
+        can be consumed as it is produced without an intermediate file
+        """
+        with open(self.err_log, "w") as stderr_fh:
+            print(f"Command line: {self.command_as_str}", file=stderr_fh, flush=True)
+            logger.info(f"Started running {self.command_as_str} ...")
+            process = subprocess.Popen(
+                self.command, stdout=subprocess.PIPE, stderr=stderr_fh
+            )
+            try:
+                yield process.stdout
+            except BaseException:
+                process.stdout.close()
+                # report the tool failure rather than the consumer's parse error
+                if process.wait() > 0:
+                    raise subprocess.CalledProcessError(
+                        process.returncode, self.command
+                    )
+                raise
+            process.stdout.close()
+            if process.wait() != 0:
+                raise subprocess.CalledProcessError(process.returncode, self.command)
+            logger.info(f"Done running {self.command_as_str}")
+
     @staticmethod
     def _run_core(command: List[str], stdout_fh, stderr_fh) -> None:
         subprocess.check_call(command, stdout=stdout_fh, stderr=stderr_fh)
 
+    @staticmethod
+    def _exit_on_error(
+        tool: "ExternalTool",
+        error: subprocess.CalledProcessError,
+        ctx: Optional[click.Context] = None,
+    ) -> None:
+        logger.error(
+            f"Error calling {tool.command_as_str} (return code {error.returncode})"
+        )
+        logger.error(f"Please check stdout log file: {tool.out_log}")
+        logger.error(f"Please check stderr log file: {tool.err_log}")
+        logger.error("Temporary files are preserved for debugging")
+        logger.error("Exiting...")
+
+        if ctx:
+            ctx.exit(1)
+        else:
+            sys.exit(1)
+
     @staticmethod
     def run_tools(
         tools_to_run: Tuple["ExternalTool", ...], ctx: Optional[click.Context] = None
@@ -77,18 +125,7 @@ class ExternalTool:
             try:
                 tool.run()
             except subprocess.CalledProcessError as error:
-                logger.error(
-                    f"Error calling {tool.command_as_str} (return code {error.returncode})"
-                )
-                logger.error(f"Please check stdout log file: {tool.out_log}")
-                logger.error(f"Please check stderr log file: {tool.err_log}")
-                logger.error("Temporary files are preserved for debugging")
-                logger.error("Exiting...")
-
-                if ctx:
-                    ctx.exit(1)
-                else:
-                    sys.exit(1)
+                ExternalTool._exit_on_error(tool, error, ctx)
 
     """
     Only one tool
@@ -99,27 +136,35 @@ class ExternalTool:
         tool: "ExternalTool",
         ctx: Optional[click.Context] = None,
         to_stdout: Optional[bool] = False,
-    ) -> None:
+    ) -> bool:
         try:
             if to_stdout is False:
                 tool.run()
             else:  # if tool needs to write to stdout
                 tool.run_to_stdout()
         except subprocess.CalledProcessError as error:
-            if tool.tool_str == "unicycler":  # for unicycler errors
+            # a kill by a signal (e.g. the OOM killer) is never a lack of plasmids
+            killed = error.returncode < 0 or error.returncode == 128 + signal.SIGKILL
+            if tool.tool_str == "unicycler" and not killed:  # for unicycler errors
                 logger.warning(
                     "Unicycler has failed. This usually means that you have no plasmids. Checking."
                 )
-            else:
-                logger.error(
-                    f"Error calling {tool.command_as_str} (return code {error.returncode})"
-                )
-                logger.error(f"Please check stdout log file: {tool.out_log}")
-                logger.error(f"Please check stderr log file: {tool.err_log}")
-                logger.error("Temporary files are preserved for debugging")
-                logger.error("Exiting...")
-
-                if ctx:
-                    ctx.exit(1)
-                else:
-                    sys.exit(1)
+                return False
+            ExternalTool._exit_on_error(tool, error, ctx)
+        return True
+
+    """
+    Only one tool, streaming stdout
+    """
+
+    @staticmethod
+    def run_tool_to_pipe(
+        tool: "ExternalTool",
+        consumer: Callable[[IO[bytes]], Any],
+        ctx: Optional[click.Context] = None,
+    ) -> Any:
+        try:
+            with tool.run_to_pipe() as stdout:
+                return consumer(stdout)
+        except subprocess.CalledProcessError as error:
+            ExternalTool._exit_on_error(tool, error, ctx)
@@ -0,0 +1,254 @@
+import gzip
+import io
+
+import numpy as np
+from loguru import logger
+
+# phred+33 offset of FASTQ quality strings
+PHRED_OFFSET = 33
+
+# first two bytes of any gzip (and bgzip) file
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def is_gzipped(path) -> bool:
+    """detects gzip from a file's magic bytes rather than its extension
+    :param path: file
+    :return: whether the file is gzipped
+    """
+    with open(path, "rb") as handle:
+        return handle.read(2) == GZIP_MAGIC
+
+
+def open_fastq(path):
+    """opens a plain or gzipped FASTQ for binary reading, detecting gzip from its magic bytes
+    :param path: FASTQ file
+    :return: binary file handle
+    """
+    if is_gzipped(path):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def encode_qualities(quality) -> bytes:
+    """encodes a pysam quality array as a FASTQ quality string in one vectorised operation
+    :param quality: pysam query_qualities (array of phred scores)
+    :return: quality string as ASCII bytes
+    """
+    return (np.frombuffer(quality, dtype=np.uint8) + PHRED_OFFSET).tobytes()
+
+
+class FastqWriter:
+    """Buffered FASTQ writer shared by the read binners
+
+    Records are assembled into batches in memory and written with a single
+    call once the batch reaches batch_bytes, through a large file buffer.
+    """
+
+    def __init__(
+        self,
+        path,
+        batch_bytes: int = 4 * 1024 * 1024,
+        buffer_size: int = 1024 * 1024,
+    ) -> None:
+        """
+        Parameters
+        --------
+        path: Path, required
+            output FASTQ file
+        batch_bytes: int, optional
+            size of the record batch written per call
+        buffer_size: int, optional
+            size of the file buffer
+        """
+        self.handle = open(path, "wb", buffering=buffer_size)
+        self.path = path
+        self.batch_bytes = batch_bytes
+        self.batch = []
+        self.batch_size = 0
+        self.record_count = 0
+
+    def write(self, name: bytes, sequence: bytes, quality: bytes) -> None:
+        """adds one record to the current batch
+        :param name: read header without the @
+        :param sequence: read sequence
+        :param quality: phred+33 quality string
+        :return:
+        """
+        record = b"@%s\n%s\n+\n%s\n" % (name, sequence, quality)
+        self.batch.append(record)
+        self.batch_size += len(record)
+        self.record_count += 1
+        if self.batch_size >= self.batch_bytes:
+            self.flush()
+
+    def write_read(self, read) -> None:
+        """adds a pysam AlignedSegment as one record
+        :param read: pysam AlignedSegment
+        :return:
+        """
+        self.write(
+            read.query_name.encode(),
+            read.query_sequence.encode(),
+            encode_qualities(read.query_qualities),
+        )
+
+    def flush(self) -> None:
+        if self.batch:
+            self.handle.write(b"".join(self.batch))
+            self.batch = []
+            self.batch_size = 0
+
+    def close(self) -> None:
+        self.flush()
+        self.handle.close()
+
+    def __enter__(self) -> "FastqWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+# bytes read per chunk by profile_fastq
+PROFILE_CHUNK_BYTES = 16 * 1024 * 1024
+
+# read length quantiles reported by profile_fastq
+PROFILE_LENGTH_QUANTILES = [10, 25, 50, 75, 90]
+
+
+def stream_fastq_lengths(path):
+    """checks every record of a 4-line FASTQ and gets its read lengths in one streaming pass
+    raises ValueError if the file is not a FASTQ
+    :param path: plain or gzipped FASTQ
+    :return: (read lengths array, sum of the quality string bytes), or None at the first wrapped record
+    """
+    length_chunks = []
+    quality_sum = 0
+    remainder = b""
+    with open_fastq(path) as handle:
+        while True:
+            chunk = handle.read(PROFILE_CHUNK_BYTES)
+            lines = (remainder + chunk).split(b"\n")
+            if chunk:
+                # keep the incomplete record for the next chunk
+                complete = (len(lines) - 1) // 4 * 4
+                remainder = b"\n".join(lines[complete:])
+                lines = lines[:complete]
+            else:
+                while lines and lines[-1].strip() == b"":
+                    lines.pop()
+                # checked after the complete records, which may turn out to be wrapped
+                remainder = b"\n".join(lines[len(lines) // 4 * 4 :])
+                lines = lines[: len(lines) // 4 * 4]
+            if b"\r" in chunk or b"\r" in remainder:
+                lines = [line.rstrip(b"\r") for line in lines]
+            headers = lines[0::4]
+            sequences = lines[1::4]
+            pluses = lines[2::4]
+            qualities = lines[3::4]
+            lengths = np.fromiter(
+                map(len, sequences), dtype=np.int64, count=len(sequences)
+            )
+            quality_lengths = np.fromiter(
+                map(len, qualities), dtype=np.int64, count=len(qualities)
+            )
+            valid = (
+                np.fromiter(
+                    (header.startswith(b"@") for header in headers),
+                    dtype=bool,
+                    count=len(headers),
+                )
+                & np.fromiter(
+                    (plus.startswith(b"+") for plus in pluses),
+                    dtype=bool,
+                    count=len(pluses),
+                )
+                & (lengths == quality_lengths)
+            )
+            if not valid.all():
+                # the records before the first bad one are fine, so it is the first out of step
+                bad = int(np.argmin(valid))
+                if headers[bad].startswith(b"@") and (
+                    not pluses[bad].startswith(b"+")
+                    or quality_lengths[bad] < lengths[bad]
+                ):
+                    # the sequence or quality of a multi-line FASTQ record continues on the next line
+                    return None
+                raise ValueError(f"{path} is not in the FASTQ format.")
+            length_chunks.append(lengths)
+            quality_sum += int(
+                np.frombuffer(b"".join(qualities), dtype=np.uint8).sum(dtype=np.int64)
+            )
+            if not chunk:
+                if remainder:
+                    raise ValueError(f"{path} ends with a truncated FASTQ record.")
+                break
+    return np.concatenate(length_chunks), quality_sum
+
+
+def parse_fastq_lengths(path):
+    """checks every record of any FASTQ, including multi-line ones with wrapped sequences, and gets its read lengths
+    slower than stream_fastq_lengths, so only used for the wrapped FASTQs it hands over
+    raises ValueError if the file is not a FASTQ
+    :param path: plain or gzipped FASTQ
+    :return: (read lengths array, sum of the quality string bytes)
+    """
+    from Bio.SeqIO.QualityIO import FastqGeneralIterator
+
+    lengths = []
+    quality_sum = 0
+    with io.TextIOWrapper(open_fastq(path), encoding="ascii") as handle:
+        for _, sequence, quality in FastqGeneralIterator(handle):
+            lengths.append(len(sequence))
+            quality_sum += sum(quality.encode("ascii"))
+    return np.array(lengths, dtype=np.int64), quality_sum
+
+
+def profile_fastq(path) -> dict:
+    """checks every record of a FASTQ and profiles its reads in one streaming pass
+    :param path: plain or gzipped FASTQ, detected from its magic bytes
+    :return: profile: dictionary of gzipped, read_count, total_bases, min_length, max_length,
+        mean_length, length_quantiles, n50 and mean_quality (mean phred score of all bases)
+    """
+    gzipped = is_gzipped(path)
+
+    try:
+        streamed = stream_fastq_lengths(path)
+        # a multi-line FASTQ with wrapped records
+        if streamed is None:
+            streamed = parse_fastq_lengths(path)
+    except (ValueError, UnicodeDecodeError):
+        logger.error(f"{path} is not in the FASTQ format")
+    lengths, quality_sum = streamed
+    read_count = len(lengths)
+    total_bases = int(lengths.sum())
+    profile = {
+        "gzipped": gzipped,
+        "read_count": read_count,
+        "total_bases": total_bases,
+    }
+    if read_count == 0:
+        return profile
+    # N50 - the length of the read at which half of the bases are in reads at least as long
+    sorted_lengths = np.sort(lengths)[::-1]
+    n50 = int(
+        sorted_lengths[np.searchsorted(np.cumsum(sorted_lengths), total_bases / 2)]
+    )
+    profile.update(
+        {
+            "min_length": int(sorted_lengths[-1]),
+            "max_length": int(sorted_lengths[0]),
+            "mean_length": round(total_bases / read_count, 2),
+            # the nearest length below each quantile, as np.percentile(method="lower")
+            "length_quantiles": {
+                str(q): int(
+                    sorted_lengths[read_count - 1 - q * (read_count - 1) // 100]
+                )
+                for q in PROFILE_LENGTH_QUANTILES
+            },
+            "n50": n50,
+            "mean_quality": round(quality_sum / max(total_bases, 1) - PHRED_OFFSET, 2),
+        }
+    )
+    return profile
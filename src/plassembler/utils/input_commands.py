@@ -1,38 +1,79 @@
-import gzip
+import json
 import os
+import shutil
 import subprocess as sp
+from concurrent.futures import ThreadPoolExecutor
 
 from Bio import SeqIO
 from loguru import logger
 
+from plassembler.utils.fastq import profile_fastq
 
-def validate_fastq(file):
-    """Checks the input fastq is really a fastq
+# profiles of the input FASTQs cached in the output directory
+FASTQ_PROFILES = "fastq_profiles.json"
+
+
+def get_fastq_profile(file, outdir=None):
+    """profile of a FASTQ from profile_fastq
+    cached in the output directory, so later stages never re-read the reads
+    :param file: fastq file
+    :param outdir: output directory - None to not cache the profile
+    :return: profile dictionary
+    """
+    path = os.path.realpath(file)
+    stat = os.stat(path)
+    # a replaced input is profiled again
+    key = [path, stat.st_size, stat.st_mtime_ns]
+    profiles = {}
+    if outdir is not None:
+        profiles_file = os.path.join(outdir, FASTQ_PROFILES)
+        if os.path.isfile(profiles_file):
+            with open(profiles_file, "r") as f:
+                profiles = json.load(f)
+        cached = profiles.get(path)
+        if cached is not None and cached["key"] == key:
+            return cached["profile"]
+
+    profile = profile_fastq(path)
+    if outdir is not None:
+        profiles[path] = {"key": key, "profile": profile}
+        tmp_file = f"{profiles_file}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(profiles, f, indent=4)
+        os.replace(tmp_file, profiles_file)
+    return profile
+
+
+def validate_fastq(file, outdir=None):
+    """Checks every record of the input fastq and profiles its reads in one pass
         :param file: fastq file
+        :param outdir: output directory the profile is cached in
     :return: zipped - Boolean whether the input fastq is gzipped.
     """
+    profile = get_fastq_profile(file, outdir)
+    if profile["read_count"] == 0:
+        logger.error(f"Input file {file} is not in the FASTQ format.")
+        return profile["gzipped"]
+    logger.info(f"FASTQ {file} checked")
+    logger.info(
+        f"FASTQ {file} has {profile['read_count']} reads and {profile['total_bases']} bases, "
+        f"with a read N50 of {profile['n50']} and a mean quality of {profile['mean_quality']}."
+    )
+    return profile["gzipped"]
 
-    # to get extension
-    filename, file_extension = os.path.splitext(file)
-    # flag for whether file is zipped
-    zipped = True
-    if file_extension == ".gz":
-        # if gzipped
-        with gzip.open(file, "rt") as handle:
-            fastq = SeqIO.parse(handle, "fastq")
-            if any(fastq):
-                logger.info(f"FASTQ {file} checked")
-            else:
-                logger.error(f"Input file {file} is not in the FASTQ format.")
-    else:
-        zipped = False
-        with open(file, "r") as handle:
-            fastq = SeqIO.parse(handle, "fastq")
-            if any(fastq):
-                logger.info(f"FASTQ {file} checked")
-            else:
-                logger.error(f"Input file {file} is not in the FASTQ format.")
-    return zipped
+
+def check_long_read_bases(longreads, outdir, chromosome):
+    """Stops before any assembly when the long reads are too few to assemble a chromosome
+        :param longreads: long read file, already profiled by validate_fastq
+        :param outdir: output directory the profile is cached in
+        :param chromosome: lower-bound chromosome length
+    :return:
+    """
+    total_bases = get_fastq_profile(longreads, outdir)["total_bases"]
+    if total_bases < chromosome:
+        logger.error(
+            f"The long reads in {longreads} total only {total_bases} bases, fewer than the chromosome length of {chromosome}, so no chromosome can be assembled. \nIncreasing sequencing depth is recommended. \nAlso please check your -c or --chromosome parameter, it may be too high."
+        )
 
 
 def validate_fasta(filename):
@@ -69,11 +110,12 @@ def validate_fastas_assembled_mode(input_chromosome, input_plasmids):
     validate_fasta(input_plasmids)
 
 
-def validate_fastqs_assembled_mode(longreads, short_one, short_two):
+def validate_fastqs_assembled_mode(longreads, short_one, short_two, outdir=None):
     """Checks the input instq are really fastqs
         :param longreads: long read file
         :param short_one: short_one read file
         :param short_two: short_two read file
+        :param outdir: output directory the profiles are cached in
     :return:
     """
 
@@ -82,15 +124,15 @@ def validate_fastqs_assembled_mode(longreads, short_one, short_two):
     long_gzipped = False
     if longreads != "nothing":
         logger.info("You have input long read FASTQs for depth calculation.")
-        long_gzipped = validate_fastq(longreads)
+        long_gzipped = validate_fastq(longreads, outdir)
         long_flag = True
 
     # short
     short_flag = False
     if short_one != "nothing" and short_two != "nothing":
         logger.info("You have input paired short read FASTQs for depth calculation.")
-        s1_gzipped = validate_fastq(short_one)
-        s2_gzipped = validate_fastq(short_two)
+        s1_gzipped = validate_fastq(short_one, outdir)
+        s2_gzipped = validate_fastq(short_two, outdir)
         if s1_gzipped != s2_gzipped:
             logger.error(
                 "R1 and R2 files are inconsistenly compressed. Please check the compression format and try again."
@@ -112,16 +154,141 @@ def validate_fastqs_assembled_mode(longreads, short_one, short_two):
     return (short_flag, long_flag, long_gzipped)
 
 
+# version command of each dependency, the stream it prints the version on and how to parse it
+DEPENDENCY_PROBES = {
+    "flye": (["flye", "--version"], "combined", lambda out: out.strip()),
+    "raven": (["raven", "--version"], "stdout", lambda out: out.split("\n")[0]),
+    # get rid of the "v"
+    "unicycler": (
+        ["unicycler", "--version"],
+        "combined",
+        lambda out: out.split(" ")[1][1:],
+    ),
+    "spades": (
+        ["spades.py", "--version"],
+        "stdout",
+        lambda out: out.split(" ")[3].split("\n")[0],
+    ),
+    "minimap2": (["minimap2", "--version"], "stdout", lambda out: out.split("\n")[0]),
+    "fastp": (
+        ["fastp", "--version"],
+        "stderr",
+        lambda out: out.split("\n")[0].split(" ")[1],
+    ),
+    "chopper": (
+        ["chopper", "--version"],
+        "stdout",
+        lambda out: out.split("\n")[0].split(" ")[1],
+    ),
+    "mash": (
+        ["mash", "version"],
+        "stdout",
+        lambda out: [line for line in out.split("\n") if "version" in line][0].split(
+            " "
+        )[2],
+    ),
+}
+
+# cached versions of the dependencies
+DEPENDENCY_CACHE = "dependencies.json"
+
+
+def get_cache_dir():
+    """plassembler's cache directory
+    $PLASSEMBLER_CACHE_DIR, otherwise plassembler in $XDG_CACHE_HOME or ~/.cache
+    :return: cache directory
+    """
+    cache_dir = os.environ.get("PLASSEMBLER_CACHE_DIR")
+    if cache_dir is None:
+        cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+            os.path.expanduser("~"), ".cache"
+        )
+        cache_dir = os.path.join(cache_home, "plassembler")
+    return cache_dir
+
+
+def get_binary_key(executable):
+    """identifies the binary a command runs - a reinstall changes its path or mtime
+    :param executable: command name
+    :return: [resolved path, mtime_ns] or None if it is not on the PATH
+    """
+    path = shutil.which(executable)
+    if path is None:
+        return None
+    path = os.path.realpath(path)
+    return [path, os.stat(path).st_mtime_ns]
+
+
+def probe_dependency(name):
+    """runs the version command of one dependency
+    :param name: key of DEPENDENCY_PROBES
+    :return: version or None if it is not found or its version cannot be parsed
+    """
+    command, stream, parse = DEPENDENCY_PROBES[name]
+    try:
+        process = sp.run(
+            command,
+            stdout=sp.PIPE,
+            stderr=sp.STDOUT if stream == "combined" else sp.PIPE,
+        )
+        out = process.stderr if stream == "stderr" else process.stdout
+        return parse(out.decode())
+    except Exception:
+        return None
+
+
+def get_dependency_versions():
+    """versions of all dependencies
+    binaries unchanged since they were last probed are taken from the cache, the rest are probed concurrently
+    :return: dictionary of versions, None for dependencies that were not found
+    """
+    cache_file = os.path.join(get_cache_dir(), DEPENDENCY_CACHE)
+    try:
+        with open(cache_file, "r") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+
+    keys = {
+        name: get_binary_key(DEPENDENCY_PROBES[name][0][0])
+        for name in DEPENDENCY_PROBES
+    }
+    versions = {}
+    for name, key in keys.items():
+        cached = cache.get(name)
+        if key is not None and cached is not None and cached["key"] == key:
+            versions[name] = cached["version"]
+    to_probe = [name for name in DEPENDENCY_PROBES if name not in versions]
+    if to_probe:
+        with ThreadPoolExecutor(max_workers=len(to_probe)) as executor:
+            for name, version in zip(
+                to_probe, executor.map(probe_dependency, to_probe)
+            ):
+                versions[name] = version
+                if version is not None and keys[name] is not None:
+                    cache[name] = {"key": keys[name], "version": version}
+        # the cache is an optimisation only, e.g. the home directory may be read only
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+            with open(tmp_file, "w") as f:
+                json.dump(cache, f, indent=1)
+            os.replace(tmp_file, cache_file)
+        except OSError:
+            pass
+    return versions
+
+
 def check_dependencies():
     """Checks the version of Unicycler, spades and Raven
     :return:
     """
 
+    versions = get_dependency_versions()
+
     # Flye
     try:
-        process = sp.Popen(["flye", "--version"], stdout=sp.PIPE, stderr=sp.STDOUT)
-        flye_out, _ = process.communicate()
-        flye_out = flye_out.decode().strip()
+        flye_out = versions["flye"]
         flye_major_version = int(flye_out.split(".")[0])
         flye_minor_version = int(flye_out.split(".")[1])
         flye_minorest_version = flye_out.split(".")[2]
@@ -150,27 +317,17 @@ def check_dependencies():
     logger.info(message)
 
     # raven
-    try:
-        process = sp.Popen(["raven", "--version"], stdout=sp.PIPE, stderr=sp.PIPE)
-        raven_out, _ = process.communicate()
-        raven_version = raven_out.decode()
-        raven_version = raven_version.split("\n")[0]
-        message = "Raven v" + str(raven_version) + " found."
+    if versions["raven"] is None:
+        logger.error("Raven not found")
+    else:
+        message = "Raven v" + str(versions["raven"]) + " found."
         logger.info(message)
         message = "Raven version is ok."
         logger.info(message)
-    except Exception:
-        logger.error("Raven not found")
 
     # unicycler
     try:
-        process = sp.Popen(["unicycler", "--version"], stdout=sp.PIPE, stderr=sp.STDOUT)
-        unicycler_out, _ = process.communicate()
-        unicycler_out = unicycler_out.decode()
-        unicycler_version = unicycler_out.split(" ")[1]
-        # get rid of the "v"
-        unicycler_version = unicycler_version[1:]
-
+        unicycler_version = versions["unicycler"]
         unicycler_major_version = int(unicycler_version.split(".")[0])
         unicycler_minor_version = int(unicycler_version.split(".")[1])
         unicycler_minorest_version = int(unicycler_version.split(".")[2])
@@ -203,77 +360,39 @@ def check_dependencies():
         logger.info(message)
 
     # spades
-    try:
-        process = sp.Popen(["spades.py", "--version"], stdout=sp.PIPE, stderr=sp.PIPE)
-        spades_out, _ = process.communicate()
-        spades_out = spades_out.decode()
-        spades_version = spades_out.split(" ")[3]
-        spades_version = spades_version.split("\n")[0]
-        message = "SPAdes " + str(spades_version) + " found."
-        logger.info(message)
-    except Exception:
+    if versions["spades"] is None:
         logger.error("SPAdes not found.")
-
-    # samtools
-    try:
-        process = sp.Popen(["samtools", "--version"], stdout=sp.PIPE, stderr=sp.PIPE)
-        samtools_out, _ = process.communicate()
-        samtools_out = samtools_out.decode()
-        samtools_version = samtools_out.split("\n")[0].split(" ")[
-            1
-        ]  # get second line, and then second component of line
-        message = "Samtools v" + str(samtools_version) + " found."
+    else:
+        message = "SPAdes " + str(versions["spades"]) + " found."
         logger.info(message)
-    except Exception:
-        logger.error("Samtools not found.")
 
     # minimap2
-    try:
-        process = sp.Popen(["minimap2", "--version"], stdout=sp.PIPE, stderr=sp.PIPE)
-        minimap2_out, _ = process.communicate()
-        minimap2_version = minimap2_out.decode()
-        minimap2_version = minimap2_version.split("\n")[0]
-        message = "minimap2 v" + str(minimap2_version) + " found."
-        logger.info(message)
-    except Exception:
+    if versions["minimap2"] is None:
         logger.error("minimap2 not found.")
+    else:
+        message = "minimap2 v" + str(versions["minimap2"]) + " found."
+        logger.info(message)
 
     # fastp
-    try:
-        process = sp.Popen(["fastp", "--version"], stdout=sp.PIPE, stderr=sp.PIPE)
-        _, fastp_out = process.communicate()
-        fastp_version = fastp_out.decode()
-        fastp_version = fastp_version.split("\n")[0].split(" ")[1]
-        message = "fastp v" + str(fastp_version) + " found."
-        logger.info(message)
-    except Exception:
+    if versions["fastp"] is None:
         logger.error("fastp not found.")
+    else:
+        message = "fastp v" + str(versions["fastp"]) + " found."
+        logger.info(message)
 
     # chopper
-    try:
-        process = sp.Popen(["chopper", "--version"], stdout=sp.PIPE, stderr=sp.PIPE)
-        chopper_out, _ = process.communicate()
-        chopper_version = chopper_out.decode()
-        chopper_version = chopper_version.split("\n")[0].split(" ")[1]
-        message = "chopper v" + str(chopper_version) + " found."
-        logger.info(message)
-    except Exception:
+    if versions["chopper"] is None:
         logger.error("chopper not found.")
+    else:
+        message = "chopper v" + str(versions["chopper"]) + " found."
+        logger.info(message)
 
     # mash
-    try:
-        process = sp.Popen(["mash", "version"], stdout=sp.PIPE, stderr=sp.PIPE)
-        mash_out, _ = process.communicate()
-        mash_out = mash_out.decode()
-        version_line = []
-        for line in mash_out.split("\n"):
-            if "version" in line:
-                version_line.append(line)
-        mash_version = version_line[0].split(" ")[2]
-        message = "mash v" + str(mash_version) + " found."
-        logger.info(message)
-    except Exception:
+    if versions["mash"] is None:
         logger.error("mash not found")
+    else:
+        message = "mash v" + str(versions["mash"]) + " found."
+        logger.info(message)
 
     # all dependencies found
     logger.info("All dependencies found.")
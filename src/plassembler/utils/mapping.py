@@ -1,17 +1,54 @@
+import os
+from pathlib import Path
+
 from plassembler.utils.external_tools import ExternalTool
+from plassembler.utils.util import hash_file
 
 #################################
-# original mapping
+# index cache
 #################################
 
 
-def minimap_long_reads(input_long_reads, fasta, sam, threads, pacbio_model, logdir):
-    """maps long reads using minimap2
-    :param threads: threads
-    :param pacbio_model: pacbio_model
+def get_minimap2_index(fasta, minimap2_model, threads, logdir):
+    """builds a minimap2 index of fasta for a preset once, and reuses it on later calls
+    the index is named by the sha256 of the reference, so a changed reference is re-indexed
+    :param fasta: reference fasta
+    :param minimap2_model: minimap2 -x preset
     :param threads: threads
     :param logdir: logdir
-    :return:
+    :return: index: Path to the .mmi index
+    """
+
+    fasta = Path(fasta)
+    digest = hash_file(fasta)[:16]
+    index: Path = fasta.parent / f"{fasta.stem}.{minimap2_model}.{digest}.mmi"
+
+    if not index.exists():
+        # build under a temporary name so an interrupted build is never reused
+        tmp_index: Path = fasta.parent / f"{index.name}.tmp"
+        minimap2 = ExternalTool(
+            tool="minimap2",
+            input="",
+            output="",
+            params=f" -x {minimap2_model} -t {threads} -d {tmp_index} {fasta}",
+            logdir=logdir,
+            outfile="",
+        )
+        ExternalTool.run_tool(minimap2, to_stdout=False)
+        os.replace(tmp_index, index)
+
+    return index
+
+
+#################################
+# original mapping
+#################################
+
+
+def get_minimap2_long_read_model(pacbio_model):
+    """gets the minimap2 preset for the long reads
+    :param pacbio_model: pacbio_model
+    :return: minimap2_model: minimap2 -x preset
     """
 
     # ONT
@@ -27,38 +64,77 @@ def minimap_long_reads(input_long_reads, fasta, sam, threads, pacbio_model, logd
     elif pacbio_model == "--pacbio-hifi":
         minimap2_model = "map-hifi"
 
+    return minimap2_model
+
+
+def minimap_output_flag(output_format):
+    """minimap2 flag for the output format
+    :param output_format: "sam" or "paf" - PAF with base-level cg:Z: cigars
+    :return: flag
+    """
+    if output_format == "sam":
+        return "-a"
+    elif output_format == "paf":
+        return "-c"
+    raise ValueError(f"Unknown minimap2 output format {output_format}")
+
+
+def minimap_long_reads_to_pipe(
+    input_long_reads,
+    fasta,
+    threads,
+    pacbio_model,
+    logdir,
+    consumer,
+    output_format="sam",
+):
+    """maps long reads using minimap2 and streams the output into consumer without writing it to disk
+    :param threads: threads
+    :param pacbio_model: pacbio_model
+    :param logdir: logdir
+    :param consumer: function taking minimap2's stdout e.g. the long read binner
+    :param output_format: "sam" or "paf"
+    :return: the return value of consumer
+    """
+
+    minimap2_model = get_minimap2_long_read_model(pacbio_model)
+    index = get_minimap2_index(fasta, minimap2_model, threads, logdir)
+
     minimap2 = ExternalTool(
         tool="minimap2",
         input="",
         output="",
-        params=f" -ax {minimap2_model} -t {threads} {fasta} {input_long_reads}",
+        params=f" {minimap_output_flag(output_format)} -x {minimap2_model} -t {threads} {index} {input_long_reads}",
         logdir=logdir,
-        outfile=sam,
+        outfile="",
     )
 
-    # need to write to stdout
-    ExternalTool.run_tool(minimap2, to_stdout=True)
+    return ExternalTool.run_tool_to_pipe(minimap2, consumer)
 
 
 # short reads
 
 
-def minimap_short_reads(r1, r2, fasta, sam, threads, logdir):
-    """maps short reads using minimap2
-    :param outdir: output directory path
+def minimap_short_reads_to_pipe(
+    r1, r2, fasta, threads, logdir, consumer, output_format="sam"
+):
+    """maps short reads using minimap2 and streams the output into consumer without writing it to disk
     :param threads: threads
     :param logdir: logdir
-    :return:
+    :param consumer: function taking minimap2's stdout e.g. the short read pair splitter
+    :param output_format: "sam" or "paf"
+    :return: the return value of consumer
     """
 
+    index = get_minimap2_index(fasta, "sr", threads, logdir)
+
     minimap2 = ExternalTool(
         tool="minimap2",
         input="",
         output="",
-        params=f" -ax sr -t {threads} {fasta} {r1} {r2}",
+        params=f" {minimap_output_flag(output_format)} -x sr -t {threads} {index} {r1} {r2}",
         logdir=logdir,
-        outfile=sam,
+        outfile="",
     )
 
-    # need to write to stdout
-    ExternalTool.run_tool(minimap2, to_stdout=True)
+    return ExternalTool.run_tool_to_pipe(minimap2, consumer)
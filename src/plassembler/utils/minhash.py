@@ -0,0 +1,502 @@
+import json
+import math
+import os
+import shutil
+from functools import lru_cache
+
+import numpy as np
+from Bio import SeqIO
+
+# mash sketch defaults used for PLSDB
+MASH_SEED = 42
+MASH_KMER_SIZE = 21
+MASH_SKETCH_SIZE = 1000
+
+# directory of the memory-mapped PLSDB sketch index in the database directory
+PLSDB_SKETCH_INDEX = "plsdb_sketch"
+
+# murmurhash3 x64 128 constants
+C1 = np.uint64(0x87C37B91114253D5)
+C2 = np.uint64(0x4CF5AD432745937F)
+
+# ACGT as 2 bit codes, everything else invalid
+BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for code, base in enumerate(b"ACGT"):
+    BASE_CODES[base] = code
+COMPLEMENT_BASES = np.frombuffer(b"TGCAN", dtype=np.uint8)
+
+
+#################################
+# mash .msh (Cap'n Proto) reader
+#################################
+
+
+class CapnpMessage:
+    """Minimal reader of an unpacked Cap'n Proto message, enough for mash sketches"""
+
+    def __init__(self, data: bytes) -> None:
+        """
+        Parameters
+        --------
+        data: bytes, required
+            the message including its segment table
+        """
+        words = np.frombuffer(data, dtype="<u4")
+        segment_count = int(words[0]) + 1
+        sizes = words[1 : 1 + segment_count].astype(np.int64)
+        # the segment table is padded to a whole word
+        start = ((1 + segment_count) * 4 + 7) // 8
+        self.segments = []
+        for size in sizes:
+            self.segments.append(data[start * 8 : (start + size) * 8])
+            start += size
+
+    def word(self, segment, offset) -> int:
+        return int.from_bytes(
+            self.segments[segment][offset * 8 : offset * 8 + 8], "little"
+        )
+
+    def resolve(self, segment, offset):
+        """follows far pointers to the pointer describing the target
+        :return: segment, pointer offset, pointer word, target offset
+        """
+        pointer = self.word(segment, offset)
+        if pointer & 3 == 2:  # far pointer to a landing pad
+            double_far = (pointer >> 2) & 1
+            pad_offset = (pointer >> 3) & 0x1FFFFFFF
+            segment = pointer >> 32
+            if double_far:
+                raise ValueError("Double far pointers are not supported")
+            offset = pad_offset
+            pointer = self.word(segment, offset)
+        # signed 30 bit offset from the end of the pointer
+        relative = (pointer >> 2) & 0x3FFFFFFF
+        if relative >= 1 << 29:
+            relative -= 1 << 30
+        return segment, pointer, offset + 1 + relative
+
+    def struct(self, segment, offset):
+        """reads a struct pointer
+        :return: (segment, data offset, data words, pointer count) or None for a null pointer
+        """
+        if self.word(segment, offset) == 0:
+            return None
+        segment, pointer, target = self.resolve(segment, offset)
+        return segment, target, (pointer >> 32) & 0xFFFF, pointer >> 48
+
+    def list(self, segment, offset):
+        """reads a list pointer
+        :return: (segment, element offset, element size code, count, words per element) or None
+        """
+        if self.word(segment, offset) == 0:
+            return None
+        segment, pointer, target = self.resolve(segment, offset)
+        size_code = (pointer >> 32) & 7
+        count = pointer >> 35
+        if size_code == 7:  # composite - a tag word gives the element count and layout
+            tag = self.word(segment, target)
+            return segment, target + 1, 7, (tag >> 2) & 0x3FFFFFFF, tag >> 32
+        return segment, target, size_code, count, None
+
+    def text(self, segment, offset) -> str:
+        pointer = self.list(segment, offset)
+        if pointer is None:
+            return ""
+        segment, target, _, count, _ = pointer
+        # drop the NUL terminator
+        return self.segments[segment][target * 8 : target * 8 + count - 1].decode()
+
+    def uint64_list(self, segment, offset) -> np.ndarray:
+        pointer = self.list(segment, offset)
+        if pointer is None:
+            return np.empty(0, dtype=np.uint64)
+        segment, target, _, count, _ = pointer
+        return np.frombuffer(
+            self.segments[segment], dtype="<u8", count=count, offset=target * 8
+        ).astype(np.uint64)
+
+
+def read_mash_sketch(msh_file):
+    """reads the sketches of a mash .msh file with 64 bit hashes
+    :param msh_file: mash sketch file
+    :return: dictionary of kmer_size, sketch_size and lists of names, lengths and sorted hash arrays
+    """
+    with open(msh_file, "rb") as f:
+        message = CapnpMessage(f.read())
+
+    segment, root, data_words, _ = message.struct(0, 0)
+    data = message.segments[segment][root * 8 : (root + data_words) * 8]
+    kmer_size = int.from_bytes(data[0:4], "little")
+    sketch_size = int.from_bytes(data[8:12], "little")
+
+    names, lengths, hashes = [], [], []
+    pointers = root + data_words
+    # the reference list and its pre-64 bit predecessor are the first two pointers
+    for list_pointer in (pointers, pointers + 1):
+        reference_list = message.struct(segment, list_pointer)
+        if reference_list is None:
+            continue
+        list_segment, list_data, list_data_words, _ = reference_list
+        references = message.list(list_segment, list_data + list_data_words)
+        if references is None:
+            continue
+        ref_segment, first, _, count, layout = references
+        ref_data_words = layout & 0xFFFF
+        ref_pointer_count = layout >> 16
+        for i in range(count):
+            ref = first + i * (ref_data_words + ref_pointer_count)
+            ref_pointers = ref + ref_data_words
+            length = message.word(ref_segment, ref) & 0xFFFFFFFF
+            if ref_data_words > 1:
+                length = max(length, message.word(ref_segment, ref + 1))
+            names.append(message.text(ref_segment, ref_pointers + 2))
+            lengths.append(length)
+            hashes.append(np.sort(message.uint64_list(ref_segment, ref_pointers + 5)))
+
+    return {
+        "kmer_size": kmer_size,
+        "sketch_size": sketch_size,
+        "names": names,
+        "lengths": lengths,
+        "hashes": hashes,
+    }
+
+
+#################################
+# sketching
+#################################
+
+
+def rotl64(x, r):
+    return (x << np.uint64(r)) | (x >> np.uint64(64 - r))
+
+
+def fmix64(k):
+    k ^= k >> np.uint64(33)
+    k *= np.uint64(0xFF51AFD7ED558CCD)
+    k ^= k >> np.uint64(33)
+    k *= np.uint64(0xC4CEB9FE1A85EC53)
+    k ^= k >> np.uint64(33)
+    return k
+
+
+def murmurhash3_x64_64(keys: np.ndarray, seed: int = MASH_SEED) -> np.ndarray:
+    """first 64 bits of MurmurHash3_x64_128 of many equal length keys at once, as mash uses
+    :param keys: uint8 array of shape (number of keys, key length)
+    :param seed: hash seed
+    :return: uint64 array of hashes
+    """
+    n, length = keys.shape
+    h1 = np.full(n, seed, dtype=np.uint64)
+    h2 = np.full(n, seed, dtype=np.uint64)
+    nblocks = length // 16
+    keys = np.ascontiguousarray(keys)
+
+    for block in range(nblocks):
+        k1 = keys[:, block * 16 : block * 16 + 8].copy().view("<u8").ravel()
+        k2 = keys[:, block * 16 + 8 : block * 16 + 16].copy().view("<u8").ravel()
+        k1 = rotl64(k1 * C1, 31) * C2
+        h1 ^= k1
+        h1 = rotl64(h1, 27) + h2
+        h1 = h1 * np.uint64(5) + np.uint64(0x52DCE729)
+        k2 = rotl64(k2 * C2, 33) * C1
+        h2 ^= k2
+        h2 = rotl64(h2, 31) + h1
+        h2 = h2 * np.uint64(5) + np.uint64(0x38495AB5)
+
+    tail = keys[:, nblocks * 16 :].astype(np.uint64)
+    k1 = np.zeros(n, dtype=np.uint64)
+    k2 = np.zeros(n, dtype=np.uint64)
+    for i in range(tail.shape[1] - 1, 7, -1):
+        k2 ^= tail[:, i] << np.uint64(8 * (i - 8))
+    if tail.shape[1] > 8:
+        h2 ^= rotl64(k2 * C2, 33) * C1
+    for i in range(min(tail.shape[1], 8) - 1, -1, -1):
+        k1 ^= tail[:, i] << np.uint64(8 * i)
+    if tail.shape[1] > 0:
+        h1 ^= rotl64(k1 * C1, 31) * C2
+
+    h1 ^= np.uint64(length)
+    h2 ^= np.uint64(length)
+    h1 += h2
+    h2 += h1
+    h1 = fmix64(h1)
+    h2 = fmix64(h2)
+    return h1 + h2
+
+
+def sketch_sequence(
+    sequence: bytes,
+    kmer_size: int = MASH_KMER_SIZE,
+    sketch_size: int = MASH_SKETCH_SIZE,
+    seed: int = MASH_SEED,
+) -> np.ndarray:
+    """bottom-s MinHash sketch of the canonical k-mers of a sequence, as mash sketch
+    k-mers containing anything but ACGT are skipped
+    :param sequence: sequence bytes
+    :return: sorted uint64 array of at most sketch_size hashes
+    """
+    seq = np.frombuffer(sequence.upper(), dtype=np.uint8)
+    if len(seq) < kmer_size:
+        return np.empty(0, dtype=np.uint64)
+
+    codes = BASE_CODES[seq]
+    # the reverse complement k-mers are windows of the reverse complemented sequence
+    forward = np.lib.stride_tricks.sliding_window_view(seq, kmer_size)
+    reverse = np.lib.stride_tricks.sliding_window_view(
+        COMPLEMENT_BASES[codes][::-1], kmer_size
+    )[::-1]
+    # drop k-mers with invalid bases
+    invalid = np.r_[0, np.cumsum(codes > 3)]
+    valid = invalid[kmer_size:] == invalid[:-kmer_size]
+    forward = forward[valid]
+    reverse = reverse[valid]
+    if len(forward) == 0:
+        return np.empty(0, dtype=np.uint64)
+
+    # canonical k-mer - the lexicographically smaller strand
+    differs = forward != reverse
+    first = differs.argmax(axis=1)
+    rows = np.arange(len(forward))
+    use_reverse = differs[rows, first] & (reverse[rows, first] < forward[rows, first])
+    canonical = np.where(use_reverse[:, None], reverse, forward)
+
+    # bottom sketch_size distinct hashes
+    hashes = np.sort(murmurhash3_x64_64(canonical, seed))
+    hashes = hashes[np.r_[True, hashes[1:] != hashes[:-1]]]
+    return hashes[:sketch_size]
+
+
+def sketch_fasta(fasta, kmer_size=MASH_KMER_SIZE, sketch_size=MASH_SKETCH_SIZE):
+    """sketches each record of a FASTA individually, as mash sketch -i
+    :param fasta: FASTA file
+    :return: dictionary of kmer_size, sketch_size and lists of names, lengths and sorted hash arrays
+    """
+    names, lengths, hashes = [], [], []
+    for record in SeqIO.parse(fasta, "fasta"):
+        sequence = bytes(record.seq)
+        names.append(record.id)
+        lengths.append(len(sequence))
+        hashes.append(sketch_sequence(sequence, kmer_size, sketch_size))
+    return {
+        "kmer_size": kmer_size,
+        "sketch_size": sketch_size,
+        "names": names,
+        "lengths": lengths,
+        "hashes": hashes,
+    }
+
+
+#################################
+# memory-mapped PLSDB index
+#################################
+
+
+def build_sketch_index(msh_file, index_dir):
+    """converts a mash sketch into an inverted index of memory-mappable arrays
+    hashes.npy holds every hash sorted, with the sketch and rank within the sketch of each in sketches.npy and ranks.npy
+    :param msh_file: mash sketch file e.g. plsdb.msh
+    :param index_dir: output directory
+    :return:
+    """
+    sketch = read_mash_sketch(msh_file)
+    # mash only uses the 64 bit hashes sketch_sequence computes above k = 16
+    if sketch["kmer_size"] <= 16:
+        raise ValueError(f"{msh_file} uses 32 bit hashes, which are not supported")
+    # built aside and swapped in whole - runs sharing the database may build it at the same time
+    tmp_dir = f"{index_dir}.{os.getpid()}.tmp"
+    if os.path.isdir(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    sizes = np.array([len(h) for h in sketch["hashes"]], dtype=np.int64)
+    hashes = np.concatenate(sketch["hashes"] + [np.empty(0, dtype=np.uint64)])
+    sketches = np.repeat(np.arange(len(sizes), dtype=np.int32), sizes)
+    ranks = np.concatenate(
+        [np.arange(size, dtype=np.int32) for size in sizes]
+        + [np.empty(0, dtype=np.int32)]
+    )
+    order = np.argsort(hashes, kind="stable")
+
+    np.save(os.path.join(tmp_dir, "hashes.npy"), hashes[order])
+    np.save(os.path.join(tmp_dir, "sketches.npy"), sketches[order])
+    np.save(os.path.join(tmp_dir, "ranks.npy"), ranks[order])
+    np.save(os.path.join(tmp_dir, "sizes.npy"), sizes)
+    np.save(
+        os.path.join(tmp_dir, "lengths.npy"),
+        np.array(sketch["lengths"], dtype=np.int64),
+    )
+    with open(os.path.join(tmp_dir, "names.txt"), "w") as f:
+        f.write("".join(f"{name}\n" for name in sketch["names"]))
+    with open(os.path.join(tmp_dir, "index.json"), "w") as f:
+        json.dump(
+            {"kmer_size": sketch["kmer_size"], "sketch_size": sketch["sketch_size"]}, f
+        )
+    # replaces a stale index
+    if os.path.isdir(index_dir):
+        shutil.rmtree(index_dir, ignore_errors=True)
+    try:
+        os.rename(tmp_dir, index_dir)
+    except OSError:
+        # another run swapped its index in first
+        shutil.rmtree(tmp_dir)
+
+
+def get_plsdb_sketch_index(plassembler_db_dir):
+    """path of the PLSDB sketch index if it is complete and up to date
+    :param plassembler_db_dir: database directory
+    :return: index directory or None to fall back to mash
+    """
+    index_dir = os.path.join(plassembler_db_dir, PLSDB_SKETCH_INDEX)
+    index_json = os.path.join(index_dir, "index.json")
+    if not os.path.isfile(index_json):
+        return None
+    # a replaced plsdb.msh makes the index stale
+    plsdb_sketch = os.path.join(plassembler_db_dir, "plsdb.msh")
+    if os.path.getmtime(index_json) < os.path.getmtime(plsdb_sketch):
+        return None
+    return index_dir
+
+
+@lru_cache(maxsize=None)
+def load_sketch_index(index_dir):
+    """memory-maps a sketch index once per process
+    :param index_dir: directory from build_sketch_index
+    :return: dictionary of the index arrays and parameters
+    """
+    with open(os.path.join(index_dir, "index.json"), "r") as f:
+        index = json.load(f)
+    for array in ["hashes", "sketches", "ranks", "sizes", "lengths"]:
+        index[array] = np.load(os.path.join(index_dir, f"{array}.npy"), mmap_mode="r")
+    with open(os.path.join(index_dir, "names.txt"), "r") as f:
+        index["names"] = f.read().splitlines()
+    return index
+
+
+#################################
+# distances
+#################################
+
+
+def binomial_upper_tail(x, n, p) -> float:
+    """P(X >= x) for X ~ Binomial(n, p), summed in log space
+    :return: probability
+    """
+    if x <= 0:
+        return 1.0
+    if p <= 0:
+        return 0.0
+    if p >= 1:
+        return 1.0
+    i = np.arange(x, n + 1, dtype=np.float64)
+    log_terms = (
+        math.lgamma(n + 1)
+        - np.array([math.lgamma(k + 1) + math.lgamma(n - k + 1) for k in i])
+        + i * math.log(p)
+        + (n - i) * math.log1p(-p)
+    )
+    top = log_terms.max()
+    return float(min(1.0, math.exp(top) * np.exp(log_terms - top).sum()))
+
+
+def mash_pvalue(common, length_ref, length_query, kmer_space, denom) -> float:
+    """mash's p-value of observing common shared hashes by chance"""
+    if common == 0:
+        return 1.0
+    p_x = 1.0 / (1.0 + kmer_space / length_ref)
+    p_y = 1.0 / (1.0 + kmer_space / length_query)
+    r = p_x * p_y / (p_x + p_y - p_x * p_y)
+    return binomial_upper_tail(common, denom, r)
+
+
+def mash_distances(query, index, max_distance=0.1, max_pvalue=0.1):
+    """mash distances of each query sketch to every indexed sketch it shares hashes with
+    sketches sharing no hashes have distance 1 and are never reported
+    :param query: dictionary from sketch_fasta
+    :param index: dictionary from load_sketch_index
+    :param max_distance: as mash dist -d
+    :param max_pvalue: as mash dist -v
+    :return: list of (query name, indexed name, distance, p-value, common, denom) in mash dist output order
+    """
+    kmer_size = index["kmer_size"]
+    sketch_size = index["sketch_size"]
+    kmer_space = 4.0**kmer_size
+    rows = []
+
+    for query_index, (query_name, query_length, query_hashes) in enumerate(
+        zip(query["names"], query["lengths"], query["hashes"])
+    ):
+        if len(query_hashes) == 0:
+            continue
+        # every (query rank, indexed sketch, indexed rank) sharing a hash
+        left = np.searchsorted(index["hashes"], query_hashes, side="left")
+        right = np.searchsorted(index["hashes"], query_hashes, side="right")
+        counts = right - left
+        if counts.sum() == 0:
+            continue
+        positions = np.repeat(left - np.cumsum(counts) + counts, counts) + np.arange(
+            counts.sum()
+        )
+        query_ranks = np.repeat(np.arange(len(query_hashes)), counts)
+        sketches = np.asarray(index["sketches"][positions], dtype=np.int64)
+        ref_ranks = np.asarray(index["ranks"][positions], dtype=np.int64)
+
+        # group the shared hashes by sketch, in hash order
+        order = np.lexsort((query_ranks, sketches))
+        sketches, query_ranks, ref_ranks = (
+            sketches[order],
+            query_ranks[order],
+            ref_ranks[order],
+        )
+        starts = np.flatnonzero(np.r_[True, sketches[1:] != sketches[:-1]])
+        shared_rank = np.arange(len(sketches)) - np.repeat(
+            starts, np.diff(np.r_[starts, len(sketches)])
+        )
+        # rank of each shared hash in the union of the two sketches
+        union_rank = query_ranks + ref_ranks - shared_rank + 1
+
+        candidates = sketches[starts]
+        shared = np.diff(np.r_[starts, len(sketches)])
+        sizes = np.asarray(index["sizes"][candidates], dtype=np.int64)
+        denoms = np.minimum(sketch_size, len(query_hashes) + sizes - shared)
+        # only shared hashes within the bottom sketch_size of the union count
+        within = union_rank <= np.repeat(denoms, shared)
+        commons = np.add.reduceat(within.astype(np.int64), starts)
+
+        for candidate, common, denom in zip(candidates, commons, denoms):
+            common, denom = int(common), int(denom)
+            if common == 0:
+                continue
+            jaccard = common / denom
+            if common == denom:
+                distance = 0.0
+            else:
+                distance = -math.log(2 * jaccard / (1.0 + jaccard)) / kmer_size
+            if distance > max_distance:
+                continue
+            pvalue = mash_pvalue(
+                common,
+                int(index["lengths"][candidate]),
+                query_length,
+                kmer_space,
+                denom,
+            )
+            if pvalue > max_pvalue:
+                continue
+            rows.append(
+                (
+                    int(candidate),
+                    query_index,
+                    (
+                        query_name,
+                        index["names"][candidate],
+                        distance,
+                        pvalue,
+                        common,
+                        denom,
+                    ),
+                )
+            )
+
+    # mash dist reports each indexed sketch against all query sketches in turn
+    rows.sort(key=lambda row: row[:2])
+    return [row[2] for row in rows]
@@ -1,4 +1,5 @@
 import os
+from functools import partial
 from pathlib import Path
 
 import pandas as pd
@@ -6,7 +7,7 @@ from Bio import SeqIO
 from Bio.SeqRecord import SeqRecord
 from loguru import logger
 
-from plassembler.utils.bam import sam_to_sorted_bam
+from plassembler.utils.daemon import daemon_plsdb_metadata
 from plassembler.utils.depth import (
     collate_depths,
     combine_depth_dfs,
@@ -14,10 +15,13 @@ from plassembler.utils.depth import (
     depth_df_single,
     get_contig_circularity,
     get_contig_lengths,
-    get_depths_from_bam,
+    get_long_read_depths,
+    get_short_read_depths,
+    run_depth_branches,
 )
-from plassembler.utils.mapping import minimap_long_reads, minimap_short_reads
-from plassembler.utils.run_mash import get_contig_count, is_file_empty
+from plassembler.utils.plsdb import fetch_plsdb_metadata
+from plassembler.utils.run_mash import get_contig_count, get_mash_tophits
+from plassembler.utils.util import hash_file
 
 
 class Plass:
@@ -37,6 +41,8 @@ class Plass:
         ),
         long_only: bool = False,
         unicycler_success: bool = True,
+        long_depths: dict = None,
+        long_depths_reference_hash: str = None,
     ) -> None:
         """
         Parameters
@@ -59,6 +65,10 @@ class Plass:
             whether plassembler is in kmer mode
         unicycler_success: bool, required
             whether unicycler succeeded
+        long_depths: dict, optional
+            per-base long read depths accumulated while binning the long reads
+        long_depths_reference_hash: str, optional
+            sha256 of the reference the long_depths were computed against
         """
         self.outdir = outdir
         self.contig_count = contig_count
@@ -70,6 +80,8 @@ class Plass:
         self.combined_depth_mash_df = combined_depth_mash_df
         self.long_only = long_only
         self.unicycler_success = unicycler_success
+        self.long_depths = long_depths
+        self.long_depths_reference_hash = long_depths_reference_hash
 
     def get_contig_count(self):
         """Counts the number of contigs assembled
@@ -367,40 +379,33 @@ class Plass:
         outdir = self.outdir
         concatenate_chrom_plasmids(outdir)
 
-        input_long_reads: Path = Path(outdir) / "chopper_long_reads.fastq.gz"
-        fasta: Path = Path(outdir) / "combined.fasta"
-        sam_file: Path = Path(outdir) / "combined_long.sam"
-        sorted_bam: Path = Path(outdir) / "combined_sorted_long.bam"
-
-        # map
-        minimap_long_reads(
-            input_long_reads, fasta, sam_file, threads, pacbio_model, logdir
-        )
-        # sort
-        sam_to_sorted_bam(sam_file, sorted_bam, threads, logdir)
-
-        # short reads
-        r1: Path = Path(outdir) / "trimmed_R1.fastq"
-        r2: Path = Path(outdir) / "trimmed_R2.fastq"
-        fasta: Path = Path(outdir) / "combined.fasta"
-        sam_file: Path = Path(outdir) / "combined_short.sam"
-        sorted_bam: Path = Path(outdir) / "combined_sorted_short.bam"
-
-        # map
-        minimap_short_reads(r1, r2, fasta, sam_file, threads, logdir)
-        # sort
-        sam_to_sorted_bam(sam_file, sorted_bam, threads, logdir)
-
         # get contig lengths
-
         fasta: Path = Path(outdir) / "combined.fasta"
         contig_lengths = get_contig_lengths(fasta)
 
-        # depths
-        short_bam_file: Path = Path(outdir) / "combined_sorted_short.bam"
-        long_bam_file: Path = Path(outdir) / "combined_sorted_long.bam"
-        depthsShort = get_depths_from_bam(short_bam_file, contig_lengths)
-        depthsLong = get_depths_from_bam(long_bam_file, contig_lengths)
+        # the long and short branches are independent, so run them concurrently
+        depths = run_depth_branches(
+            {
+                "long": partial(
+                    get_long_read_depths,
+                    outdir,
+                    fasta,
+                    contig_lengths,
+                    pacbio_model=pacbio_model,
+                    logdir=logdir,
+                ),
+                "short": partial(
+                    get_short_read_depths,
+                    outdir,
+                    fasta,
+                    contig_lengths,
+                    logdir=logdir,
+                ),
+            },
+            threads,
+        )
+        depthsShort = depths["short"]
+        depthsLong = depths["long"]
 
         # circular status
         circular_status = get_contig_circularity(fasta)
@@ -413,6 +418,15 @@ class Plass:
             summary_depth_df_short, summary_depth_df_long, circular_status
         )
 
+    def set_long_depths(self, long_depths, fasta):
+        """keeps depths accumulated while binning the long reads for get_depth_long
+        :param long_depths: dictionary of contigs and depth arrays
+        :param fasta: reference the long reads were mapped to
+        :return:
+        """
+        self.long_depths = long_depths
+        self.long_depths_reference_hash = hash_file(fasta)
+
     def get_depth_long(self, logdir, pacbio_model, threads):
         """wrapper function to get depth of each plasmid
         :param pacbio_model:  pacbio_model
@@ -422,26 +436,22 @@ class Plass:
         """
         outdir = self.outdir
 
-        input_long_reads: Path = Path(outdir) / "chopper_long_reads.fastq.gz"
         fasta: Path = Path(outdir) / "flye_renamed.fasta"
-        sam_file: Path = Path(outdir) / "combined_long.sam"
-        sorted_bam: Path = Path(outdir) / "combined_sorted_long.bam"
-
-        # map
-        minimap_long_reads(
-            input_long_reads, fasta, sam_file, threads, pacbio_model, logdir
-        )
-        # sort
-        sam_to_sorted_bam(sam_file, sorted_bam, threads, logdir)
 
         # get contig lengths
-
-        fasta: Path = Path(outdir) / "flye_renamed.fasta"
         contig_lengths = get_contig_lengths(fasta)
 
-        # depths
-        long_bam_file: Path = Path(outdir) / "combined_sorted_long.bam"
-        depthsLong = get_depths_from_bam(long_bam_file, contig_lengths)
+        if (
+            self.long_depths is not None
+            and self.long_depths_reference_hash == hash_file(fasta)
+        ):
+            # the reference is unchanged since binning - reuse that alignment
+            logger.info("Reusing the long read alignment from binning for depth.")
+            depthsLong = self.long_depths
+        else:
+            depthsLong = get_long_read_depths(
+                outdir, fasta, contig_lengths, threads, pacbio_model, logdir
+            )
 
         # circular status
         circular_status = get_contig_circularity(fasta)
@@ -450,10 +460,11 @@ class Plass:
         # save the depth df in the class
         self.depth_df = depth_df_single(summary_depth_df_long, circular_status)
 
-    def process_mash_tsv(self, plassembler_db_dir):
+    def process_mash_tsv(self, plassembler_db_dir, daemon=None):
         """
         Process mash output
         :param outdir: output directory
+        :param daemon: PLSDB daemon socket to fetch the metadata from - None to use the local database
         :return: mash_empty: boolean whether there was a mash hit
         """
         outdir = self.outdir
@@ -467,159 +478,20 @@ class Plass:
             contig_count = get_contig_count(os.path.join(outdir, "assembly.fasta"))
         # update with final plasmid count number
         self.contig_count = contig_count
-        # get mash tsv output contig
+        # closest PLSDB hit of each contig
         mash_tsv = os.path.join(outdir, "mash.tsv")
-        col_list = [
-            "contig",
-            "ACC_NUCCORE",
-            "mash_distance",
-            "mash_pval",
-            "mash_matching_hashes",
-        ]
-
-        # check if mash tsv file is empty -> no hits
-        mash_empty = is_file_empty(mash_tsv)
-        # instantiate tophits list
-        tophits_mash_df = []
-
-        if mash_empty is False:
-            mash_df = pd.read_csv(
-                mash_tsv, delimiter="\t", index_col=False, names=col_list
-            )
-            # get list of contigs from unicycler: 1 -> total number of contigs
-            contigs = range(1, contig_count + 1)
-
-            # instantiate tophits list
-            tophits = []
-
-            for contig in contigs:
-                hit_df = (
-                    mash_df.loc[mash_df["contig"] == contig]
-                    .sort_values("mash_distance")
-                    .reset_index(drop=True)
-                )
-                hits = len(hit_df["mash_distance"])
-                # add only if there is a hit
-                if hits > 0:
-                    tmp_df = (
-                        mash_df.loc[mash_df["contig"] == contig]
-                        .sort_values("mash_distance")
-                        .reset_index(drop=True)
-                        .loc[0]
-                    )
-                    tophits.append(
-                        [
-                            tmp_df.contig,
-                            "Yes",
-                            tmp_df.ACC_NUCCORE,
-                            tmp_df.mash_distance,
-                            tmp_df.mash_pval,
-                            tmp_df.mash_matching_hashes,
-                        ]
-                    )
-                else:  # no hits append no it
-                    tophits.append([contig, "", "", "", "", ""])
-                # create tophits df
-            tophits_mash_df = pd.DataFrame(
-                tophits,
-                columns=[
-                    "contig",
-                    "PLSDB_hit",
-                    "ACC_NUCCORE",
-                    "mash_distance",
-                    "mash_pval",
-                    "mash_matching_hashes",
-                ],
-            )
-
-        else:  # empty mash file
-            contigs = range(1, contig_count + 1)
-            # create empty df
-            tophits_mash_df = pd.DataFrame(
-                columns=[
-                    "contig",
-                    "PLSDB_hit",
-                    "ACC_NUCCORE",
-                    "mash_distance",
-                    "mash_pval",
-                    "mash_matching_hashes",
-                ]
-            )
-            for contig in contigs:
-                tophits_mash_df.loc[contig - 1] = [contig, "", "", "", "", ""]
+        tophits_mash_df = get_mash_tophits(mash_tsv, contig_count)
 
         # read in the plasdb tsv to get the description
-        plsdb_tsv_file = os.path.join(plassembler_db_dir, "plsdb.tsv")
-        cols = [
-            "UID_NUCCORE",
-            "ACC_NUCCORE",
-            "Description_NUCCORE",
-            "CreateDate_NUCCORE",
-            "Topology_NUCCORE",
-            "Completeness_NUCCORE",
-            "TaxonID_NUCCORE",
-            "Genome_NUCCORE",
-            "Length_NUCCORE",
-            "Source_NUCCORE",
-            "UID_ASSEMBLY",
-            "Status_ASSEMBLY",
-            "SeqReleaseDate_ASSEMBLY",
-            "SubmissionDate_ASSEMBLY",
-            "Latest_ASSEMBLY",
-            "UID_BIOSAMPLE",
-            "ACC_BIOSAMPLE",
-            "Location_BIOSAMPLE",
-            "Coordinates_BIOSAMPLE",
-            "IsolationSource_BIOSAMPLE",
-            "Host_BIOSAMPLE",
-            "CollectionDate_BIOSAMPLE",
-            "Host_DISEASE",
-            "SamplType_BIOSAMPLE",
-            "taxon_name",
-            "taxon_rank",
-            "lineage",
-            "taxon_species_id",
-            "taxon_species_name",
-            "taxon_genus_id",
-            "taxon_genus_name",
-            "taxon_family_id",
-            "taxon_family_name",
-            "taxon_order_id",
-            "taxon_order_name",
-            "taxon_class_id",
-            "taxon_class_name",
-            "taxon_phylum_id",
-            "taxon_phylum_name",
-            "taxon_superkingdom_id",
-            "taxon_superkingdom_name",
-            "loc_lat",
-            "loc_lng",
-            "loc_parsed",
-            "GC_NUCCORE",
-            "Identical",
-            "OldVersion",
-            "hits_rMLST",
-            "hitscount_rMLST",
-            "inclusions",
-            "Host_BIOSAMPLE_processed",
-            "Host_DISEASE_processed",
-            "D1",
-            "D2",
-            "plasmidfinder",
-            "pmlst",
-            "relaxase_type(s)",
-            "mpf_type",
-        ]
-        plsdb_tsv = pd.read_csv(
-            plsdb_tsv_file,
-            delimiter="\t",
-            index_col=False,
-            names=cols,
-            skiprows=1,
-            low_memory=False,
+        plsdb_hits = daemon_plsdb_metadata(
+            daemon, str(plassembler_db_dir), tophits_mash_df["ACC_NUCCORE"]
         )
+        if plsdb_hits is None:
+            plsdb_hits = fetch_plsdb_metadata(
+                str(plassembler_db_dir), tophits_mash_df["ACC_NUCCORE"]
+            )
         combined_mash_df = tophits_mash_df.merge(
-            plsdb_tsv, on="ACC_NUCCORE", how="left"
+            plsdb_hits, on="ACC_NUCCORE", how="left"
         )
 
         self.mash_df = combined_mash_df
@@ -698,7 +570,7 @@ class Plass:
             combined_depth_mash_df["contig"] != "chromosome"
         ].reset_index(drop=True)
         # get contigs only
-        plasmid_fasta = os.path.join(outdir, "plasmids.fasta")
+        plasmid_fasta = os.path.join(outdir, "plasmids_initial.fasta")
         i = 0
         with open(os.path.join(outdir, prefix + "_plasmids.fasta"), "w") as dna_fa:
             for dna_record in SeqIO.parse(plasmid_fasta, "fasta"):
@@ -818,44 +690,28 @@ class Assembly:
         """
         outdir = self.outdir
 
-        input_long_reads: Path = Path(outdir) / "chopper_long_reads.fastq.gz"
-        fasta: Path = Path(outdir) / "combined.fasta"
-        sam_file: Path = Path(outdir) / "combined_long.sam"
-        sorted_bam: Path = Path(outdir) / "combined_sorted_long.bam"
-
-        # map
-        if self.long_flag is True:
-            minimap_long_reads(
-                input_long_reads, fasta, sam_file, threads, pacbio_model, logdir
-            )
-            # sort
-            sam_to_sorted_bam(sam_file, sorted_bam, threads, logdir)
-
-        # short reads
-        r1: Path = Path(outdir) / "trimmed_R1.fastq"
-        r2: Path = Path(outdir) / "trimmed_R2.fastq"
-        fasta: Path = Path(outdir) / "combined.fasta"
-        sam_file: Path = Path(outdir) / "combined_short.sam"
-        sorted_bam: Path = Path(outdir) / "combined_sorted_short.bam"
-
-        # map
-        if self.short_flag is True:
-            minimap_short_reads(r1, r2, fasta, sam_file, threads, logdir)
-            # sort
-            sam_to_sorted_bam(sam_file, sorted_bam, threads, logdir)
-
         # get contig lengths
-
         fasta: Path = Path(outdir) / "combined.fasta"
         contig_lengths = get_contig_lengths(fasta)
 
-        # depths
-        short_bam_file: Path = Path(outdir) / "combined_sorted_short.bam"
-        long_bam_file: Path = Path(outdir) / "combined_sorted_long.bam"
-        if self.short_flag is True:
-            depthsShort = get_depths_from_bam(short_bam_file, contig_lengths)
+        # the long and short branches are independent, so run them concurrently
+        branches = {}
         if self.long_flag is True:
-            depthsLong = get_depths_from_bam(long_bam_file, contig_lengths)
+            branches["long"] = partial(
+                get_long_read_depths,
+                outdir,
+                fasta,
+                contig_lengths,
+                pacbio_model=pacbio_model,
+                logdir=logdir,
+            )
+        if self.short_flag is True:
+            branches["short"] = partial(
+                get_short_read_depths, outdir, fasta, contig_lengths, logdir=logdir
+            )
+        depths = run_depth_branches(branches, threads)
+        depthsShort = depths.get("short")
+        depthsLong = depths.get("long")
 
         # circular status
         circular_status = get_contig_circularity(fasta)
@@ -878,10 +734,11 @@ class Assembly:
         elif self.long_flag is False and self.short_flag is True:  # only short
             self.depth_df = depth_df_single(summary_depth_df_short, circular_status)
 
-    def process_mash_tsv(self, plassembler_db_dir, plasmid_fasta):
+    def process_mash_tsv(self, plassembler_db_dir, plasmid_fasta, daemon=None):
         """
         Process mash output
         :param outdir: output directory
+        :param daemon: PLSDB daemon socket to fetch the metadata from - None to use the local database
         :return: mash_empty: boolean whether there was a mash hit
         """
         outdir = self.outdir
@@ -890,159 +747,20 @@ class Assembly:
         # update with final plasmid count number
         self.contig_count = contig_count
 
-        # get mash tsv output contig
+        # closest PLSDB hit of each contig
         mash_tsv = os.path.join(outdir, "mash.tsv")
-        col_list = [
-            "contig",
-            "ACC_NUCCORE",
-            "mash_distance",
-            "mash_pval",
-            "mash_matching_hashes",
-        ]
-
-        # check if mash tsv file is empty -> no hits
-        mash_empty = is_file_empty(mash_tsv)
-        # instantiate tophits list
-        tophits_mash_df = []
-
-        if mash_empty is False:
-            mash_df = pd.read_csv(
-                mash_tsv, delimiter="\t", index_col=False, names=col_list
-            )
-            # get list of contigs from unicycler: 1 -> total number of contigs
-            contigs = range(1, contig_count + 1)
-
-            # instantiate tophits list
-            tophits = []
-
-            for contig in contigs:
-                hit_df = (
-                    mash_df.loc[mash_df["contig"] == contig]
-                    .sort_values("mash_distance")
-                    .reset_index(drop=True)
-                )
-                hits = len(hit_df["mash_distance"])
-                # add only if there is a hit
-                if hits > 0:
-                    tmp_df = (
-                        mash_df.loc[mash_df["contig"] == contig]
-                        .sort_values("mash_distance")
-                        .reset_index(drop=True)
-                        .loc[0]
-                    )
-                    tophits.append(
-                        [
-                            tmp_df.contig,
-                            "Yes",
-                            tmp_df.ACC_NUCCORE,
-                            tmp_df.mash_distance,
-                            tmp_df.mash_pval,
-                            tmp_df.mash_matching_hashes,
-                        ]
-                    )
-                else:  # no hits append no it
-                    tophits.append([contig, "", "", "", "", ""])
-                # create tophits df
-            tophits_mash_df = pd.DataFrame(
-                tophits,
-                columns=[
-                    "contig",
-                    "PLSDB_hit",
-                    "ACC_NUCCORE",
-                    "mash_distance",
-                    "mash_pval",
-                    "mash_matching_hashes",
-                ],
-            )
-
-        else:  # empty mash file
-            contigs = range(1, contig_count + 1)
-            # create empty df
-            tophits_mash_df = pd.DataFrame(
-                columns=[
-                    "contig",
-                    "PLSDB_hit",
-                    "ACC_NUCCORE",
-                    "mash_distance",
-                    "mash_pval",
-                    "mash_matching_hashes",
-                ]
-            )
-            for contig in contigs:
-                tophits_mash_df.loc[contig - 1] = [contig, "", "", "", "", ""]
+        tophits_mash_df = get_mash_tophits(mash_tsv, contig_count)
 
         # read in the plasdb tsv to get the description
-        plsdb_tsv_file = os.path.join(plassembler_db_dir, "plsdb.tsv")
-        cols = [
-            "UID_NUCCORE",
-            "ACC_NUCCORE",
-            "Description_NUCCORE",
-            "CreateDate_NUCCORE",
-            "Topology_NUCCORE",
-            "Completeness_NUCCORE",
-            "TaxonID_NUCCORE",
-            "Genome_NUCCORE",
-            "Length_NUCCORE",
-            "Source_NUCCORE",
-            "UID_ASSEMBLY",
-            "Status_ASSEMBLY",
-            "SeqReleaseDate_ASSEMBLY",
-            "SubmissionDate_ASSEMBLY",
-            "Latest_ASSEMBLY",
-            "UID_BIOSAMPLE",
-            "ACC_BIOSAMPLE",
-            "Location_BIOSAMPLE",
-            "Coordinates_BIOSAMPLE",
-            "IsolationSource_BIOSAMPLE",
-            "Host_BIOSAMPLE",
-            "CollectionDate_BIOSAMPLE",
-            "Host_DISEASE",
-            "SamplType_BIOSAMPLE",
-            "taxon_name",
-            "taxon_rank",
-            "lineage",
-            "taxon_species_id",
-            "taxon_species_name",
-            "taxon_genus_id",
-            "taxon_genus_name",
-            "taxon_family_id",
-            "taxon_family_name",
-            "taxon_order_id",
-            "taxon_order_name",
-            "taxon_class_id",
-            "taxon_class_name",
-            "taxon_phylum_id",
-            "taxon_phylum_name",
-            "taxon_superkingdom_id",
-            "taxon_superkingdom_name",
-            "loc_lat",
-            "loc_lng",
-            "loc_parsed",
-            "GC_NUCCORE",
-            "Identical",
-            "OldVersion",
-            "hits_rMLST",
-            "hitscount_rMLST",
-            "inclusions",
-            "Host_BIOSAMPLE_processed",
-            "Host_DISEASE_processed",
-            "D1",
-            "D2",
-            "plasmidfinder",
-            "pmlst",
-            "relaxase_type(s)",
-            "mpf_type",
-        ]
-        plsdb_tsv = pd.read_csv(
-            plsdb_tsv_file,
-            delimiter="\t",
-            index_col=False,
-            names=cols,
-            skiprows=1,
-            low_memory=False,
+        plsdb_hits = daemon_plsdb_metadata(
+            daemon, str(plassembler_db_dir), tophits_mash_df["ACC_NUCCORE"]
         )
+        if plsdb_hits is None:
+            plsdb_hits = fetch_plsdb_metadata(
+                str(plassembler_db_dir), tophits_mash_df["ACC_NUCCORE"]
+            )
         combined_mash_df = tophits_mash_df.merge(
-            plsdb_tsv, on="ACC_NUCCORE", how="left"
+            plsdb_hits, on="ACC_NUCCORE", how="left"
         )
 
         self.mash_df = combined_mash_df
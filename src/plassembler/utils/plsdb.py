@@ -0,0 +1,181 @@
+import os
+import sqlite3
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+# indexed copy of plsdb.tsv built at download
+PLSDB_STORE = "plsdb.sqlite"
+
+# SQLite limits the number of ? parameters per query
+SQLITE_MAX_PARAMS = 500
+
+# columns of the PLSDB metadata plsdb.tsv
+PLSDB_COLUMNS = [
+    "UID_NUCCORE",
+    "ACC_NUCCORE",
+    "Description_NUCCORE",
+    "CreateDate_NUCCORE",
+    "Topology_NUCCORE",
+    "Completeness_NUCCORE",
+    "TaxonID_NUCCORE",
+    "Genome_NUCCORE",
+    "Length_NUCCORE",
+    "Source_NUCCORE",
+    "UID_ASSEMBLY",
+    "Status_ASSEMBLY",
+    "SeqReleaseDate_ASSEMBLY",
+    "SubmissionDate_ASSEMBLY",
+    "Latest_ASSEMBLY",
+    "UID_BIOSAMPLE",
+    "ACC_BIOSAMPLE",
+    "Location_BIOSAMPLE",
+    "Coordinates_BIOSAMPLE",
+    "IsolationSource_BIOSAMPLE",
+    "Host_BIOSAMPLE",
+    "CollectionDate_BIOSAMPLE",
+    "Host_DISEASE",
+    "SamplType_BIOSAMPLE",
+    "taxon_name",
+    "taxon_rank",
+    "lineage",
+    "taxon_species_id",
+    "taxon_species_name",
+    "taxon_genus_id",
+    "taxon_genus_name",
+    "taxon_family_id",
+    "taxon_family_name",
+    "taxon_order_id",
+    "taxon_order_name",
+    "taxon_class_id",
+    "taxon_class_name",
+    "taxon_phylum_id",
+    "taxon_phylum_name",
+    "taxon_superkingdom_id",
+    "taxon_superkingdom_name",
+    "loc_lat",
+    "loc_lng",
+    "loc_parsed",
+    "GC_NUCCORE",
+    "Identical",
+    "OldVersion",
+    "hits_rMLST",
+    "hitscount_rMLST",
+    "inclusions",
+    "Host_BIOSAMPLE_processed",
+    "Host_DISEASE_processed",
+    "D1",
+    "D2",
+    "plasmidfinder",
+    "pmlst",
+    "relaxase_type(s)",
+    "mpf_type",
+]
+
+
+@lru_cache(maxsize=None)
+def load_plsdb_metadata(plassembler_db_dir):
+    """reads the PLSDB metadata once per database directory and process
+    :param plassembler_db_dir: database directory
+    :return: plsdb_tsv: pandas df of the PLSDB metadata - shared, do not modify in place
+    """
+    plsdb_tsv_file = os.path.join(plassembler_db_dir, "plsdb.tsv")
+    plsdb_tsv = pd.read_csv(
+        plsdb_tsv_file,
+        delimiter="\t",
+        index_col=False,
+        names=PLSDB_COLUMNS,
+        skiprows=1,
+        low_memory=False,
+    )
+    return plsdb_tsv
+
+
+def get_plsdb_store(plassembler_db_dir):
+    """path of the indexed PLSDB metadata store if it is present and up to date
+    :param plassembler_db_dir: database directory
+    :return: store path or None to fall back to plsdb.tsv
+    """
+    store = os.path.join(plassembler_db_dir, PLSDB_STORE)
+    plsdb_tsv_file = os.path.join(plassembler_db_dir, "plsdb.tsv")
+    if not os.path.isfile(store):
+        return None
+    # a replaced plsdb.tsv makes the store stale
+    if os.path.getmtime(store) < os.path.getmtime(plsdb_tsv_file):
+        return None
+    return store
+
+
+def build_plsdb_store(plassembler_db_dir):
+    """converts plsdb.tsv into an SQLite store indexed on ACC_NUCCORE
+    the column dtypes pandas infers for the whole tsv are kept in a side table,
+    so rows fetched from the store are typed exactly as when read from the tsv
+    :param plassembler_db_dir: database directory
+    :return:
+    """
+    plsdb_tsv = load_plsdb_metadata.__wrapped__(str(plassembler_db_dir))
+    store = os.path.join(plassembler_db_dir, PLSDB_STORE)
+    # per process, as runs sharing the database may build it at the same time
+    tmp_store = f"{store}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_store):
+        os.remove(tmp_store)
+    dtypes = pd.DataFrame(
+        {"column": PLSDB_COLUMNS, "dtype": [str(t) for t in plsdb_tsv.dtypes]}
+    )
+    with sqlite3.connect(tmp_store) as connection:
+        plsdb_tsv.to_sql("plsdb", connection, index=False)
+        dtypes.to_sql("plsdb_dtypes", connection, index=False)
+        connection.execute("CREATE INDEX plsdb_acc ON plsdb (ACC_NUCCORE)")
+    connection.close()
+    # only a complete store is ever used
+    os.replace(tmp_store, store)
+
+
+def fetch_plsdb_metadata(plassembler_db_dir, accessions):
+    """fetches the PLSDB metadata of some accessions
+    from the indexed store when it exists, otherwise from plsdb.tsv
+    :param plassembler_db_dir: database directory
+    :param accessions: iterable of ACC_NUCCORE accessions
+    :return: plsdb_hits: pandas df of the matching PLSDB metadata rows
+    """
+    accessions = sorted({acc for acc in accessions if isinstance(acc, str) and acc})
+    store = get_plsdb_store(plassembler_db_dir)
+    if store is None:
+        plsdb_tsv = load_plsdb_metadata(str(plassembler_db_dir))
+        return plsdb_tsv.loc[plsdb_tsv["ACC_NUCCORE"].isin(accessions)]
+
+    with sqlite3.connect(f"file:{store}?mode=ro", uri=True) as connection:
+        dtypes = dict(
+            connection.execute("SELECT column, dtype FROM plsdb_dtypes").fetchall()
+        )
+        chunks = [pd.DataFrame(columns=PLSDB_COLUMNS)]
+        for i in range(0, len(accessions), SQLITE_MAX_PARAMS):
+            chunk = accessions[i : i + SQLITE_MAX_PARAMS]
+            placeholders = ",".join("?" * len(chunk))
+            chunks.append(
+                pd.read_sql_query(
+                    f"SELECT * FROM plsdb WHERE ACC_NUCCORE IN ({placeholders})",
+                    connection,
+                    params=chunk,
+                )
+            )
+    connection.close()
+    plsdb_hits = pd.concat(chunks, ignore_index=True)[PLSDB_COLUMNS]
+    # NULLs come back as None
+    plsdb_hits = plsdb_hits.replace({None: np.nan}).astype(dtypes)
+    return plsdb_hits
+
+
+def preload_plsdb_metadata(plassembler_db_dir):
+    """loads plsdb.tsv into the cache ahead of process_mash_tsv
+    unnecessary when the indexed store is present, as only the hit rows are fetched then
+    :param plassembler_db_dir: database directory
+    :return:
+    """
+    if get_plsdb_store(str(plassembler_db_dir)) is None:
+        logger.info(
+            f"No indexed PLSDB metadata in {plassembler_db_dir}. Run plassembler download to build it."
+        )
+        load_plsdb_metadata(str(plassembler_db_dir))
@@ -1,4 +1,3 @@
-import gzip
 import shutil
 import subprocess as sp
 from pathlib import Path
@@ -6,79 +5,120 @@ from pathlib import Path
 from loguru import logger
 
 from plassembler.utils.external_tools import ExternalTool
+from plassembler.utils.fastq import is_gzipped
+from plassembler.utils.util import stage_file
+
+# chopper_long_reads.fastq.gz is an intermediate file, so it is compressed for speed
+CHOPPER_COMPRESSION_LEVEL = 1
+
+
+def get_gzip_command(threads, decompress=False, level=6):
+    """gzip command reading stdin or a file given after it and writing to stdout
+    multithreaded with pigz, or bgzip whose output is also valid gzip, when installed
+    :param threads: threads
+    :param decompress: whether to decompress instead of compress
+    :param level: compression level
+    :return: command list
+    """
+    if shutil.which("pigz") is not None:
+        command = ["pigz", "-p", str(threads)]
+    elif shutil.which("bgzip") is not None:
+        command = ["bgzip", "-@", str(threads)]
+    else:
+        command = ["gzip"]
+    if decompress is True:
+        return command + ["-dc"]
+    if command[0] == "bgzip":
+        return command + ["-c", "-l", str(level)]
+    return command + ["-c", f"-{level}"]
+
+
+def split_chopper_threads(threads, gzip_flag):
+    """splits the threads between chopper and the decompression and compression around it
+    about a quarter each to the decompression (of gzipped reads only) and the compression, at least 1 each
+    :param threads: threads granted to the chopper stage
+    :param gzip_flag: whether or not the long reads are gzipped
+    :return: (chopper threads, threads for each of the decompression and compression)
+    """
+    threads = int(threads)
+    gzip_threads = max(1, threads // 4)
+    gzip_processes = 2 if gzip_flag is True else 1
+    chopper_threads = max(1, threads - gzip_processes * gzip_threads)
+    return chopper_threads, gzip_threads
 
 
 def chopper(
     input_long_reads, outdir, min_length, min_quality, gzip_flag, threads, logdir
 ):
     """Filters long reads using chopper
+    the reads are decompressed into and recompressed out of chopper with pigz or bgzip threads when available
 
     :param input_long_reads: input ONT reads file
     :param outdir: output directory
     :param min_length: minimum length for long reads - defaults to 1000
     :param min_quality:  minimum quality for long reads - defaults to 8
     :param gzip_flag: whether or not the long reads are gzipped
+    :param threads: threads shared by chopper and the decompression and compression
     :param logdir
     :return:
     """
     filtered_long_reads: Path = Path(outdir) / "chopper_long_reads.fastq.gz"
+    # may be a link to the input staged by an earlier --skip_qc run - never write through it
+    filtered_long_reads.unlink(missing_ok=True)
     logger.info("Started running chopper")
     logdir.mkdir(parents=True, exist_ok=True)
     tool = "chopper"
     tool_name = Path(tool).name
     logfile_prefix: Path = logdir / f"{tool_name}"
-    err_log = open(f"{logfile_prefix}.err", "w")
-    f = open(filtered_long_reads, "w")
-    if gzip_flag is True:
+    chopper_threads, gzip_threads = split_chopper_threads(threads, gzip_flag)
+    chopper_command = [
+        "chopper",
+        "-q",
+        min_quality,
+        "--threads",
+        str(chopper_threads),
+        "-l",
+        min_length,
+        "--headcrop",
+        "75",
+        "--tailcrop",
+        "75",
+    ]
+    with open(f"{logfile_prefix}.err", "w") as err_log, open(
+        filtered_long_reads, "wb"
+    ) as f:
+        return_codes = []
         try:
-            unzip = sp.Popen(["gunzip", "-c", input_long_reads], stdout=sp.PIPE)
+            # plain reads are read by chopper directly
+            if gzip_flag is True:
+                unzip = sp.Popen(
+                    get_gzip_command(gzip_threads, decompress=True)
+                    + [str(input_long_reads)],
+                    stdout=sp.PIPE,
+                    stderr=err_log,
+                )
+                chopper_input = unzip.stdout
+            else:
+                unzip = None
+                chopper_input = open(input_long_reads, "rb")
             chopper = sp.Popen(
-                [
-                    "chopper",
-                    "-q",
-                    min_quality,
-                    "--threads",
-                    threads,
-                    "-l",
-                    min_length,
-                    "--headcrop",
-                    "75",
-                    "--tailcrop",
-                    "75",
-                ],
-                stdin=unzip.stdout,
-                stdout=sp.PIPE,
-                stderr=err_log,
+                chopper_command, stdin=chopper_input, stdout=sp.PIPE, stderr=err_log
             )
-            gzip = sp.Popen(["gzip"], stdin=chopper.stdout, stdout=f)
-            gzip.communicate()[0]
-        except Exception:
-            logger.error("Error with chopper")
-    else:
-        try:
-            cat = sp.Popen(["cat", input_long_reads], stdout=sp.PIPE)
-            chopper = sp.Popen(
-                [
-                    "chopper",
-                    "-q",
-                    min_quality,
-                    "--threads",
-                    threads,
-                    "-l",
-                    min_length,
-                    "--headcrop",
-                    "75",
-                    "--tailcrop",
-                    "75",
-                ],
-                stdin=cat.stdout,
-                stdout=sp.PIPE,
+            # the children hold the pipe ends, so an early exit reaches the others
+            chopper_input.close()
+            compress = sp.Popen(
+                get_gzip_command(gzip_threads, level=CHOPPER_COMPRESSION_LEVEL),
+                stdin=chopper.stdout,
+                stdout=f,
                 stderr=err_log,
             )
-            gzip = sp.Popen(["gzip"], stdin=chopper.stdout, stdout=f)
-            gzip.communicate()[0]
+            chopper.stdout.close()
+            processes = [p for p in [unzip, chopper, compress] if p is not None]
+            return_codes = [p.wait() for p in processes]
         except Exception:
             logger.error("Error with chopper")
+    if any(return_codes):
+        logger.error(f"Error with chopper. Check {logfile_prefix}.err")
     logger.info("Finished running chopper")
 
 
@@ -94,6 +134,10 @@ def fastp(short_one, short_two, outdir, logdir):
     outdir = Path(outdir)
     out_one: Path = outdir / "trimmed_R1.fastq"
     out_two: Path = outdir / "trimmed_R2.fastq"
+    # may be links to the inputs staged by an earlier --skip_qc run - never write through them
+    for trimmed in [out_one, out_two]:
+        trimmed.unlink(missing_ok=True)
+        get_gzipped_path(trimmed).unlink(missing_ok=True)
 
     fastp = ExternalTool(
         tool="fastp",
@@ -107,15 +151,50 @@ def fastp(short_one, short_two, outdir, logdir):
     ExternalTool.run_tool(fastp, to_stdout=False)
 
 
-def copy_sr_fastq_file(infile: Path, outfile: Path):
-    if infile.suffix == ".gz":
-        # If the input file is a .fastq.gz file, extract and copy to .fastq
-        with gzip.open(infile, "rt") as f_in:
-            with open(outfile, "w") as f_out:
-                f_out.writelines(f_in)
-    elif infile.suffix == ".fastq":
-        # If the input file is already a .fastq file, copy it directly
-        shutil.copy2(infile, outfile)
-    else:
+def get_gzipped_path(path: Path) -> Path:
+    """path with .gz appended
+    :param path: file
+    :return: Path
+    """
+    return path.with_name(f"{path.name}.gz")
+
+
+def get_staged_sr_fastq_file(infile: Path, outfile: Path) -> Path:
+    """path copy_sr_fastq_file stages infile at - gzipped reads keep the .gz suffix
+    :param infile: input FASTQ, plain or gzipped
+    :param outfile: trimmed_R1.fastq or trimmed_R2.fastq
+    :return: outfile, or outfile with .gz appended if infile is gzipped
+    """
+    if is_gzipped(infile):
+        return get_gzipped_path(outfile)
+    return outfile
+
+
+def copy_sr_fastq_file(infile: Path, outfile: Path) -> Path:
+    """stages an input short read FASTQ as a trimmed FASTQ with --skip_qc, without copying or decompressing it
+    gzipped reads are staged as trimmed_R1.fastq.gz or trimmed_R2.fastq.gz
+    :param infile: input FASTQ, plain or gzipped
+    :param outfile: trimmed_R1.fastq or trimmed_R2.fastq
+    :return: the staged FASTQ
+    """
+    if infile.suffix not in [".gz", ".fastq"]:
         # Skip files that are not .fastq or .fastq.gz
         logger.error("Error with copy_sr_fastq_file")
+    staged: Path = get_staged_sr_fastq_file(infile, outfile)
+    # the other one may be left by an earlier run with differently compressed reads
+    outfile.unlink(missing_ok=True)
+    get_gzipped_path(outfile).unlink(missing_ok=True)
+    stage_file(infile, staged)
+    return staged
+
+
+def get_trimmed_short_reads(outdir):
+    """paths of the trimmed short reads - gzipped if --skip_qc staged gzipped inputs
+    :param outdir: output directory
+    :return: (R1 FASTQ, R2 FASTQ)
+    """
+    out_one: Path = Path(outdir) / "trimmed_R1.fastq"
+    out_two: Path = Path(outdir) / "trimmed_R2.fastq"
+    if get_gzipped_path(out_one).is_file():
+        return get_gzipped_path(out_one), get_gzipped_path(out_two)
+    return out_one, out_two
@@ -2,9 +2,21 @@ import os
 import shutil
 from pathlib import Path
 
+import pandas as pd
 from Bio import SeqIO
 
+from plassembler.utils.daemon import daemon_mash_distances
 from plassembler.utils.external_tools import ExternalTool
+from plassembler.utils.minhash import (
+    get_plsdb_sketch_index,
+    load_sketch_index,
+    mash_distances,
+    sketch_fasta,
+)
+
+# mash dist -d and -v thresholds
+MASH_MAX_DISTANCE = 0.1
+MASH_MAX_PVALUE = 0.1
 
 
 def mash_sketch(out_dir, fasta_file, logdir):
@@ -49,7 +61,7 @@ def run_mash(out_dir, plassembler_db_dir, logdir):
         tool="mash",
         input="",
         output="",
-        params=f" dist  {plasmid_sketch} {plsdb_sketch} -v 0.1 -d 0.1 -i ",
+        params=f" dist  {plasmid_sketch} {plsdb_sketch} -v {MASH_MAX_PVALUE} -d {MASH_MAX_DISTANCE} -i ",
         logdir=logdir,
         outfile=mash_tsv,
     )
@@ -58,6 +70,63 @@ def run_mash(out_dir, plassembler_db_dir, logdir):
     ExternalTool.run_tool(mash, to_stdout=True)
 
 
+def write_mash_tsv(out_dir, rows):
+    """
+    Writes mash distances to mash.tsv formatted as mash dist prints them
+    :param out_dir: output directory
+    :param rows: list of (query name, PLSDB name, distance, p-value, common, denom)
+    :return:
+    """
+    with open(Path(f"{out_dir}/mash.tsv"), "w") as mash_tsv:
+        for contig, accession, distance, pvalue, common, denom in rows:
+            mash_tsv.write(
+                f"{contig}\t{accession}\t{distance:g}\t{pvalue:g}\t{common}/{denom}\n"
+            )
+
+
+def run_native_mash(out_dir, fasta_file, index_dir):
+    """
+    Sketches the plasmids and computes their mash distances to the PLSDB sketch index in-process
+    writes mash.tsv as mash sketch -i and mash dist -v 0.1 -d 0.1 -i do
+    :param out_dir: output directory
+    :param fasta_file: plasmid FASTA
+    :param index_dir: PLSDB sketch index directory
+    :return:
+    """
+    index = load_sketch_index(str(index_dir))
+    query = sketch_fasta(fasta_file, index["kmer_size"], index["sketch_size"])
+    rows = mash_distances(query, index, MASH_MAX_DISTANCE, MASH_MAX_PVALUE)
+    write_mash_tsv(out_dir, rows)
+
+
+def calculate_mash_distances(
+    out_dir, fasta_file, plassembler_db_dir, logdir, daemon=None
+):
+    """
+    Calculates the mash distances of the plasmids to PLSDB into mash.tsv
+    with the PLSDB daemon when one is running, otherwise in-process with the PLSDB sketch index,
+    or with mash when the index has not been built
+    :param out_dir: output directory
+    :param fasta_file: plasmid FASTA
+    :param plassembler_db_dir: plassembler db directory
+    :param logdir: logdir
+    :param daemon: PLSDB daemon socket - None to use the local database
+    :return:
+    """
+    rows = daemon_mash_distances(
+        daemon, plassembler_db_dir, fasta_file, MASH_MAX_DISTANCE, MASH_MAX_PVALUE
+    )
+    if rows is not None:
+        write_mash_tsv(out_dir, rows)
+        return
+    index_dir = get_plsdb_sketch_index(str(plassembler_db_dir))
+    if index_dir is not None:
+        run_native_mash(out_dir, fasta_file, index_dir)
+    else:
+        mash_sketch(out_dir, fasta_file, logdir)
+        run_mash(out_dir, plassembler_db_dir, logdir)
+
+
 def get_contig_count(plasmid_fasta):
     """
     Process mash output
@@ -81,3 +150,56 @@ def is_file_empty(file):
     if os.stat(file).st_size == 0:
         empty = True
     return empty
+
+
+# columns of mash dist output
+MASH_COLUMNS = [
+    "contig",
+    "ACC_NUCCORE",
+    "mash_distance",
+    "mash_pval",
+    "mash_matching_hashes",
+]
+
+# columns of the top hit per contig
+TOPHIT_COLUMNS = [
+    "contig",
+    "PLSDB_hit",
+    "ACC_NUCCORE",
+    "mash_distance",
+    "mash_pval",
+    "mash_matching_hashes",
+]
+
+
+def get_mash_tophits(mash_tsv, contig_count):
+    """
+    Gets the closest PLSDB hit of each contig 1 to contig_count in one grouped operation
+    ties on mash_distance keep the first hit in mash's output
+    :param mash_tsv: mash dist output
+    :param contig_count: number of contigs
+    :return: tophits_mash_df: one row per contig, with empty strings for contigs without hits
+    """
+    contigs = range(1, contig_count + 1)
+
+    # empty mash file -> no hits
+    if is_file_empty(mash_tsv):
+        return pd.DataFrame(
+            [[contig, "", "", "", "", ""] for contig in contigs],
+            columns=TOPHIT_COLUMNS,
+        )
+
+    mash_df = pd.read_csv(mash_tsv, delimiter="\t", index_col=False, names=MASH_COLUMNS)
+    tophits = (
+        mash_df.sort_values("mash_distance", kind="stable")
+        .drop_duplicates("contig")
+        .set_index("contig")
+        .reindex(pd.Index(contigs, name="contig"))
+        .reset_index()
+    )
+    has_hit = tophits["ACC_NUCCORE"].notna()
+    tophits.insert(1, "PLSDB_hit", has_hit.map({True: "Yes", False: ""}))
+    tophits = tophits.astype(object).where(has_hit, "")
+    tophits["contig"] = contigs
+    # built from rows so the column dtypes are inferred as for per contig rows
+    return pd.DataFrame(tophits.to_numpy().tolist(), columns=TOPHIT_COLUMNS)
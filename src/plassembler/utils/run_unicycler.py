@@ -11,7 +11,7 @@ def run_unicycler(
     :param unicycler_output_dir: unicycler Output Directory
     :param threads: threads
     :param logdir: logdir
-    :return:
+    :return: False if Unicycler failed, which usually means there are no plasmids
     """
 
     unicycler = ExternalTool(
@@ -23,4 +23,4 @@ def run_unicycler(
         outfile="",
     )
 
-    ExternalTool.run_tool(unicycler, to_stdout=False)
+    return ExternalTool.run_tool(unicycler, to_stdout=False)
@@ -1,177 +1,204 @@
 import os
 from collections import defaultdict
+from contextlib import ExitStack
+from itertools import groupby
 
 import pysam
 
+from plassembler.utils.fastq import PHRED_OFFSET, FastqWriter, encode_qualities
 
-def extract_bin_long_fastqs(out_dir):
-    #################################################
-    # Define file paths
-    #################################################
-
-    sam_name = os.path.join(out_dir, "long_read.sam")
-
-    # reads mapping to plasmids, or not mapping to any contigs
-    plasmidfile = open(os.path.join(out_dir, "plasmid_long.fastq"), "w")
-
-    # Open a FASTQ file for writing reads mapping to multiple contigs
-    multimap_plasmid_chromosome_fastqfile = open(
-        os.path.join(out_dir, "multimap_plasmid_chromosome_long.fastq"), "w"
-    )
-
-    # chromosome fastqs
-    chrom_fastqfile = open(os.path.join(out_dir, "chromosome_mapped_long.fastq"), "w")
-
-    #################################################
-    # Get the single and multiple map reads as lists
-    #################################################
+# samtools fastq writes reverse strand reads in their original orientation
+COMPLEMENT = bytes.maketrans(b"ACGTNacgtn", b"TGCANtgcan")
 
-    # get names, single and multi as lists
-    read_names = []
-    single_read_names = []
-    multi_read_names = []
 
-    # open samfile
-    samfile = pysam.AlignmentFile(sam_name, "r")
-
-    # get list of all read names
-    for read in samfile.fetch():
-        read_names.append(read.query_name)
-
-    # Create a defaultdict with int as the default factory
-    count_dict = defaultdict(int)
-
-    # Loop through the list and count occurrences
-    for item in read_names:
-        count_dict[item] += 1
-
-    # Get the counts
-    for key, value in count_dict.items():
-        if value == 1:
-            single_read_names.append(key)
-        else:
-            multi_read_names.append(key)
-
-    samfile.close()
+def extract_bin_long_fastqs(out_dir, sam_file=None, depth_accumulator=None):
+    """bins long reads into plasmid, chromosome and multimap FASTQs in a single pass
+    minimap2 writes every alignment of a read consecutively, so each read is classified
+    once from its group of alignments without holding any read names in memory
+    :param out_dir: output directory
+    :param sam_file: long read SAM - defaults to long_read.sam in out_dir
+    :param depth_accumulator: optional DepthAccumulator also fed every alignment
+    :return:
+    """
 
     #################################################
-    # process all single reads and then get counts of plasmid vs chromosome ####
-    #################################################
-
-    samfile = pysam.AlignmentFile(sam_name, "r")
-
-    # Create a defaultdict with int as the default  for the multimap reads
-    plasmid_mm_dict = defaultdict(int)
-    chromosome_mm_dict = defaultdict(int)
-
-    for read in samfile.fetch():
-        # Access the read's name, sequence, quality scores, etc.
-        read_name = read.query_name
-        sequence = read.query_sequence
-        quality = read.query_qualities
-        flag = read.flag
-        # get contig name for the read
-        contig_name = samfile.get_reference_name(read.reference_id)
-
-        # print(read_name)
-        # print(read.reference_id)
-        # print(read.next_reference_id)
-        # print(contig_name)
-        # print(flag)
-
-        # single reads - easy :)
-        if read_name in single_read_names:
-            # gets all reads that plasmid mapped reads and all unmapped reads
-            if (contig_name and "plasmid" in contig_name) or read.is_unmapped:
-                # Write the read to the FASTQ file
-                plasmidfile.write(f"@{read_name}\n")  # Write read name
-                plasmidfile.write(f"{sequence}\n")  # Write sequence
-                plasmidfile.write("+{0}\n".format(read_name))  # Write quality header
-                plasmidfile.write(
-                    "".join(chr(q + 33) for q in quality) + "\n"
-                )  # Write quality scores in ASCII format
-            elif contig_name and "chromosome" in contig_name:
-                # Write the read to the unmapped reads FASTQ file
-                chrom_fastqfile.write(f"@{read_name}\n")  # Write read name
-                chrom_fastqfile.write(f"{sequence}\n")  # Write sequence
-                chrom_fastqfile.write(
-                    "+{0}\n".format(read_name)
-                )  # Write quality header
-                chrom_fastqfile.write(
-                    "".join(chr(q + 33) for q in quality) + "\n"
-                )  # Write quality scores in ASCII format
-        # create count dictionaries for multimap reads next step
-        else:
-            if contig_name and "plasmid" in contig_name:
-                plasmid_mm_dict[read_name] += 1
-            elif contig_name and "chromosome" in contig_name:
-                chromosome_mm_dict[read_name] += 1
-
-    samfile.close()
-
-    #################################################
-    # process all multimap reads
+    # Define file paths
     #################################################
 
-    samfile = pysam.AlignmentFile(sam_name, "r")
-
-    for read in samfile.fetch():
-        read_name = read.query_name
-        sequence = read.query_sequence
-        quality = read.query_qualities
-        flag = read.flag
-
-        # multireads
-        if read_name in multi_read_names:
-            if (
-                plasmid_mm_dict[read_name] > 0 and chromosome_mm_dict[read_name] > 0
-            ):  # multimap both plasmid and chromosome
-                if quality is not None and (
-                    flag == 0 or flag == 16
-                ):  # get only the primary
-                    multimap_plasmid_chromosome_fastqfile.write(
-                        f"@{read_name}\n"
-                    )  # Write read name
-                    multimap_plasmid_chromosome_fastqfile.write(
-                        f"{sequence}\n"
-                    )  # Write sequence
-                    multimap_plasmid_chromosome_fastqfile.write(
-                        "+{0}\n".format(read_name)
-                    )  # Write quality header
-                    multimap_plasmid_chromosome_fastqfile.write(
-                        "".join(chr(q + 33) for q in quality) + "\n"
-                    )  # Write quality scores in ASCII format
-            # write all that map to plasmid to the plasmid file
-            elif plasmid_mm_dict[read_name] > 0:  # multimap plasmid
-                if quality is not None and (
-                    flag == 0 or flag == 16
-                ):  # get only the primary
-                    plasmidfile.write(f"@{read_name}\n")  # Write read name
-                    plasmidfile.write(f"{sequence}\n")  # Write sequence
-                    plasmidfile.write(
-                        "+{0}\n".format(read_name)
-                    )  # Write quality header
-                    plasmidfile.write(
-                        "".join(chr(q + 33) for q in quality) + "\n"
-                    )  # Write quality scores in ASCII format
-                    # write all that map to chromosome to the plasmid file
-            elif chromosome_mm_dict[read_name] > 0:  # multimap chromosome
-                if quality is not None and (
-                    flag == 0 or flag == 16
-                ):  # get only the primary
-                    chrom_fastqfile.write(f"@{read_name}\n")  # Write read name
-                    chrom_fastqfile.write(f"{sequence}\n")  # Write sequence
-                    chrom_fastqfile.write(
-                        "+{0}\n".format(read_name)
-                    )  # Write quality header
-                    chrom_fastqfile.write(
-                        "".join(chr(q + 33) for q in quality) + "\n"
-                    )  # Write quality scores in ASCII format
-
-    # Close the FASTQ files
-    plasmidfile.close()
-    chrom_fastqfile.close()
-    multimap_plasmid_chromosome_fastqfile.close()
-
-    # Close the SAM file
-    samfile.close()
+    if sam_file is None:
+        sam_file = os.path.join(out_dir, "long_read.sam")
+
+    # closes the FASTQs and the SAM even when reading the SAM fails
+    with ExitStack() as stack:
+        # reads mapping to plasmids, or not mapping to any contigs
+        plasmidfile = stack.enter_context(
+            FastqWriter(os.path.join(out_dir, "plasmid_long.fastq"))
+        )
+
+        # Open a FASTQ file for writing reads mapping to multiple contigs
+        multimap_plasmid_chromosome_fastqfile = stack.enter_context(
+            FastqWriter(os.path.join(out_dir, "multimap_plasmid_chromosome_long.fastq"))
+        )
+
+        # chromosome fastqs
+        chrom_fastqfile = stack.enter_context(
+            FastqWriter(os.path.join(out_dir, "chromosome_mapped_long.fastq"))
+        )
+
+        #################################################
+        # classify each read from its group of alignments
+        #################################################
+
+        samfile = stack.enter_context(pysam.AlignmentFile(sam_file, "r"))
+
+        for _, group in groupby(
+            samfile.fetch(until_eof=True), key=lambda read: read.query_name
+        ):
+            alignments = list(group)
+
+            # per-base depth from the same alignment - saves remapping for depth
+            if depth_accumulator is not None:
+                for read in alignments:
+                    depth_accumulator.add_alignment(read)
+
+            # single reads - easy :)
+            if len(alignments) == 1:
+                read = alignments[0]
+                contig_name = read.reference_name
+                # gets all reads that plasmid mapped reads and all unmapped reads
+                if (contig_name and "plasmid" in contig_name) or read.is_unmapped:
+                    plasmidfile.write_read(read)
+                elif contig_name and "chromosome" in contig_name:
+                    chrom_fastqfile.write_read(read)
+                continue
+
+            # multimap reads - count the plasmid and chromosome alignments
+            plasmid_count = 0
+            chromosome_count = 0
+            for read in alignments:
+                contig_name = read.reference_name
+                if contig_name and "plasmid" in contig_name:
+                    plasmid_count += 1
+                elif contig_name and "chromosome" in contig_name:
+                    chromosome_count += 1
+
+            if plasmid_count > 0 and chromosome_count > 0:
+                # multimap both plasmid and chromosome
+                fastqfile = multimap_plasmid_chromosome_fastqfile
+            elif plasmid_count > 0:
+                # write all that map to plasmid to the plasmid file
+                fastqfile = plasmidfile
+            elif chromosome_count > 0:
+                fastqfile = chrom_fastqfile
+            else:
+                continue
+
+            # get only the primary
+            for read in alignments:
+                if read.query_qualities is not None and (
+                    read.flag == 0 or read.flag == 16
+                ):
+                    fastqfile.write_read(read)
+
+
+def read_bed_regions(bed_file):
+    """reads the regions of a bed file
+    :param bed_file: bed file
+    :return: regions: dictionary of contigs and lists of (start, end) tuples
+    """
+    regions = defaultdict(list)
+    with open(bed_file, "r") as bed:
+        for line in bed:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) >= 3:
+                regions[fields[0]].append((int(fields[1]), int(fields[2])))
+    return regions
+
+
+def overlaps_regions(read, regions):
+    """checks whether an alignment overlaps any bed region, as samtools view -L does
+    :param read: pysam AlignedSegment
+    :param regions: dictionary from read_bed_regions
+    :return: bool
+    """
+    if read.reference_name is None:
+        return False
+    start = read.reference_start
+    # unmapped reads placed next to their mate cover a single base
+    end = read.reference_end if read.reference_end is not None else start + 1
+    for region_start, region_end in regions.get(read.reference_name, ()):
+        if start < region_end and end > region_start:
+            return True
+    return False
+
+
+def write_original_orientation(fastqfile, read):
+    """writes a read as it was sequenced, reverse complementing reverse strand alignments
+    :param fastqfile: FastqWriter
+    :param read: pysam AlignedSegment
+    :return:
+    """
+    sequence = read.query_sequence.encode()
+    if read.query_qualities is None:
+        quality = bytes([PHRED_OFFSET + 1]) * len(sequence)
+    else:
+        quality = encode_qualities(read.query_qualities)
+    if read.is_reverse:
+        sequence = sequence.translate(COMPLEMENT)[::-1]
+        quality = quality[::-1]
+    fastqfile.write(read.query_name.encode(), sequence, quality)
+
+
+def extract_short_fastqs(out_dir, sam_file=None, bed_file=None):
+    """extracts short read pairs that are unmapped or map to non-chromosome contigs in a single pass
+    replaces the samtools view, samtools fastq and concatenation steps
+    a pair is kept when both primary alignments are unmapped,
+    or both overlap the non_chromosome.bed regions - singletons are dropped as with samtools fastq -s /dev/null
+    :param out_dir: output directory
+    :param sam_file: short read SAM (or minimap2's stdout) - defaults to short_read.sam in out_dir
+    :param bed_file: non-chromosome bed - defaults to non_chromosome.bed in out_dir
+    :return:
+    """
+
+    if sam_file is None:
+        sam_file = os.path.join(out_dir, "short_read.sam")
+    if bed_file is None:
+        bed_file = os.path.join(out_dir, "non_chromosome.bed")
+
+    regions = read_bed_regions(bed_file)
+
+    # closes the FASTQs and the SAM even when reading the SAM fails
+    with ExitStack() as stack:
+        r1_fastqfile = stack.enter_context(
+            FastqWriter(os.path.join(out_dir, "short_read_concat_R1.fastq"))
+        )
+        r2_fastqfile = stack.enter_context(
+            FastqWriter(os.path.join(out_dir, "short_read_concat_R2.fastq"))
+        )
+
+        samfile = stack.enter_context(pysam.AlignmentFile(sam_file, "r"))
+
+        # minimap2 writes both ends of a pair consecutively
+        for _, group in groupby(
+            samfile.fetch(until_eof=True), key=lambda read: read.query_name
+        ):
+            read_one = None
+            read_two = None
+            for read in group:
+                # primary alignments only
+                if read.is_secondary or read.is_supplementary:
+                    continue
+                if read.is_read1:
+                    read_one = read
+                elif read.is_read2:
+                    read_two = read
+
+            if read_one is None or read_two is None:
+                continue
+
+            if (read_one.is_unmapped and read_two.is_unmapped) or (
+                overlaps_regions(read_one, regions)
+                and overlaps_regions(read_two, regions)
+            ):
+                write_original_orientation(r1_fastqfile, read_one)
+                write_original_orientation(r2_fastqfile, read_two)
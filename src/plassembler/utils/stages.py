@@ -0,0 +1,459 @@
+import json
+import os
+import shutil
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from loguru import logger
+
+from plassembler.utils.assembly import run_flye, run_raven
+from plassembler.utils.daemon import ping_plsdb_daemon
+from plassembler.utils.mapping import (
+    minimap_long_reads_to_pipe,
+    minimap_short_reads_to_pipe,
+)
+from plassembler.utils.plsdb import preload_plsdb_metadata
+from plassembler.utils.qc import (
+    chopper,
+    copy_sr_fastq_file,
+    fastp,
+    get_staged_sr_fastq_file,
+    get_trimmed_short_reads,
+)
+from plassembler.utils.run_unicycler import run_unicycler
+from plassembler.utils.sam_to_fastq import (
+    extract_bin_long_fastqs,
+    extract_short_fastqs,
+)
+from plassembler.utils.util import hash_file, stage_file
+
+# fastp's default number of worker threads
+FASTP_THREADS = 3
+
+# files up to this size are fingerprinted by content for --resume
+CONTENT_FINGERPRINT_LIMIT = 64 * 1024 * 1024
+
+
+class Stage:
+    """One step of a pipeline with declared input and output files"""
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[int], Any],
+        inputs: Iterable[Path] = (),
+        outputs: Iterable[Path] = (),
+        threads: Optional[int] = None,
+        checkpoint: bool = False,
+        params: str = "",
+    ) -> None:
+        """
+        Parameters
+        --------
+        name: str, required
+            unique name of the stage
+        func: callable, required
+            runs the stage - called with the number of threads granted to it.
+            Returning False leaves the stage without a checkpoint, so --resume runs it again
+        inputs: list of Paths, optional
+            files the stage reads - it runs after the stages that write them
+        outputs: list of Paths, optional
+            files the stage writes
+        threads: int, optional
+            fixed number of threads the stage uses. None for stages that scale
+            and share whatever threads are free when they start
+        checkpoint: bool, optional
+            whether to record a completion marker so --resume can skip the stage
+        params: str, optional
+            options affecting the outputs - part of the checkpoint fingerprint
+        """
+        self.name = name
+        self.func = func
+        self.inputs = [str(path) for path in inputs]
+        self.outputs = [str(path) for path in outputs]
+        self.threads = threads
+        self.checkpoint = checkpoint
+        self.params = params
+
+
+def file_fingerprint(path):
+    """fingerprint of a file for the resume checkpoints
+    small files (e.g. assemblies) are rewritten by cheap steps on every run, so they are fingerprinted by content
+    large files (e.g. reads) by their size and modification time
+    :param path: file
+    :return: [path, size, sha256 or mtime_ns] or None if it does not exist
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    if stat.st_size <= CONTENT_FINGERPRINT_LIMIT:
+        return [str(path), stat.st_size, hash_file(path)]
+    return [str(path), stat.st_size, stat.st_mtime_ns]
+
+
+class StageGraph:
+    """Dependency graph of stages run concurrently under a thread budget
+
+    A stage depends on the stages that write its inputs. Ready stages are
+    started as soon as threads are free: fixed-thread stages first, then the
+    scalable stages split the remaining threads between them.
+    """
+
+    def __init__(
+        self, threads, checkpoint_dir: Optional[Path] = None, resume: bool = False
+    ) -> None:
+        """
+        Parameters
+        --------
+        threads: int, required
+            total thread budget shared by all running stages
+        checkpoint_dir: Path, optional
+            directory for the completion markers of checkpointed stages
+        resume: bool, optional
+            skip checkpointed stages whose marker matches their inputs and outputs
+        """
+        self.threads = max(1, int(threads))
+        self.checkpoint_dir = checkpoint_dir
+        self.resume = resume
+        self.stages: Dict[str, Stage] = {}
+        self.results: Dict[str, Any] = {}
+        self.skipped = set()
+
+    def add(self, stage: Stage) -> Stage:
+        """adds a stage
+        :param stage: Stage
+        :return: stage
+        """
+        if stage.name in self.stages:
+            raise ValueError(f"Duplicate stage {stage.name}")
+        self.stages[stage.name] = stage
+        return stage
+
+    def dependencies(self, stage: Stage) -> set:
+        """names of the stages writing the inputs of stage
+        :param stage: Stage
+        :return: set of stage names
+        """
+        return {
+            other.name
+            for other in self.stages.values()
+            if other is not stage and set(other.outputs) & set(stage.inputs)
+        }
+
+    def marker(self, stage: Stage) -> Path:
+        return Path(self.checkpoint_dir) / f"{stage.name}.done"
+
+    def fingerprint(self, stage: Stage) -> dict:
+        """fingerprint of the stage's params and inputs
+        :param stage: Stage
+        :return: dictionary
+        """
+        return {
+            "params": stage.params,
+            "inputs": [file_fingerprint(path) for path in stage.inputs],
+        }
+
+    def is_complete(self, stage: Stage) -> bool:
+        """whether the stage's marker matches its current inputs and outputs
+        :param stage: Stage
+        :return: bool
+        """
+        if self.checkpoint_dir is None or stage.checkpoint is False:
+            return False
+        try:
+            with open(self.marker(stage), "r") as f:
+                marker = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return False
+        outputs = [file_fingerprint(path) for path in stage.outputs]
+        return (
+            marker.get("fingerprint") == self.fingerprint(stage)
+            and None not in outputs
+            and marker.get("outputs") == outputs
+        )
+
+    def record_complete(self, stage: Stage) -> None:
+        """writes the stage's marker, only if all its outputs exist
+        :param stage: Stage
+        :return:
+        """
+        if self.checkpoint_dir is None or stage.checkpoint is False:
+            return
+        outputs = [file_fingerprint(path) for path in stage.outputs]
+        if None in outputs:
+            return
+        Path(self.checkpoint_dir).mkdir(parents=True, exist_ok=True)
+        marker = self.marker(stage)
+        tmp_marker = marker.with_suffix(".tmp")
+        with open(tmp_marker, "w") as f:
+            json.dump({"fingerprint": self.fingerprint(stage), "outputs": outputs}, f)
+        os.replace(tmp_marker, marker)
+
+    def run(self) -> Dict[str, Any]:
+        """runs all stages, re-raising the first error (including SystemExit) once running stages finish
+        :return: results: dictionary of stage names and their return values
+        """
+        dependencies = {
+            name: self.dependencies(stage) for name, stage in self.stages.items()
+        }
+        pending = list(self.stages)
+        running = {}
+        done = set()
+        free = self.threads
+
+        with ThreadPoolExecutor(max_workers=max(1, len(self.stages))) as executor:
+            while pending or running:
+                ready = [name for name in pending if dependencies[name] <= done]
+                # with --resume skip stages completed by an earlier run
+                if self.resume is True:
+                    complete = [n for n in ready if self.is_complete(self.stages[n])]
+                    for name in complete:
+                        logger.info(f"Skipping {name} - completed by a previous run.")
+                        pending.remove(name)
+                        done.add(name)
+                        self.skipped.add(name)
+                        self.results[name] = None
+                    if complete:
+                        continue
+                scalable = sum(self.stages[name].threads is None for name in ready)
+                # fixed-thread stages first so scalable stages get what is left
+                for name in sorted(ready, key=lambda n: self.stages[n].threads is None):
+                    stage = self.stages[name]
+                    if stage.threads is not None:
+                        granted = min(stage.threads, self.threads)
+                        if granted > free and running:
+                            continue
+                    else:
+                        if free < 1 and running:
+                            continue
+                        granted = max(1, free // scalable)
+                        scalable -= 1
+                    free -= granted
+                    pending.remove(name)
+                    logger.debug(f"Starting stage {name} with {granted} threads.")
+                    running[executor.submit(stage.func, granted)] = (name, granted)
+
+                if not running:
+                    raise ValueError(f"Stages {pending} have unmet dependencies")
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name, granted = running.pop(future)
+                    free += granted
+                    try:
+                        self.results[name] = future.result()
+                    except BaseException:
+                        # let the stages already running finish before bailing out
+                        wait(running)
+                        raise
+                    if self.results[name] is not False:
+                        self.record_complete(self.stages[name])
+                    done.add(name)
+
+        return self.results
+
+
+#################################
+# plassembler stages
+#################################
+
+
+def long_read_qc_stage(
+    longreads, outdir, min_length, min_quality, long_zipped, skip_qc, logdir
+):
+    """filters the long reads with chopper, or stages them with --skip_qc
+    :return: Stage
+    """
+    chopper_long_reads: Path = Path(outdir) / "chopper_long_reads.fastq.gz"
+
+    def run_stage(threads):
+        if skip_qc is False:
+            logger.info("Filtering long reads with chopper")
+            chopper(
+                longreads,
+                outdir,
+                min_length,
+                min_quality,
+                long_zipped,
+                str(threads),
+                logdir,
+            )
+        else:  # stage the input in the outdir - Flye, Raven and minimap2 read it plain or gzipped
+            stage_file(longreads, chopper_long_reads)
+
+    return Stage(
+        "long_read_qc",
+        run_stage,
+        inputs=[longreads],
+        outputs=[chopper_long_reads],
+        threads=1 if skip_qc is True else None,
+        checkpoint=True,
+        params=f"skip_qc={skip_qc} min_length={min_length} min_quality={min_quality}",
+    )
+
+
+def short_read_qc_stage(short_one, short_two, outdir, skip_qc, logdir):
+    """trims the short reads with fastp, or stages them with --skip_qc
+    :return: Stage
+    """
+    out_one: Path = Path(outdir) / "trimmed_R1.fastq"
+    out_two: Path = Path(outdir) / "trimmed_R2.fastq"
+    if skip_qc is True:
+        out_one = get_staged_sr_fastq_file(Path(short_one), out_one)
+        out_two = get_staged_sr_fastq_file(Path(short_two), out_two)
+
+    def run_stage(threads):
+        if skip_qc is True:  # stage the input in the outdir
+            logger.info("Skipping short read trimming as --skip_qc was specified")
+            copy_sr_fastq_file(Path(short_one), Path(outdir) / "trimmed_R1.fastq")
+            copy_sr_fastq_file(Path(short_two), Path(outdir) / "trimmed_R2.fastq")
+        else:
+            logger.info("Trimming short reads.")
+            fastp(short_one, short_two, outdir, logdir)
+
+    return Stage(
+        "short_read_qc",
+        run_stage,
+        inputs=[short_one, short_two],
+        outputs=[out_one, out_two],
+        threads=1 if skip_qc is True else FASTP_THREADS,
+        checkpoint=True,
+        params=f"skip_qc={skip_qc}",
+    )
+
+
+def long_read_assembly_stage(outdir, use_raven, raw_flag, pacbio_model, logdir):
+    """assembles the filtered long reads with Flye, or Raven with --use_raven
+    :return: Stage
+    """
+
+    def run_stage(threads):
+        if use_raven is True:
+            logger.info("Running Raven.")
+            run_raven(outdir, threads, logdir)
+        else:
+            logger.info("Running Flye.")
+            run_flye(outdir, threads, raw_flag, pacbio_model, logdir)
+
+    outputs = [Path(outdir) / "assembly.fasta"]
+    if use_raven is False:
+        # the contig depths come from Flye's assembly_info.txt
+        outputs.append(Path(outdir) / "assembly_info.txt")
+
+    return Stage(
+        "long_read_assembly",
+        run_stage,
+        inputs=[Path(outdir) / "chopper_long_reads.fastq.gz"],
+        outputs=outputs,
+        checkpoint=True,
+        params=f"use_raven={use_raven} raw_flag={raw_flag} pacbio_model={pacbio_model}",
+    )
+
+
+def long_read_binning_stage(outdir, pacbio_model, logdir, depth_accumulator=None):
+    """maps the long reads to the renamed assembly and bins them in one stream
+    :param depth_accumulator: optional DepthAccumulator also fed the alignments
+    :return: Stage
+    """
+    input_long_reads: Path = Path(outdir) / "chopper_long_reads.fastq.gz"
+    fasta: Path = Path(outdir) / "flye_renamed.fasta"
+
+    def run_stage(threads):
+        logger.info("Mapping long reads and extracting Fastqs.")
+        minimap_long_reads_to_pipe(
+            input_long_reads,
+            fasta,
+            threads,
+            pacbio_model,
+            logdir,
+            partial(
+                extract_bin_long_fastqs, outdir, depth_accumulator=depth_accumulator
+            ),
+        )
+
+    return Stage(
+        "long_read_binning",
+        run_stage,
+        inputs=[input_long_reads, fasta],
+        outputs=[
+            Path(outdir) / "plasmid_long.fastq",
+            Path(outdir) / "chromosome_mapped_long.fastq",
+            Path(outdir) / "multimap_plasmid_chromosome_long.fastq",
+        ],
+        checkpoint=True,
+        params=f"pacbio_model={pacbio_model}",
+    )
+
+
+def short_read_binning_stage(outdir, logdir):
+    """maps the short reads to the renamed assembly and keeps the non-chromosome pairs in one stream
+    :return: Stage
+    """
+    r1, r2 = get_trimmed_short_reads(outdir)
+    fasta: Path = Path(outdir) / "flye_renamed.fasta"
+
+    def run_stage(threads):
+        logger.info("Mapping short reads and extracting Fastqs.")
+        minimap_short_reads_to_pipe(
+            r1, r2, fasta, threads, logdir, partial(extract_short_fastqs, outdir)
+        )
+
+    return Stage(
+        "short_read_binning",
+        run_stage,
+        inputs=[r1, r2, fasta, Path(outdir) / "non_chromosome.bed"],
+        outputs=[
+            Path(outdir) / "short_read_concat_R1.fastq",
+            Path(outdir) / "short_read_concat_R2.fastq",
+        ],
+        checkpoint=True,
+    )
+
+
+def unicycler_stage(outdir, logdir):
+    """assembles the binned plasmid reads with Unicycler
+    :return: Stage
+    """
+    long_reads: Path = Path(outdir) / "plasmid_long.fastq"
+    short_r1: Path = Path(outdir) / "short_read_concat_R1.fastq"
+    short_r2: Path = Path(outdir) / "short_read_concat_R2.fastq"
+    unicycler_dir: Path = Path(outdir) / "unicycler_output"
+
+    def run_stage(threads):
+        # a run killed part way through (e.g. OOM) leaves a stale directory behind
+        if unicycler_dir.is_dir():
+            shutil.rmtree(unicycler_dir)
+        # no short reads were binned to the plasmids -> nothing for Unicycler to assemble
+        if short_r1.stat().st_size == 0 or short_r2.stat().st_size == 0:
+            logger.info("No short reads map to plasmids. Skipping Unicycler.")
+            return
+        logger.info("Running Unicycler.")
+        # a kill (e.g. OOM) exits here, keeping the intermediate files
+        # other failures usually mean no plasmids - not checkpointed, so --resume retries Unicycler
+        return run_unicycler(
+            threads, logdir, short_r1, short_r2, long_reads, unicycler_dir
+        )
+
+    return Stage(
+        "unicycler",
+        run_stage,
+        inputs=[long_reads, short_r1, short_r2],
+        outputs=[unicycler_dir / "assembly.fasta"],
+        checkpoint=True,
+    )
+
+
+def plsdb_stage(database, daemon=None):
+    """loads the PLSDB metadata into the cache used by process_mash_tsv, unless it is indexed
+    or a PLSDB daemon serves it
+    :return: Stage
+    """
+
+    def load_plsdb(threads):
+        if ping_plsdb_daemon(daemon, database) is None:
+            preload_plsdb_metadata(database)
+
+    return Stage("plsdb_metadata", load_plsdb, threads=1)
@@ -1,4 +1,6 @@
+import hashlib
 import os
+import shutil
 import sys
 
 import click
@@ -28,6 +30,73 @@ def print_citation():
             echo_click(line)
 
 
+def hash_file(path, chunk_size: int = 1024 * 1024) -> str:
+    """sha256 of a file's content, read in chunks
+    :param path: file
+    :param chunk_size: bytes hashed per read
+    :return: hex digest
+    """
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+# ioctl cloning a file's extents on copy-on-write filesystems e.g. btrfs and XFS
+FICLONE = 0x40049409
+
+
+def reflink_file(source, destination) -> bool:
+    """clones source into destination without copying its data, where the filesystem supports it
+    :param source: file
+    :param destination: new file
+    :return: True if the file was cloned
+    """
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    try:
+        with open(source, "rb") as src, open(destination, "wb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    except OSError:
+        if os.path.exists(destination):
+            os.remove(destination)
+        return False
+    shutil.copystat(source, destination)
+    return True
+
+
+def stage_file(source, destination, allow_symlink: bool = True) -> str:
+    """makes source available at destination without copying its data where possible
+    a hardlink, then a reflink, then a symlink, falling back to a copy
+    staged files must never be written in place, as a hardlink shares the source's data
+    :param source: file
+    :param destination: path to stage it at - replaced if it exists
+    :param allow_symlink: False for outputs, which must outlive the source
+    :return: how the file was staged - hardlink, reflink, symlink or copy
+    """
+    source = os.path.realpath(source)
+    if os.path.lexists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+        return "hardlink"
+    except OSError:
+        pass
+    if reflink_file(source, destination):
+        return "reflink"
+    if allow_symlink is True:
+        try:
+            os.symlink(source, destination)
+            return "symlink"
+        except OSError:
+            pass
+    shutil.copy2(source, destination)
+    return "copy"
+
+
 def echo_click(msg, log=None):
     click.echo(msg, nl=False, err=True)
     if log:
@@ -5,18 +5,31 @@ Usage: pytest
 
 """
 
+import os
 import shutil
 import sys
+import tempfile
 
 # import
 import unittest
 from pathlib import Path
+from unittest.mock import patch
 
+import pandas as pd
 import pytest
 from loguru import logger
 
 # import functions
 from src.plassembler.utils.db import check_db_installation, get_database_zenodo
+from src.plassembler.utils.minhash import PLSDB_SKETCH_INDEX, get_plsdb_sketch_index
+from src.plassembler.utils.plsdb import (
+    PLSDB_COLUMNS,
+    PLSDB_STORE,
+    build_plsdb_store,
+    fetch_plsdb_metadata,
+    get_plsdb_store,
+    load_plsdb_metadata,
+)
 
 # data
 test_data = Path("tests/test_data")
@@ -38,13 +51,33 @@ logger.add(lambda _: sys.exit(1), level="ERROR")
 class test_install(unittest.TestCase):
     """Test for db"""
 
-    # for plassembler run
+    # for plassembler run - builds the indexed metadata store and the sketch index on first use
     def test_check_db_installation_good(self):
-        check_db_installation(db_path, False)
+        with tempfile.TemporaryDirectory() as tmp:
+            db_copy: Path = Path(tmp) / "db"
+            shutil.copytree(db_path, db_copy)
+            check_db_installation(db_copy, False)
+            self.assertIsNotNone(get_plsdb_store(str(db_copy)))
+            self.assertIsNotNone(get_plsdb_sketch_index(str(db_copy)))
+
+    # a read-only database is used as it is
+    def test_check_db_installation_read_only(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            db_copy: Path = Path(tmp) / "db"
+            shutil.copytree(db_path, db_copy)
+            with patch("os.access", return_value=False):
+                check_db_installation(db_copy, False)
+            self.assertIsNone(get_plsdb_store(str(db_copy)))
+            self.assertIsNone(get_plsdb_sketch_index(str(db_copy)))
 
     # for plassembler download
     def test_check_db_installation_good_d(self):
         check_db_installation(db_path, True)
+        # download builds the indexed metadata store and the sketch index
+        self.assertIsNotNone(get_plsdb_store(str(db_path)))
+        self.assertIsNotNone(get_plsdb_sketch_index(str(db_path)))
+        os.remove(db_path / PLSDB_STORE)
+        shutil.rmtree(db_path / PLSDB_SKETCH_INDEX)
 
     def test_check_db_installation_bad(self):
         with self.assertRaises(SystemExit):
@@ -56,3 +89,30 @@ class test_install(unittest.TestCase):
         # remove it after downloading
         shutil.rmtree(tmp_db_path)
         self.assertEqual(expected_return, True)
+
+
+class test_plsdb_store(unittest.TestCase):
+    """Test for the indexed PLSDB metadata store"""
+
+    # rows fetched from the store match those read from plsdb.tsv, dtypes included
+    def test_fetch_plsdb_metadata(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            plsdb_df = pd.DataFrame(
+                [[f"{column}_{i}" for column in PLSDB_COLUMNS] for i in range(3)],
+                columns=PLSDB_COLUMNS,
+            )
+            plsdb_df["UID_NUCCORE"] = [1, 2, 3]
+            plsdb_df["Length_NUCCORE"] = [5000.5, None, 7000.0]
+            plsdb_df["Host_BIOSAMPLE"] = ["human", None, "cow"]
+            plsdb_df.to_csv(os.path.join(tmp, "plsdb.tsv"), sep="\t", index=False)
+            accessions = ["ACC_NUCCORE_1", "ACC_NUCCORE_2", "missing", ""]
+            expected = fetch_plsdb_metadata(tmp, accessions).reset_index(drop=True)
+            load_plsdb_metadata.cache_clear()
+
+            build_plsdb_store(tmp)
+            self.assertIsNotNone(get_plsdb_store(tmp))
+            fetched = fetch_plsdb_metadata(tmp, accessions)
+            pd.testing.assert_frame_equal(fetched, expected)
+            self.assertEqual(
+                fetched["ACC_NUCCORE"].tolist(), ["ACC_NUCCORE_1", "ACC_NUCCORE_2"]
+            )
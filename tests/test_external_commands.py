@@ -5,11 +5,14 @@ Usage: pytest
 
 """
 
+import gzip
 import os
 import shutil
+import tempfile
 
 # import
 import unittest
+from functools import partial
 from pathlib import Path
 from unittest.mock import patch
 
@@ -17,13 +20,20 @@ import pytest
 
 # import functions
 from src.plassembler.utils.assembly import run_flye, run_raven
-from src.plassembler.utils.bam import bam_to_fastq_short, sam_to_bam, split_bams
 from src.plassembler.utils.cleanup import remove_directory, remove_file
 from src.plassembler.utils.external_tools import ExternalTool
-from src.plassembler.utils.mapping import minimap_long_reads, minimap_short_reads
-from src.plassembler.utils.qc import chopper, fastp
+from src.plassembler.utils.mapping import (
+    get_minimap2_index,
+)
+from src.plassembler.utils.qc import (
+    chopper,
+    fastp,
+    get_gzip_command,
+    split_chopper_threads,
+)
 from src.plassembler.utils.run_mash import get_contig_count, mash_sketch, run_mash
 from src.plassembler.utils.run_unicycler import run_unicycler
+from src.plassembler.utils.sam_to_fastq import extract_bin_long_fastqs
 
 test_data = Path("tests/test_data")
 val_data = Path(f"{test_data}/validation")
@@ -62,59 +72,17 @@ class test_mash(unittest.TestCase):
         self.assertEqual(count, 1)
 
 
-class test_bam(unittest.TestCase):
-    """Tests for bam.py"""
-
-    # sam to bam
-    def test_sam_to_bam(self):
-        expected_return = True
-        threads = 1
-        samfile: Path = Path(f"{map_dir}/sam_to_bam/test.sam")
-        bamfile: Path = Path(f"{map_dir}/sam_to_bam/test.bam")
-        sam_to_bam(samfile, bamfile, threads, logdir)
-        remove_file(bamfile)
-        self.assertEqual(expected_return, True)
-
-    def test_split(self):
-        expected_return = True
-        split_bams(map_dir, threads=1, logdir=logdir)
-        self.assertEqual(expected_return, True)
-
-    def test_bam_to_fastq_short(self):
-        expected_return = True
-        bam_to_fastq_short(map_dir, threads=1, logdir=logdir)
-        self.assertEqual(expected_return, True)
-
-
 class test_mapping(unittest.TestCase):
     """Test for mapping"""
 
-    # long read map
-    def test_minimap_long_reads(self):
-        expected_return = True
-        pacbio_model = ""
-        input_long_reads: Path = Path(f"{map_dir}/chopper_long_reads.fastq.gz")
-        fasta: Path = Path(f"{map_dir}/flye_renamed.fasta")
-        samfile: Path = Path(f"{map_dir}/test.sam")
-        threads = 1
-        minimap_long_reads(
-            input_long_reads, fasta, samfile, threads, pacbio_model, logdir
-        )
-        remove_file(samfile)
-        self.assertEqual(expected_return, True)
-
-        # short read map
-
-    def test_minimap_short_reads(self):
-        expected_return = True
-        r1: Path = Path(f"{map_dir}/trimmed_R1.fastq")
-        r2: Path = Path(f"{map_dir}/trimmed_R2.fastq")
+    # the index is built once per reference and preset, then reused
+    def test_get_minimap2_index(self):
         fasta: Path = Path(f"{map_dir}/flye_renamed.fasta")
-        samfile: Path = Path(f"{map_dir}/test.sam")
-        threads = 1
-        minimap_short_reads(r1, r2, fasta, samfile, threads, logdir)
-        remove_file(samfile)
-        self.assertEqual(expected_return, True)
+        index = get_minimap2_index(fasta, "sr", 1, logdir)
+        modified = os.path.getmtime(index)
+        self.assertEqual(get_minimap2_index(fasta, "sr", 1, logdir), index)
+        self.assertEqual(os.path.getmtime(index), modified)
+        remove_file(index)
 
 
 class test_qc_gzip(unittest.TestCase):
@@ -139,6 +107,59 @@ class test_qc_gzip(unittest.TestCase):
         remove_file(os.path.join(fake_out_dir, "chopper_long_reads.fastq.gz"))
         self.assertEqual(expected_return, True)
 
+    # the pipe around chopper, with a chopper passing the reads through
+    def test_chopper_pipe(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            bin_dir: Path = Path(tmp) / "bin"
+            bin_dir.mkdir()
+            (bin_dir / "chopper").write_text("#!/bin/sh\ncat\n")
+            (bin_dir / "chopper").chmod(0o755)
+            with patch.dict(
+                os.environ, {"PATH": f"{bin_dir}{os.pathsep}{os.environ['PATH']}"}
+            ):
+                for input_long_reads, gzip_flag in [
+                    (os.path.join(test_data, "test_long.fastq.gz"), True),
+                    (os.path.join(test_data, "test_long.fastq"), False),
+                ]:
+                    # the reads staged by a --skip_qc run are left intact
+                    staged_reads: Path = Path(tmp) / "staged_reads.fastq"
+                    shutil.copy(input_long_reads, staged_reads)
+                    filtered_reads: Path = Path(tmp) / "chopper_long_reads.fastq.gz"
+                    filtered_reads.unlink(missing_ok=True)
+                    os.link(staged_reads, filtered_reads)
+                    chopper(staged_reads, tmp, "500", "9", gzip_flag, "2", logdir)
+                    self.assertEqual(
+                        staged_reads.read_bytes(), Path(input_long_reads).read_bytes()
+                    )
+                    with gzip.open(Path(tmp) / "chopper_long_reads.fastq.gz") as f:
+                        self.assertEqual(
+                            f.read(),
+                            Path(test_data, "test_long.fastq").read_bytes(),
+                        )
+
+    def test_get_gzip_command(self):
+        with patch("shutil.which", lambda tool: None):
+            self.assertEqual(get_gzip_command("4", level=1), ["gzip", "-c", "-1"])
+            self.assertEqual(get_gzip_command("4", decompress=True), ["gzip", "-dc"])
+        with patch("shutil.which", lambda tool: f"/bin/{tool}"):
+            self.assertEqual(
+                get_gzip_command("4", level=1), ["pigz", "-p", "4", "-c", "-1"]
+            )
+        with patch(
+            "shutil.which", lambda tool: None if tool == "pigz" else f"/bin/{tool}"
+        ):
+            self.assertEqual(
+                get_gzip_command("4", level=1), ["bgzip", "-@", "4", "-c", "-l", "1"]
+            )
+
+    # the decompression, chopper and compression together stay within the threads
+    def test_split_chopper_threads(self):
+        self.assertEqual(split_chopper_threads("8", True), (4, 2))
+        self.assertEqual(split_chopper_threads("8", False), (6, 2))
+        self.assertEqual(split_chopper_threads("16", True), (8, 4))
+        self.assertEqual(split_chopper_threads("3", True), (1, 1))
+        self.assertEqual(split_chopper_threads("1", False), (1, 1))
+
     def test_fastp_gzip(self):
         expected_return = True
         short_one = Path(f"{test_data}/C11_subsetsim_R1.fastq.gz")
@@ -286,3 +307,18 @@ class TestExternalTools:
             "tool", '-i "escaped in"', '-o "escaped out"', 'params with "escaped arg"'
         )
         assert expected_escaped_command == actual_escaped_command
+
+    def test_run_tool_to_pipe(self, tmp_path):
+        sam: Path = Path(f"{map_dir}/long_read.sam")
+        cat = ExternalTool("cat", "", "", f"{sam}", tmp_path, "")
+        ExternalTool.run_tool_to_pipe(cat, partial(extract_bin_long_fastqs, tmp_path))
+        assert (tmp_path / "plasmid_long.fastq").stat().st_size > 0
+        assert (tmp_path / "chromosome_mapped_long.fastq").stat().st_size > 0
+
+    def test_run_tool_to_pipe_error(self, tmp_path):
+        sam: Path = Path(f"{tmp_path}/missing.sam")
+        cat = ExternalTool("cat", "", "", f"{sam}", tmp_path, "")
+        with pytest.raises(SystemExit):
+            ExternalTool.run_tool_to_pipe(
+                cat, partial(extract_bin_long_fastqs, tmp_path)
+            )
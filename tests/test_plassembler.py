@@ -5,41 +5,85 @@ Usage: pytest
 
 """
 
+import io
+import json
 import os
 import shutil
 import subprocess as sp
 import sys
+import tempfile
+import threading
 import unittest
+from array import array
 from pathlib import Path
+from unittest.mock import patch
 
+import numpy as np
+import pandas as pd
+import pysam
 import pytest
 from loguru import logger
 
 from src.plassembler import begin_plassembler, end_plassembler
-from src.plassembler.utils.concat import (
-    concatenate_short_fastqs,
-    concatenate_single_fasta,
-    concatenate_single_fastq,
+from src.plassembler.utils.batch import (
+    get_batch_workers,
+    read_sample_sheet,
+    run_batch,
+    write_batch_summary,
+)
+from src.plassembler.utils.concat import concatenate_single_fasta
+from src.plassembler.utils.daemon import (
+    PlsdbDaemon,
+    daemon_plsdb_metadata,
+    get_daemon_key,
+    ping_plsdb_daemon,
+    stop_plsdb_daemon,
 )
 from src.plassembler.utils.depth import (
+    DepthAccumulator,
     concatenate_chrom_plasmids,
     get_contig_circularity,
     get_contig_lengths,
-    get_depths_from_bam,
+    get_depths_from_paf,
+    run_depth_branches,
+    split_threads,
+    summarise_depths,
 )
+from src.plassembler.utils.fastq import FastqWriter, encode_qualities, profile_fastq
 
 # import functions
 from src.plassembler.utils.input_commands import (
+    DEPENDENCY_CACHE,
+    FASTQ_PROFILES,
     check_dependencies,
+    get_dependency_versions,
+    get_fastq_profile,
     validate_fasta,
     validate_fastas_assembled_mode,
     validate_fastq,
     validate_fastqs_assembled_mode,
     validate_pacbio_model,
 )
+from src.plassembler.utils.minhash import (
+    build_sketch_index,
+    murmurhash3_x64_64,
+    read_mash_sketch,
+    sketch_fasta,
+)
 from src.plassembler.utils.plass_class import Plass
-from src.plassembler.utils.qc import copy_sr_fastq_file
-from src.plassembler.utils.sam_to_fastq import extract_bin_long_fastqs
+from src.plassembler.utils.plsdb import fetch_plsdb_metadata
+from src.plassembler.utils.qc import copy_sr_fastq_file, get_trimmed_short_reads
+from src.plassembler.utils.run_mash import (
+    calculate_mash_distances,
+    get_mash_tophits,
+    run_native_mash,
+)
+from src.plassembler.utils.sam_to_fastq import (
+    extract_bin_long_fastqs,
+    extract_short_fastqs,
+)
+from src.plassembler.utils.stages import Stage, StageGraph, unicycler_stage
+from src.plassembler.utils.util import stage_file
 
 # data
 test_data = Path("tests/test_data")
@@ -48,6 +92,9 @@ fake_out_dir = Path(f"{test_data}/fake_out_dir")
 bad_dir = Path(f"{test_data}/bad_dir")
 logdir = Path(f"{test_data}/logs")
 map_dir = Path(f"{test_data}/map_dir")
+short_split_dir = Path(f"{test_data}/short_split")
+mash_dir = Path(f"{test_data}/mash_dir")
+plassembler_db_dir = Path(f"{test_data}/Plassembler_Test_DB")
 assembly_class = Path(f"{test_data}/assembly_class")
 
 
@@ -62,6 +109,18 @@ def remove_directory(dir_path):
         shutil.rmtree(dir_path)
 
 
+# batch samples - module level so the workers can unpickle them
+def batch_sample_success(outdir, **kwargs):
+    os.mkdir(outdir)
+    with open(os.path.join(outdir, "plassembler_summary.tsv"), "w") as f:
+        f.write("contig\tlength\n1\t5000\n")
+
+
+def batch_sample_fail(outdir, **kwargs):
+    logger.add(lambda _: sys.exit(1), level="ERROR")
+    logger.error("sample failed")
+
+
 # to ensure sys exit on logger error
 logger.add(lambda _: sys.exit(1), level="ERROR")
 
@@ -86,6 +145,10 @@ class test_plassembler_misc(unittest.TestCase):
         with self.assertRaises(SystemExit):
             begin_plassembler(fake_out_dir, False)
 
+    def test_begin_plassembler_resume(self):
+        begin_plassembler(fake_out_dir, False, True)
+        self.assertTrue(os.path.isdir(fake_out_dir))
+
 
 class test_unicycler_success(unittest.TestCase):
     """Test for validate_pacbio_model"""
@@ -115,6 +178,103 @@ class test_sam_to_fastq_long(unittest.TestCase):
         extract_bin_long_fastqs(map_dir)
         self.assertEqual(expected_return, True)
 
+    # each read is binned once from its group of alignments
+    def test_sam_to_fastq_long_bins(self):
+        extract_bin_long_fastqs(map_dir)
+        bins = {}
+        for fastq in [
+            "plasmid_long.fastq",
+            "chromosome_mapped_long.fastq",
+            "multimap_plasmid_chromosome_long.fastq",
+        ]:
+            with open(Path(map_dir) / fastq) as handle:
+                bins[fastq] = sorted(
+                    line[1:].strip() for line in handle.readlines()[::4]
+                )
+        self.assertEqual(
+            bins["plasmid_long.fastq"],
+            [
+                "read_multimap_plasmid",
+                "read_plasmid_single",
+                "read_plasmid_two",
+                "read_unmapped",
+            ],
+        )
+        self.assertEqual(
+            bins["chromosome_mapped_long.fastq"],
+            ["read_chromosome_single", "read_multimap_chromosome"],
+        )
+        self.assertEqual(
+            bins["multimap_plasmid_chromosome_long.fastq"], ["read_multimap_both"]
+        )
+
+    # depths accumulated while binning match depths from the same alignment
+    def test_sam_to_fastq_long_depths(self):
+        sam_file: Path = Path(f"{map_dir}/long_read.sam")
+        with pysam.AlignmentFile(sam_file, "r") as sam:
+            contig_lengths = dict(zip(sam.references, sam.lengths))
+            expected = DepthAccumulator(contig_lengths)
+            for read in sam.fetch(until_eof=True):
+                expected.add_alignment(read)
+        expected = expected.get_depths()
+        accumulator = DepthAccumulator(contig_lengths)
+        extract_bin_long_fastqs(map_dir, depth_accumulator=accumulator)
+        depths = accumulator.get_depths()
+        for contig in contig_lengths:
+            self.assertEqual(depths[contig].tolist(), expected[contig].tolist())
+        self.assertGreater(int(depths["plasmid_1"].sum()), 0)
+
+
+class test_sam_to_fastq_short(unittest.TestCase):
+    """Test for the single pass short read pair splitter"""
+
+    # pairs are kept if both ends are unmapped or both are on non-chromosome contigs
+    def test_extract_short_fastqs(self):
+        extract_short_fastqs(short_split_dir)
+        names = {}
+        for fastq in ["short_read_concat_R1.fastq", "short_read_concat_R2.fastq"]:
+            with open(Path(short_split_dir) / fastq) as handle:
+                names[fastq] = [line[1:].strip() for line in handle.readlines()[::4]]
+        expected = [
+            "pair_unmapped",
+            "pair_plasmid",
+            "pair_plasmid_mate_unmapped",
+            "pair_plasmid_secondary",
+        ]
+        self.assertEqual(names["short_read_concat_R1.fastq"], expected)
+        self.assertEqual(names["short_read_concat_R2.fastq"], expected)
+
+    # reverse strand reads are written in their sequenced orientation
+    def test_extract_short_fastqs_reverse(self):
+        extract_short_fastqs(short_split_dir)
+        with open(Path(short_split_dir) / "short_read_concat_R2.fastq") as handle:
+            lines = handle.readlines()
+        self.assertEqual(lines[5].strip(), "GTTGCAACGT")
+        self.assertEqual(lines[7].strip(), "HHHHHIIIII")
+
+
+class test_fastq(unittest.TestCase):
+    """Test for fastq.py"""
+
+    def test_encode_qualities(self):
+        quality = array("B", [0, 9, 40, 93])
+        self.assertEqual(encode_qualities(quality), b"!*I~")
+
+    def test_encode_qualities_empty(self):
+        self.assertEqual(encode_qualities(array("B")), b"")
+
+    def test_fastq_writer_batches(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            fastq: Path = Path(tmp) / "batched.fastq"
+            # tiny batches so every record triggers a flush
+            with FastqWriter(fastq, batch_bytes=1) as writer:
+                writer.write(b"read_1", b"ACGT", b"IIII")
+                writer.write(b"read_2", b"GG", b"!!")
+            self.assertEqual(writer.record_count, 2)
+            self.assertEqual(
+                fastq.read_bytes(), b"@read_1\nACGT\n+\nIIII\n@read_2\nGG\n+\n!!\n"
+            )
+
 
 class TestInputCommands(unittest.TestCase):
     """Tests input commands"""
@@ -166,13 +326,13 @@ class TestInputCommands(unittest.TestCase):
 
     # fastq
     def test_validate_fastqs_fasta_as_fastq(self):
-        with self.assertRaises(ValueError):
+        with self.assertRaises(SystemExit):
             fasta = os.path.join(val_data, "test.fasta")
             validate_fastq(fasta)
 
     # assembled fastq
     def test_validate_fastqs_assembled_mode_fasta_as_fastq(self):
-        with self.assertRaises(ValueError):
+        with self.assertRaises(SystemExit):
             fasta = os.path.join(val_data, "test.fasta")
             s1 = os.path.join(val_data, "test_2.fastq.gz")
             s2 = os.path.join(val_data, "test.fastq")
@@ -197,25 +357,586 @@ class TestInputCommands(unittest.TestCase):
             # self.assertEqual(expected_return, True)
 
 
-class test_concat(unittest.TestCase):
-    """Test for concat.py"""
+class test_fastq_profile(unittest.TestCase):
+    """Test for the FASTQ profiling"""
 
-    # concat single
-    def test_concat_single_fastq_bad(self):
+    def test_profile_fastq(self):
+        profile = profile_fastq(Path(test_data) / "test_long.fastq.gz")
+        self.assertEqual(
+            profile,
+            {
+                "gzipped": True,
+                "read_count": 10,
+                "total_bases": 25949,
+                "min_length": 2421,
+                "max_length": 3261,
+                "mean_length": 2594.9,
+                "length_quantiles": {
+                    "10": 2421,
+                    "25": 2446,
+                    "50": 2483,
+                    "75": 2494,
+                    "90": 2921,
+                },
+                "n50": 2487,
+                "mean_quality": 21.69,
+            },
+        )
+        # the same reads uncompressed
+        plain = profile_fastq(Path(test_data) / "test_long.fastq")
+        self.assertFalse(plain.pop("gzipped"))
+        profile.pop("gzipped")
+        self.assertEqual(plain, profile)
+
+    # records split across chunks
+    def test_profile_fastq_chunks(self):
+        fastq = Path(test_data) / "C11_subsetsim_R1.fastq"
+        profile = profile_fastq(fastq)
+        with patch("src.plassembler.utils.fastq.PROFILE_CHUNK_BYTES", 333):
+            self.assertEqual(profile_fastq(fastq), profile)
+
+    # compression is sniffed, not taken from the extension
+    def test_validate_fastq_gzip_magic(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            fastq: Path = Path(tmp) / "reads.fastq"
+            shutil.copy(Path(test_data) / "test_long.fastq.gz", fastq)
+            self.assertTrue(validate_fastq(fastq))
+
+    # multi-line FASTQs with wrapped sequences are parsed by Biopython
+    def test_profile_fastq_wrapped(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            records = (Path(test_data) / "test_long.fastq").read_text().splitlines()
+            fastq: Path = Path(tmp) / "reads.fastq"
+            with open(fastq, "w") as f:
+                for header, sequence, plus, quality in zip(*[iter(records)] * 4):
+                    f.write(f"{header}\n")
+                    for start in range(0, len(sequence), 80):
+                        f.write(f"{sequence[start:start + 80]}\n")
+                    f.write(f"{plus}\n")
+                    for start in range(0, len(quality), 80):
+                        f.write(f"{quality[start:start + 80]}\n")
+            self.assertEqual(
+                profile_fastq(fastq),
+                profile_fastq(Path(test_data) / "test_long.fastq"),
+            )
+
+    def test_profile_fastq_truncated(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            fastq: Path = Path(tmp) / "reads.fastq"
+            fastq.write_bytes(b"@r1\nACGT\n+\nIIII\n@r2\nAC")
+            with self.assertRaises(SystemExit):
+                profile_fastq(fastq)
+
+    # only wrapped records are handed over to Biopython
+    def test_profile_fastq_not_fastq(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            fastq: Path = Path(tmp) / "reads.fastq"
+            fastq.write_bytes(b"@r1\nACGT\n+\nIIII\n>r2\nACGT\n+\nIIII\n")
+            with patch(
+                "src.plassembler.utils.fastq.parse_fastq_lengths"
+            ) as parse_fastq_lengths:
+                with self.assertRaises(SystemExit):
+                    profile_fastq(fastq)
+            parse_fastq_lengths.assert_not_called()
+
+    # the profile is read from the output directory until the input changes
+    def test_get_fastq_profile_cached(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            fastq: Path = Path(tmp) / "reads.fastq"
+            shutil.copy(Path(test_data) / "test_long.fastq", fastq)
+            profile = get_fastq_profile(fastq, tmp)
+            profiles_file: Path = Path(tmp) / FASTQ_PROFILES
+            self.assertTrue(profiles_file.exists())
+            with patch(
+                "src.plassembler.utils.input_commands.profile_fastq"
+            ) as profile_mock:
+                self.assertEqual(get_fastq_profile(fastq, tmp), profile)
+                profile_mock.assert_not_called()
+            os.utime(fastq, ns=(0, 0))
+            self.assertEqual(get_fastq_profile(fastq, tmp), profile)
+            self.assertEqual(
+                json.loads(profiles_file.read_text())[str(fastq.resolve())]["key"][2],
+                0,
+            )
+
+
+# version output of each dependency, and the stream it is printed on
+FAKE_DEPENDENCIES = {
+    "flye": ("--version", "2.9.2-b1786", 1),
+    "raven": ("--version", "1.8.1", 1),
+    "unicycler": ("--version", "Unicycler v0.5.0", 1),
+    "spades.py": ("--version", "SPAdes genome assembler v3.15.5", 1),
+    "minimap2": ("--version", "2.26-r1175", 1),
+    "fastp": ("--version", "fastp 0.23.4", 2),
+    "chopper": ("--version", "chopper 0.7.0", 1),
+    "mash": ("version", "mash version 2.3", 1),
+}
+
+
+class test_dependency_cache(unittest.TestCase):
+    """Test for the cached dependency versions"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.bin_dir: Path = Path(self.tmp.name) / "bin"
+        self.bin_dir.mkdir()
+        self.calls: Path = Path(self.tmp.name) / "calls.txt"
+        for tool in FAKE_DEPENDENCIES:
+            self.write_tool(tool)
+        self.env = patch.dict(
+            os.environ,
+            {
+                "PATH": str(self.bin_dir),
+                "PLASSEMBLER_CACHE_DIR": str(Path(self.tmp.name) / "cache"),
+            },
+        )
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+        self.tmp.cleanup()
+
+    def write_tool(self, tool, output=None):
+        argument, default_output, stream = FAKE_DEPENDENCIES[tool]
+        script: Path = self.bin_dir / tool
+        script.write_text(
+            "#!/bin/sh\n"
+            f"echo {tool} >> {self.calls}\n"
+            f'[ "$1" = "{argument}" ] && echo "{output or default_output}" >&{stream}\n'
+        )
+        script.chmod(0o755)
+
+    def test_dependency_versions_cached(self):
+        versions = get_dependency_versions()
+        self.assertEqual(versions["flye"], "2.9.2-b1786")
+        self.assertEqual(versions["unicycler"], "0.5.0\n")
+        self.assertEqual(versions["spades"], "v3.15.5")
+        self.assertEqual(versions["fastp"], "0.23.4")
+        self.assertEqual(versions["mash"], "2.3")
+        self.assertEqual(len(self.calls.read_text().splitlines()), 8)
+        self.assertTrue((Path(self.tmp.name) / "cache" / DEPENDENCY_CACHE).exists())
+        # nothing is probed again
+        self.assertEqual(get_dependency_versions(), versions)
+        self.assertEqual(len(self.calls.read_text().splitlines()), 8)
+        check_dependencies()
+
+    # a reinstalled binary is probed again
+    def test_dependency_versions_changed(self):
+        get_dependency_versions()
+        self.write_tool("chopper", "chopper 0.8.0")
+        os.utime(self.bin_dir / "chopper", ns=(0, 0))
+        versions = get_dependency_versions()
+        self.assertEqual(versions["chopper"], "0.8.0")
+        self.assertEqual(self.calls.read_text().splitlines()[8:], ["chopper"])
+
+    # missing dependencies are not cached
+    def test_dependency_versions_missing(self):
+        (self.bin_dir / "mash").unlink()
+        self.assertIsNone(get_dependency_versions()["mash"])
+        with self.assertRaises(SystemExit):
+            check_dependencies()
+
+
+# imports the modules in a fresh interpreter
+def import_time(statement):
+    src_dir = Path(__file__).resolve().parent.parent / "src"
+    process = sp.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        env={**os.environ, "PYTHONPATH": str(src_dir)},
+        stderr=sp.PIPE,
+        stdout=sp.PIPE,
+        check=True,
+    )
+    times = {}
+    for line in process.stderr.decode().splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, module = line.split("|")
+            if cumulative.strip().isdigit():
+                times[module.strip()] = int(cumulative)
+    return process.stdout.decode(), times
+
+
+class test_startup(unittest.TestCase):
+    """Test for the CLI startup cost"""
+
+    # the scientific stack is only imported by the commands that use it
+    def test_import_is_light(self):
+        out, _ = import_time(
+            "import sys, plassembler; "
+            "print(sorted(m for m in ['pandas', 'numpy', 'pysam', 'Bio'] if m in sys.modules))"
+        )
+        self.assertEqual(out.strip(), "[]")
+
+    # import time benchmark - a regression would cost at least an import of pandas
+    def test_import_time(self):
+        _, times = import_time("import plassembler, pandas")
+        self.assertLess(times["plassembler"], times["pandas"])
+
+
+class test_stages(unittest.TestCase):
+    """Test for the stage graph scheduler"""
+
+    # stages run after the stages writing their inputs
+    def test_stage_graph_order(self):
+        order = []
+        graph = StageGraph(4)
+        graph.add(
+            Stage("second", lambda threads: order.append("second"), inputs=["a.txt"])
+        )
+        graph.add(
+            Stage("first", lambda threads: order.append("first"), outputs=["a.txt"])
+        )
+        graph.run()
+        self.assertEqual(order, ["first", "second"])
+
+    # independent stages run at the same time - the barrier breaks if they do not
+    def test_stage_graph_concurrent(self):
+        barrier = threading.Barrier(2, timeout=10)
+        graph = StageGraph(2)
+        graph.add(Stage("a", lambda threads: barrier.wait(), threads=1))
+        graph.add(Stage("b", lambda threads: barrier.wait(), threads=1))
+        graph.run()
+
+    # fixed stages take their threads first and scalable stages share the rest
+    def test_stage_graph_threads(self):
+        graph = StageGraph(8)
+        graph.add(Stage("scalable_1", lambda threads: threads))
+        graph.add(Stage("scalable_2", lambda threads: threads))
+        graph.add(Stage("fixed", lambda threads: threads, threads=2))
+        results = graph.run()
+        self.assertEqual(results, {"fixed": 2, "scalable_1": 3, "scalable_2": 3})
+
+    def test_stage_graph_error(self):
+        def stage(threads):
+            raise SystemExit(1)
+
+        graph = StageGraph(2)
+        graph.add(Stage("a", stage))
+        with self.assertRaises(SystemExit):
+            graph.run()
+
+    def test_stage_graph_cycle(self):
+        graph = StageGraph(2)
+        graph.add(Stage("a", print, inputs=["b.txt"], outputs=["a.txt"]))
+        graph.add(Stage("b", print, inputs=["a.txt"], outputs=["b.txt"]))
         with self.assertRaises(ValueError):
-            fasta1: Path = Path(val_data) / "test.fasta"
-            fasta2: Path = Path(val_data) / "test.fasta"
-            out_f: Path = Path(val_data) / "concat.fastq"
-            concatenate_single_fastq(fasta1, fasta2, out_f)
+            graph.run()
 
-    # concat single good
-    def test_concatenate_single_fastq_good(self):
-        f1: Path = Path(val_data) / "test.fastq"
-        f2: Path = Path(val_data) / "test.fastq"
-        out_f = os.path.join(val_data, "fastq")
-        expected_return = True
-        concatenate_single_fastq(f1, f2, out_f)
-        self.assertEqual(expected_return, True)
+    # --resume skips completed stages until their inputs change
+    def test_stage_graph_resume(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            input_file: Path = Path(tmp) / "input.txt"
+            output_file: Path = Path(tmp) / "output.txt"
+            checkpoint_dir: Path = Path(tmp) / "checkpoints"
+            input_file.write_text("reads")
+            calls = []
+
+            def stage(threads):
+                calls.append(threads)
+                output_file.write_text("assembly")
+
+            def run_graph(resume):
+                graph = StageGraph(2, checkpoint_dir, resume)
+                graph.add(
+                    Stage(
+                        "a",
+                        stage,
+                        inputs=[input_file],
+                        outputs=[output_file],
+                        checkpoint=True,
+                    )
+                )
+                graph.run()
+                return graph
+
+            run_graph(False)
+            self.assertEqual(run_graph(True).skipped, {"a"})
+            self.assertEqual(len(calls), 1)
+            # without --resume stages always run
+            run_graph(False)
+            self.assertEqual(len(calls), 2)
+            input_file.write_text("more reads")
+            self.assertEqual(run_graph(True).skipped, set())
+            self.assertEqual(len(calls), 3)
+            # a missing output invalidates the marker
+            output_file.unlink()
+            run_graph(True)
+            self.assertEqual(len(calls), 4)
+
+    # markers are only written once every output exists
+    def test_stage_graph_resume_missing_output(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            checkpoint_dir: Path = Path(tmp) / "checkpoints"
+            graph = StageGraph(2, checkpoint_dir, True)
+            graph.add(
+                Stage(
+                    "a",
+                    lambda threads: None,
+                    outputs=[Path(tmp) / "output.txt"],
+                    checkpoint=True,
+                )
+            )
+            graph.run()
+            self.assertFalse((checkpoint_dir / "a.done").exists())
+
+    # a killed Unicycler (e.g. OOM) stops the run and --resume restarts at Unicycler
+    def test_unicycler_killed_resume(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            outdir: Path = Path(tmp)
+            bin_dir: Path = outdir / "bin"
+            bin_dir.mkdir()
+            unicycler: Path = bin_dir / "unicycler"
+            checkpoint_dir: Path = outdir / "checkpoints"
+            binned = [
+                outdir / "plasmid_long.fastq",
+                outdir / "short_read_concat_R1.fastq",
+                outdir / "short_read_concat_R2.fastq",
+            ]
+            calls = []
+
+            def binning(threads):
+                calls.append("binning")
+                for fastq in binned:
+                    fastq.write_text("@read\nACGT\n+\nIIII\n")
+
+            def run_graph(resume):
+                graph = StageGraph(2, checkpoint_dir, resume)
+                graph.add(Stage("binning", binning, outputs=binned, checkpoint=True))
+                graph.add(unicycler_stage(outdir, outdir / "logs"))
+                graph.run()
+                return graph
+
+            path = f"{bin_dir}{os.pathsep}{os.environ['PATH']}"
+            with patch.dict(os.environ, {"PATH": path}):
+                unicycler.write_text("#!/bin/sh\nkill -9 $$\n")
+                unicycler.chmod(0o755)
+                with self.assertRaises(SystemExit):
+                    run_graph(False)
+                # the intermediates and the checkpoints of the completed stages are kept
+                self.assertTrue(all(fastq.exists() for fastq in binned))
+                self.assertTrue((checkpoint_dir / "binning.done").exists())
+                self.assertFalse((checkpoint_dir / "unicycler.done").exists())
+                unicycler.write_text(
+                    "#!/bin/sh\n"
+                    'while [ "$1" != "-o" ]; do shift; done\n'
+                    'mkdir -p "$2" && echo ">1" > "$2/assembly.fasta"\n'
+                )
+                graph = run_graph(True)
+            self.assertEqual(graph.skipped, {"binning"})
+            self.assertEqual(calls, ["binning"])
+            self.assertTrue((outdir / "unicycler_output" / "assembly.fasta").exists())
+            self.assertTrue((checkpoint_dir / "unicycler.done").exists())
+
+    # other Unicycler failures usually mean no plasmids - the run goes on, but --resume retries Unicycler
+    def test_unicycler_failed_not_checkpointed(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            outdir: Path = Path(tmp)
+            bin_dir: Path = outdir / "bin"
+            bin_dir.mkdir()
+            unicycler: Path = bin_dir / "unicycler"
+            unicycler.write_text(
+                "#!/bin/sh\n"
+                'while [ "$1" != "-o" ]; do shift; done\n'
+                'mkdir -p "$2" && echo ">1" > "$2/assembly.fasta"\n'
+                "exit 1\n"
+            )
+            unicycler.chmod(0o755)
+            for fastq in [
+                "plasmid_long.fastq",
+                "short_read_concat_R1.fastq",
+                "short_read_concat_R2.fastq",
+            ]:
+                (outdir / fastq).write_text("@read\nACGT\n+\nIIII\n")
+            checkpoint_dir: Path = outdir / "checkpoints"
+            path = f"{bin_dir}{os.pathsep}{os.environ['PATH']}"
+            with patch.dict(os.environ, {"PATH": path}):
+                graph = StageGraph(2, checkpoint_dir)
+                graph.add(unicycler_stage(outdir, outdir / "logs"))
+                self.assertEqual(graph.run(), {"unicycler": False})
+            self.assertFalse((checkpoint_dir / "unicycler.done").exists())
+
+
+class test_batch(unittest.TestCase):
+    """Test for the batch command helpers"""
+
+    def test_read_sample_sheet(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            sample_sheet: Path = Path(tmp) / "samples.tsv"
+            sample_sheet.write_text(
+                "sample\tlongreads\tshort_one\tshort_two\n"
+                "hybrid\tl.fastq\tr1.fastq\tr2.fastq\n"
+                "long_only\tl.fastq\t\t\n"
+            )
+            samples = read_sample_sheet(sample_sheet)
+            self.assertEqual(samples["sample"].tolist(), ["hybrid", "long_only"])
+            self.assertEqual(samples["short_one"].tolist(), ["r1.fastq", ""])
+
+    def test_read_sample_sheet_duplicated(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            sample_sheet: Path = Path(tmp) / "samples.tsv"
+            sample_sheet.write_text("sample\tlongreads\na\tl.fastq\na\tl.fastq\n")
+            with self.assertRaises(SystemExit):
+                read_sample_sheet(sample_sheet)
+
+    # the tighter of the thread and memory budgets sets the workers
+    def test_get_batch_workers(self):
+        self.assertEqual(get_batch_workers(10, 32, 8, None, 8), (4, 8))
+        self.assertEqual(get_batch_workers(10, 32, 8, 20, 8), (2, 16))
+        self.assertEqual(get_batch_workers(1, 32, 8, 64, 8), (1, 32))
+        self.assertEqual(get_batch_workers(3, 4, 8, 64, 8), (1, 4))
+
+    # a failed sample does not stop the others
+    def test_run_batch(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            jobs = [
+                (batch_sample_success, "a", {"outdir": os.path.join(tmp, "a")}),
+                (batch_sample_fail, "b", {"outdir": os.path.join(tmp, "b")}),
+            ]
+            statuses = run_batch(jobs, 2)
+            self.assertEqual(
+                [status["status"] for status in statuses], ["success", "failed"]
+            )
+            write_batch_summary(statuses, tmp, "plassembler")
+            status_df = pd.read_csv(Path(tmp) / "batch_status.tsv", sep="\t")
+            self.assertEqual(status_df["sample"].tolist(), ["a", "b"])
+            summary_df = pd.read_csv(Path(tmp) / "batch_summary.tsv", sep="\t")
+            self.assertEqual(list(summary_df.columns), ["sample", "contig", "length"])
+            self.assertEqual(summary_df["sample"].tolist(), ["a"])
+
+
+class test_mash_tophits(unittest.TestCase):
+    """Test for the mash top hit selection"""
+
+    # closest hit per contig, first on ties, blanks for contigs without hits
+    def test_get_mash_tophits(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            mash_tsv: Path = Path(tmp) / "mash.tsv"
+            mash_tsv.write_text(
+                "1\tNC_2\t0.05\t0\t900/1000\n"
+                "3\tNC_3\t0.01\t0\t990/1000\n"
+                "1\tNC_1\t0.01\t0\t980/1000\n"
+                "1\tNC_4\t0.01\t0\t970/1000\n"
+                "5\tNC_5\t0.01\t0\t990/1000\n"
+            )
+            tophits = get_mash_tophits(mash_tsv, 3)
+            self.assertEqual(tophits["contig"].tolist(), [1, 2, 3])
+            self.assertEqual(tophits["PLSDB_hit"].tolist(), ["Yes", "", "Yes"])
+            self.assertEqual(tophits["ACC_NUCCORE"].tolist(), ["NC_1", "", "NC_3"])
+            self.assertEqual(tophits["mash_distance"].tolist(), [0.01, "", 0.01])
+
+    def test_get_mash_tophits_empty(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            mash_tsv: Path = Path(tmp) / "mash.tsv"
+            mash_tsv.write_text("")
+            tophits = get_mash_tophits(mash_tsv, 2)
+            self.assertEqual(tophits["contig"].tolist(), [1, 2])
+            self.assertEqual(tophits["ACC_NUCCORE"].tolist(), ["", ""])
+
+
+class test_minhash(unittest.TestCase):
+    """Test for the in-process mash engine"""
+
+    def test_murmurhash3_x64_64(self):
+        keys = np.frombuffer(b"hello", dtype=np.uint8)[None, :]
+        self.assertEqual(int(murmurhash3_x64_64(keys, 0)[0]), 0xCBD8A7B341BD9B02)
+
+    # the same hashes as mash sketch
+    def test_sketch_fasta(self):
+        plsdb = read_mash_sketch(Path(plassembler_db_dir) / "plsdb.msh")
+        sketch = sketch_fasta(Path(plassembler_db_dir) / "plsdb.fasta")
+        self.assertEqual(plsdb["names"], ["NC_018969.1"])
+        self.assertEqual(plsdb["lengths"], sketch["lengths"])
+        np.testing.assert_array_equal(plsdb["hashes"][0], sketch["hashes"][0])
+
+    # the same mash.tsv as mash dist
+    def test_run_native_mash(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            index_dir: Path = Path(tmp) / "plsdb_sketch"
+            build_sketch_index(Path(plassembler_db_dir) / "plsdb.msh", index_dir)
+            run_native_mash(tmp, Path(mash_dir) / "plasmids.fasta", index_dir)
+            self.assertEqual(
+                (Path(tmp) / "mash.tsv").read_text(),
+                "1\tNC_018969.1\t0.000239895\t0\t990/1000\n",
+            )
+
+
+class test_daemon(unittest.TestCase):
+    """Test for the PLSDB daemon"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_dir: Path = Path(self.tmp.name) / "db"
+        self.db_dir.mkdir()
+        for f in ["plsdb.msh", "plsdb.tsv"]:
+            shutil.copy(Path(plassembler_db_dir) / f, self.db_dir)
+        build_sketch_index(self.db_dir / "plsdb.msh", self.db_dir / "plsdb_sketch")
+        self.socket = str(Path(self.tmp.name) / "plsdb.sock")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def start_daemon(self):
+        daemon = PlsdbDaemon(self.db_dir, self.socket)
+        daemon.load()
+        thread = threading.Thread(target=daemon.serve)
+        thread.start()
+        for _ in range(500):
+            if os.path.exists(get_daemon_key(self.socket)):
+                break
+            threading.Event().wait(0.01)
+        return thread
+
+    # the daemon answers as the local database does
+    def test_daemon_queries(self):
+        thread = self.start_daemon()
+        try:
+            self.assertIsNotNone(ping_plsdb_daemon(self.socket, self.db_dir))
+            calculate_mash_distances(
+                self.tmp.name,
+                Path(mash_dir) / "plasmids.fasta",
+                self.db_dir,
+                Path(self.tmp.name),
+                self.socket,
+            )
+            self.assertEqual(
+                (Path(self.tmp.name) / "mash.tsv").read_text(),
+                "1\tNC_018969.1\t0.000239895\t0\t990/1000\n",
+            )
+            hits = daemon_plsdb_metadata(self.socket, self.db_dir, ["NC_018969.1"])
+            pd.testing.assert_frame_equal(
+                hits.reset_index(drop=True),
+                fetch_plsdb_metadata(self.db_dir, ["NC_018969.1"]).reset_index(
+                    drop=True
+                ),
+            )
+            # another database is not served
+            self.assertIsNone(ping_plsdb_daemon(self.socket, plassembler_db_dir))
+        finally:
+            self.assertTrue(stop_plsdb_daemon(self.socket, self.db_dir))
+            thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertFalse(os.path.exists(self.socket))
+        self.assertFalse(os.path.exists(get_daemon_key(self.socket)))
+
+    # without a daemon the local database is used
+    def test_daemon_fallback(self):
+        self.assertIsNone(ping_plsdb_daemon(self.socket, self.db_dir))
+        self.assertFalse(stop_plsdb_daemon(self.socket, self.db_dir))
+        calculate_mash_distances(
+            self.tmp.name,
+            Path(mash_dir) / "plasmids.fasta",
+            self.db_dir,
+            Path(self.tmp.name),
+            self.socket,
+        )
+        self.assertEqual(
+            (Path(self.tmp.name) / "mash.tsv").read_text(),
+            "1\tNC_018969.1\t0.000239895\t0\t990/1000\n",
+        )
+
+
+class test_concat(unittest.TestCase):
+    """Test for concat.py"""
 
     # concat single good
     def test_concatenate_single_fasta_good(self):
@@ -226,14 +947,80 @@ class test_concat(unittest.TestCase):
         concatenate_single_fasta(f1, f2, out_f)
         self.assertEqual(expected_return, True)
 
-    def test_concatenate_short_fastqs_bad_dir(self):
-        with self.assertRaises(SystemExit):
-            concatenate_short_fastqs(val_data)
+
+class test_stage_file(unittest.TestCase):
+    """Test for staging files without copying them"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.source: Path = Path(self.tmp.name) / "reads.fastq"
+        self.source.write_text("@r1\nACGT\n+\nIIII\n")
+        self.destination: Path = Path(self.tmp.name) / "staged.fastq"
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_stage_file_hardlink(self):
+        self.destination.write_text("old")
+        self.assertEqual(stage_file(self.source, self.destination), "hardlink")
+        self.assertTrue(os.path.samefile(self.source, self.destination))
+        # removing the staged file keeps the source
+        self.destination.unlink()
+        self.assertTrue(self.source.exists())
+
+    # across filesystems
+    def test_stage_file_fallbacks(self):
+        with patch("os.link", side_effect=OSError), patch(
+            "src.plassembler.utils.util.reflink_file", return_value=False
+        ):
+            self.assertEqual(stage_file(self.source, self.destination), "symlink")
+            self.assertEqual(os.readlink(self.destination), str(self.source.resolve()))
+            self.assertEqual(
+                stage_file(self.source, self.destination, allow_symlink=False), "copy"
+            )
+            self.assertFalse(self.destination.is_symlink())
+            self.assertEqual(self.destination.read_text(), self.source.read_text())
 
 
 class test_qc(unittest.TestCase):
     """Test for qc.py"""
 
+    # gzipped short reads are staged without decompressing them, keeping the .gz suffix
+    def test_copy_sr_fastq_file_gzip(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            infile: Path = Path(tmp) / "R1.fastq.gz"
+            shutil.copy(Path(test_data) / "C11_subsetsim_R1.fastq.gz", infile)
+            outfile: Path = Path(tmp) / "trimmed_R1.fastq"
+            # left by an earlier run with plain reads
+            outfile.write_text("stale")
+            staged = copy_sr_fastq_file(infile, outfile)
+            self.assertEqual(staged, Path(tmp) / "trimmed_R1.fastq.gz")
+            self.assertEqual(staged.read_bytes(), infile.read_bytes())
+            self.assertFalse(outfile.exists())
+
+    def test_copy_sr_fastq_file_plain(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            infile: Path = Path(tmp) / "R1.fastq"
+            shutil.copy(Path(val_data) / "test.fastq", infile)
+            outfile: Path = Path(tmp) / "trimmed_R1.fastq"
+            self.assertEqual(copy_sr_fastq_file(infile, outfile), outfile)
+            self.assertEqual(outfile.read_bytes(), infile.read_bytes())
+
+    def test_get_trimmed_short_reads(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.assertEqual(
+                get_trimmed_short_reads(tmp),
+                (Path(tmp) / "trimmed_R1.fastq", Path(tmp) / "trimmed_R2.fastq"),
+            )
+            (Path(tmp) / "trimmed_R1.fastq.gz").touch()
+            self.assertEqual(
+                get_trimmed_short_reads(tmp),
+                (
+                    Path(tmp) / "trimmed_R1.fastq.gz",
+                    Path(tmp) / "trimmed_R2.fastq.gz",
+                ),
+            )
+
     def test_copy_sr_fastq_file_not_fastq(self):
         with self.assertRaises(SystemExit):
             infile: Path = Path(val_data) / "test.fasta"
@@ -274,9 +1061,53 @@ class test_depth(unittest.TestCase):
         with self.assertRaises(FileNotFoundError):
             get_contig_circularity(fasta)
 
-    def test_get_get_depths_from_bam_unsorted_error(self):
-        bam_file: Path = Path(f"{map_dir}/short_read.bam")
-        fasta: Path = Path(f"{map_dir}/combined.fasta")
-        contig_lengths = get_contig_lengths(fasta)
-        with self.assertRaises(sp.CalledProcessError):
-            get_depths_from_bam(bam_file, contig_lengths=contig_lengths)
+    def test_depth_accumulator(self):
+        accumulator = DepthAccumulator({"contig_1": 10}, chunk_size=2)
+        accumulator.add_interval("contig_1", 0, 4)
+        accumulator.add_interval("contig_1", 2, 10)
+        accumulator.add_interval("contig_1", 9, 10)
+        self.assertEqual(
+            accumulator.get_depths()["contig_1"].tolist(),
+            [1, 1, 2, 2, 1, 1, 1, 1, 1, 2],
+        )
+
+    def test_summarise_depths(self):
+        self.assertEqual(summarise_depths([2, 4, 4, 4, 5, 5, 7, 9]), (5.0, 2.14, 4, 5))
+
+    def test_summarise_depths_too_short(self):
+        self.assertEqual(summarise_depths([5]), ("NA", "NA", "NA", "NA"))
+
+    def test_split_threads(self):
+        self.assertEqual(split_threads(32, 2), [16, 16])
+        self.assertEqual(split_threads(5, 2), [3, 2])
+        self.assertEqual(split_threads(1, 2), [1, 1])
+
+    # each branch gets its share of the threads and the results are keyed by branch
+    def test_run_depth_branches(self):
+        depths = run_depth_branches(
+            {"long": lambda threads: threads, "short": lambda threads: -threads}, 7
+        )
+        self.assertEqual(depths, {"long": 4, "short": -3})
+        self.assertEqual(run_depth_branches({}, 4), {})
+
+    def test_run_depth_branches_error(self):
+        def branch(threads):
+            raise SystemExit(1)
+
+        with self.assertRaises(SystemExit):
+            run_depth_branches({"long": branch}, 2)
+
+    # cg:Z: cigars are walked, secondary alignments skipped, spans used without a cigar
+    def test_get_depths_from_paf(self):
+        paf = (
+            b"read_a\t20\t0\t20\t+\tcontig_1\t30\t0\t20\t18\t21\t60"
+            b"\ttp:A:P\tcg:Z:5M2D3M1I10M\n"
+            b"read_b\t10\t0\t10\t+\tcontig_1\t30\t0\t10\t10\t10\t0"
+            b"\ttp:A:S\tcg:Z:10M\n"
+            b"read_c\t5\t0\t5\t-\tcontig_1\t30\t25\t30\t5\t5\t60\ttp:A:P\n"
+        )
+        depths = get_depths_from_paf(io.BytesIO(paf), {"contig_1": 30})
+        self.assertEqual(
+            depths["contig_1"].tolist(),
+            [1] * 5 + [0] * 2 + [1] * 13 + [0] * 5 + [1] * 5,
+        )